@@ -0,0 +1,146 @@
+"""Running aggregates behind the /analytics endpoint.
+
+Every counter is updated in O(1) as tests are added or re-rated, so reading
+the analytics summary costs the same no matter how many tests are stored.
+"""
+import json
+
+# Shown by the dashboard until a frequency response test has been run
+DEFAULT_FREQUENCY_DATA = {
+    "labels": ["100Hz", "500Hz", "1kHz", "5kHz", "10kHz", "15kHz"],
+    "average_response": [0.8, 0.85, 0.9, 0.85, 0.8, 0.7]
+}
+
+
+def frequency_sort_key(label):
+    return float(label) if label.replace('.', '').isdigit() else 0
+
+
+def parse_rating(rating):
+    """The 1-5 star rating in rating (an integer or a numeric string); raises ValueError for anything else"""
+    try:
+        value = int(rating)
+        valid = not isinstance(rating, bool) and float(rating) == value and 1 <= value <= 5
+    except (TypeError, ValueError, OverflowError):
+        valid = False
+    if not valid:
+        raise ValueError("rating must be an integer from 1 to 5")
+    return value
+
+
+def _rating_bucket(rating):
+    """Index into the 1-5 star histogram, or None for missing/invalid ratings"""
+    if rating is None:
+        return None
+    try:
+        rating = int(rating)
+    except (TypeError, ValueError):
+        return None
+    return rating - 1 if 1 <= rating <= 5 else None
+
+
+class RunningAggregates:
+    def __init__(self):
+        self.total_tests = 0
+        self.score_sum = 0.0
+        self.score_count = 0
+        self.test_types = {}  # test_type -> count
+        self.speaker_models = {}  # speaker_model -> count
+        self.model_score_sum = {}
+        self.model_score_count = {}
+        self.freq_sum = {}  # frequency label -> summed response
+        self.freq_count = {}
+        self.ratings_distribution = [0, 0, 0, 0, 0]
+        self._freq_labels = []  # kept sorted as new labels appear
+
+    def add(self, test):
+        self.total_tests += 1
+
+        test_type = test.get("test_type", "unknown")
+        self.test_types[test_type] = self.test_types.get(test_type, 0) + 1
+
+        model = test.get("speaker_model", "Unknown")
+        self.speaker_models[model] = self.speaker_models.get(model, 0) + 1
+
+        score = test.get("score")
+        if score is not None:
+            self.score_sum += score
+            self.score_count += 1
+            self.model_score_sum[model] = self.model_score_sum.get(model, 0) + score
+            self.model_score_count[model] = self.model_score_count.get(model, 0) + 1
+
+        if test_type == "frequency_response" and test.get("additional_data"):
+            self._add_frequency_response(test["additional_data"])
+
+        bucket = _rating_bucket(test.get("user_rating"))
+        if bucket is not None:
+            self.ratings_distribution[bucket] += 1
+
+    def _add_frequency_response(self, additional_data):
+        try:
+            points = [(freq, float(response)) for freq, response in json.loads(additional_data).items()]
+        except (ValueError, TypeError, AttributeError):
+            return
+
+        for freq, response in points:
+            if freq not in self.freq_count:
+                self.freq_count[freq] = 0
+                self.freq_sum[freq] = 0
+                self._freq_labels.append(freq)
+                self._freq_labels.sort(key=frequency_sort_key)
+            self.freq_count[freq] += 1
+            self.freq_sum[freq] += response
+
+    def score_changed(self, speaker_model, old_score, new_score):
+        if old_score is not None:
+            self.score_sum -= old_score
+            self.score_count -= 1
+            self.model_score_sum[speaker_model] -= old_score
+            self.model_score_count[speaker_model] -= 1
+            if not self.model_score_count[speaker_model]:
+                del self.model_score_sum[speaker_model], self.model_score_count[speaker_model]
+        if new_score is not None:
+            self.score_sum += new_score
+            self.score_count += 1
+            self.model_score_sum[speaker_model] = self.model_score_sum.get(speaker_model, 0) + new_score
+            self.model_score_count[speaker_model] = self.model_score_count.get(speaker_model, 0) + 1
+
+    def rating_changed(self, old_rating, new_rating):
+        old_bucket = _rating_bucket(old_rating)
+        if old_bucket is not None:
+            self.ratings_distribution[old_bucket] -= 1
+        new_bucket = _rating_bucket(new_rating)
+        if new_bucket is not None:
+            self.ratings_distribution[new_bucket] += 1
+
+    def summary(self):
+        """Return the /analytics payload"""
+        if not self.total_tests:
+            return {
+                "total_tests": 0,
+                "average_score": 0,
+                "test_types": {},
+                "speaker_models": {},
+                "average_scores_by_model": {},
+                "frequency_data": dict(DEFAULT_FREQUENCY_DATA),
+                "ratings_distribution": [0, 0, 0, 0, 0]
+            }
+
+        if self._freq_labels:
+            frequency_data = {
+                "labels": list(self._freq_labels),
+                "average_response": [self.freq_sum[f] / self.freq_count[f] for f in self._freq_labels]
+            }
+        else:
+            frequency_data = dict(DEFAULT_FREQUENCY_DATA)
+
+        return {
+            "total_tests": self.total_tests,
+            "average_score": float(self.score_sum / self.score_count) if self.score_count else 0.0,
+            "test_types": dict(self.test_types),
+            "speaker_models": dict(self.speaker_models),
+            "average_scores_by_model": {model: self.model_score_sum[model] / count
+                                        for model, count in self.model_score_count.items()},
+            "frequency_data": frequency_data,
+            "ratings_distribution": list(self.ratings_distribution)
+        }
@@ -0,0 +1,142 @@
+"""Process pool for CPU-heavy capture analysis.
+
+Measurements run ``TestType.run`` in worker processes so a long FFT analysis
+never holds a Flask worker thread (or the GIL) while lightweight routes are
+being served. Capture samples are copied once into a shared memory block and
+attached by the worker, instead of being pickled through the pool's pipe.
+The number of queued and running analyses is bounded; past that, submit()
+raises ExecutorBusy and the route answers 503. A pool broken by a dying
+worker fails the analyses it was running and is replaced by a fresh one.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+
+class ExecutorBusy(Exception):
+    """Raised when the analysis queue is full"""
+
+
+def _analyze(test_type_name, params, shm_name, shape, dtype, sample_rate):
+    """Worker side: attach the capture and run the test type's measurement"""
+    import numpy as np
+    from registry import TEST_TYPES
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        recording = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        try:
+            return TEST_TYPES[test_type_name].run(params, (sample_rate, recording))
+        finally:
+            del recording  # the buffer cannot be closed while a view is alive
+    finally:
+        shm.close()
+
+
+def _to_shared_memory(samples):
+    import numpy as np
+
+    shm = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+    view = np.ndarray(samples.shape, dtype=samples.dtype, buffer=shm.buf)
+    view[...] = samples
+    del view
+    return shm
+
+
+def _release(shm):
+    shm.close()
+    shm.unlink()
+
+
+def mp_context():
+    """Start workers from a clean server process rather than forking a multi-threaded one"""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class AnalysisExecutor:
+    """Runs test type measurements in a lazily started process pool.
+
+    With workers=0 analyses run inline in the calling thread, for
+    deployments that cannot start processes (e.g. serverless functions).
+    """
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or 4 * max(self.workers, 1)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=mp_context())
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a pool broken by a dead worker, so the next analysis starts a new one"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _submit(self, *args):
+        pool = self._get_pool()
+        try:
+            return pool, pool.submit(*args)
+        except BrokenProcessPool:
+            # A worker died since the last analysis: retry once on a fresh pool
+            self._discard_pool(pool)
+            pool = self._get_pool()
+            return pool, pool.submit(*args)
+
+    def submit(self, test_type, params, capture, block=False):
+        """Future of test_type.run(params, capture).
+
+        Raises ExecutorBusy if max_pending analyses are in flight, unless
+        block is set, in which case it waits for a slot instead.
+        """
+        if not self._slots.acquire(blocking=block):
+            raise ExecutorBusy(f"Analysis queue is full ({self.max_pending} pending)")
+
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(test_type.run(params, capture))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+            return future
+
+        import numpy as np
+
+        sample_rate, recording = capture
+        recording = np.ascontiguousarray(recording)
+        shm = None
+        try:
+            shm = _to_shared_memory(recording)
+            pool, future = self._submit(_analyze, test_type.name, params, shm.name,
+                                        recording.shape, recording.dtype.str, sample_rate)
+        except BaseException:
+            if shm is not None:
+                _release(shm)
+            self._slots.release()
+            raise
+
+        def finished(done):
+            _release(shm)
+            self._slots.release()
+            if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+                self._discard_pool(pool)
+        future.add_done_callback(finished)
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
@@ -0,0 +1,652 @@
+"""Vectorized analytics over an array view of the stored tests.
+
+The engine keeps one row per test in typed NumPy columns (model and test type
+as integer codes, score, rating, historical flag) and expands frequency
+response JSON into a wide numeric matrix once, at ingest. Group-by means,
+counts and histograms are then a handful of ``np.bincount`` calls instead of
+Python loops over dicts. The speaker leaderboard goes further and keeps its
+per-model, per-type sums current on every write.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from aggregates import DEFAULT_FREQUENCY_DATA, frequency_sort_key, parse_rating
+from similarity import SimilarityIndex
+from trends import TrendRollups, parse_epoch
+
+
+class Column:
+    """Append-only NumPy array that grows by doubling"""
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self._data):
+            grown = np.empty(len(self._data) * 2, dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self._data):
+            capacity = len(self._data)
+            while capacity < end:
+                capacity *= 2
+            grown = np.empty(capacity, dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:end] = values
+        self.size = end
+
+    @property
+    def values(self):
+        return self._data[:self.size]
+
+    def __getitem__(self, row):
+        return self._data[row]
+
+    def __setitem__(self, row, value):
+        self._data[row] = value
+
+    def frozen(self):
+        """The rows appended so far, as a column sharing this one's array.
+
+        Appends land past its end, so it can be read, e.g. by a snapshot
+        writer, while appends continue; rows updated in place are not frozen.
+        """
+        column = Column.__new__(Column)
+        column._data = self._data
+        column.size = self.size
+        return column
+
+    @classmethod
+    def from_array(cls, values, size=None):
+        """Column holding the first `size` (default: all) of values, which it keeps using until it has to grow"""
+        column = cls(values.dtype)
+        if len(values):
+            column._data = values
+            column.size = len(values) if size is None else size
+        return column
+
+
+class StringTable:
+    """Dictionary encoding of repeated strings into integer codes"""
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        """Return the code for value, or None if it was never stored"""
+        return self._codes.get(value)
+
+    @classmethod
+    def from_values(cls, values):
+        table = cls()
+        table.values = list(values)
+        table._codes = {value: code for code, value in enumerate(table.values)}
+        return table
+
+    def __len__(self):
+        return len(self.values)
+
+
+class FrequencyMatrix:
+    """Frequency response results as a (tests x frequency bins) matrix, NaN where a bin was not measured"""
+    def __init__(self):
+        self.labels = []
+        self._columns = {}  # frequency label -> matrix column
+        self._values = np.full((64, 0), np.nan)
+        self.rows = Column(np.int64)  # engine row of each matrix row
+
+    def add(self, row, additional_data):
+        try:
+            points = [(freq, float(response)) for freq, response in json.loads(additional_data).items()]
+        except (ValueError, TypeError, AttributeError):
+            return
+
+        for freq, _ in points:
+            if freq not in self._columns:
+                self._columns[freq] = len(self.labels)
+                self.labels.append(freq)
+                self._values = np.hstack([self._values, np.full((len(self._values), 1), np.nan)])
+
+        n = self.rows.size
+        if n == len(self._values):
+            grown = np.full((n * 2, len(self.labels)), np.nan)
+            grown[:n] = self._values
+            self._values = grown
+        for freq, response in points:
+            self._values[n, self._columns[freq]] = response
+        self.rows.append(row)
+
+    def average(self, row_mask):
+        """Mean response per frequency label over the engine rows selected by row_mask"""
+        values = self._values[:self.rows.size][row_mask[self.rows.values]]
+        counts = np.count_nonzero(~np.isnan(values), axis=0)
+        sums = np.nansum(values, axis=0)
+        measured = [(label, sums[i] / counts[i]) for i, label in enumerate(self.labels) if counts[i]]
+        measured.sort(key=lambda item: frequency_sort_key(item[0]))
+        return [label for label, _ in measured], [float(avg) for _, avg in measured]
+
+    def state(self):
+        """Arrays and labels for a snapshot; rows already added are never written again, so no copy is needed"""
+        return {"labels": list(self.labels), "values": self._values[:self.rows.size], "rows": self.rows.frozen()}
+
+    @classmethod
+    def from_state(cls, state):
+        matrix = cls()
+        matrix.labels = list(state["labels"])
+        matrix._columns = {label: i for i, label in enumerate(matrix.labels)}
+        matrix.rows = state["rows"]
+        if len(state["values"]):
+            matrix._values = state["values"]
+        else:
+            matrix._values = np.full((64, len(matrix.labels)), np.nan)
+        return matrix
+
+
+# Ranked results the leaderboard remembers, one per (test type set, limit)
+LEADERBOARD_CACHE_SIZE = 64
+
+# Personalized rankings add PREFERENCE_BONUS of a model's score in each of a
+# user's PREFERRED_TYPES most-tested test types to its average score
+PREFERRED_TYPES = 3
+PREFERENCE_BONUS = 0.05
+
+# Users ranked per matrix product by personalized_rankings
+USER_BLOCK = 1024
+
+# Engine epoch of tests whose timestamp could not be parsed
+NO_EPOCH = np.iinfo(np.int64).min
+
+
+def _grown(array, rows, columns):
+    """array zero-padded to at least (rows, columns), doubling each dimension as needed"""
+    height, width = array.shape
+    if rows <= height and columns <= width:
+        return array
+    while height < rows:
+        height *= 2
+    while width < columns:
+        width *= 2
+    grown = np.zeros((height, width), dtype=array.dtype)
+    grown[:array.shape[0], :array.shape[1]] = array
+    return grown
+
+
+def _encode(table, names, index):
+    """Codes in table of names[index], encoding only the names that occur"""
+    codes = np.zeros(len(names), dtype=np.int32)
+    for i in np.flatnonzero(np.bincount(index, minlength=len(names))):
+        codes[i] = table.encode(names[i])
+    return codes[index]
+
+
+def _best(values, tie_keys, limit):
+    """Positions of the `limit` (None: all) largest values, best first; ties are ordered by tie_keys as for np.lexsort"""
+    positions = np.arange(len(values))
+    if limit is None:
+        limit = len(values)
+    elif 0 < limit < len(values):
+        # Keep the top `limit` values, plus any ties with the last of them
+        top = np.argpartition(-values, limit - 1)[:limit]
+        positions = np.flatnonzero(values >= values[top].min())
+    order = np.lexsort(tuple(key[positions] for key in tie_keys) + (-values[positions],))
+    return positions[order][:max(limit, 0)]
+
+
+def preference_matrix(type_counts, type_names):
+    """Users x test types indicator of each user's PREFERRED_TYPES most-tested types (ties in name order)"""
+    preferences = np.zeros(type_counts.shape)
+    name_order = np.broadcast_to(np.argsort(np.argsort(type_names[:type_counts.shape[1]])), type_counts.shape)
+    top = np.lexsort((name_order, -type_counts), axis=1)[:, :PREFERRED_TYPES]
+    preferences[np.arange(len(type_counts))[:, None], top] = 1
+    preferences[type_counts == 0] = 0
+    return preferences
+
+
+def personalized_rankings(model_names, type_names, pair_sum, pair_count, type_counts, columns, limit=5):
+    """Top models for each user, from (models x types) score sums and counts and (users x types) test counts.
+
+    Models are ranked on the test types in `columns`. A model's personalized
+    score is its average plus PREFERENCE_BONUS of its score in each of the
+    user's preferred types, computed for every model and a block of users as
+    one matrix product. Users without tests get no ranking.
+    """
+    pair_sum, pair_count = pair_sum[:, columns], pair_count[:, columns]
+    model_sum = pair_sum.sum(axis=1)
+    model_count = pair_count.sum(axis=1)
+    ranked = np.flatnonzero(model_count)
+    averages = model_sum[ranked] / model_count[ranked]
+    tested = pair_count[ranked] > 0
+    type_scores = np.divide(pair_sum[ranked], pair_count[ranked], out=np.zeros(tested.shape), where=tested)
+
+    results = []
+    for start in range(0, len(type_counts), USER_BLOCK):
+        counts = type_counts[start:start + USER_BLOCK]
+        preferences = preference_matrix(counts, type_names)[:, columns]
+        personalized = np.minimum(100, averages[:, None] + PREFERENCE_BONUS * (type_scores @ preferences.T))
+        for user, has_tests in enumerate(counts.any(axis=1)):
+            if not has_tests:
+                results.append([])
+                continue
+            preferred = np.flatnonzero(preferences[user])
+            scores = personalized[:, user]
+            results.append([{
+                "model": model_names[ranked[i]],
+                "base_score": float(averages[i]),
+                "personalized_score": float(scores[i]),
+                "test_count": int(model_count[ranked[i]]),
+                "preferred_type_scores": {type_names[columns[t]]: float(type_scores[i, t])
+                                          for t in preferred if tested[i, t]}
+            } for i in _best(scores, (ranked, -averages), limit)])
+    return results
+
+
+class UserProfiles:
+    """How many tests of each type every user has run, counted as tests are stored"""
+    def __init__(self, types):
+        self.types = types
+        self.users = StringTable()
+        self._counts = np.zeros((64, 16), dtype=np.int64)
+
+    def encode(self, user_id):
+        return self.users.encode(user_id)
+
+    def add(self, user, test_type):
+        """Count one test of type code test_type for user code user (see encode)"""
+        self._counts = _grown(self._counts, user + 1, test_type + 1)
+        self._counts[user, test_type] += 1
+
+    def add_many(self, user_ids, user_index, test_types):
+        """Count a batch of tests, test i by user user_ids[user_index[i]] of type code test_types[i]"""
+        users = _encode(self.users, user_ids, user_index).astype(np.intp)
+        self._counts = _grown(self._counts, len(self.users), len(self.types))
+        shape = (len(self.users), len(self.types))
+        self._counts[:shape[0], :shape[1]] += np.bincount(
+            users * shape[1] + test_types, minlength=shape[0] * shape[1]).reshape(shape)
+
+    def type_counts(self, user_ids):
+        """(users x test types) test counts of user_ids, zero for users without tests"""
+        counts = np.zeros((len(user_ids), len(self.types)), dtype=np.int64)
+        codes = [self.users.lookup(user_id) for user_id in user_ids]
+        known = [i for i, code in enumerate(codes) if code is not None]
+        if known:
+            counts[known] = self._counts[[codes[i] for i in known], :len(self.types)]
+        return counts
+
+    def state(self):
+        return {"users": list(self.users.values), "counts": self._counts[:len(self.users), :len(self.types)].copy()}
+
+    @classmethod
+    def from_state(cls, types, state):
+        profiles = cls(types)
+        profiles.users = StringTable.from_values(state["users"])
+        profiles._counts = _grown(profiles._counts, *state["counts"].shape)
+        profiles._counts[:state["counts"].shape[0], :state["counts"].shape[1]] = state["counts"]
+        return profiles
+
+
+class Leaderboard:
+    """Score sums and counts per (speaker model, test type), updated on every write.
+
+    Ranking the models for any set of test types reduces the selected
+    columns of the matrix and partially sorts the averages, so a query costs
+    O(models x types) however many tests are stored. Recent results are kept
+    in an LRU cache; a write only evicts the entries whose type set includes
+    the written test's type.
+    """
+    def __init__(self, models, types, cache_size=LEADERBOARD_CACHE_SIZE):
+        self.models = models
+        self.types = types
+        self._sum = np.zeros((16, 16))
+        self._count = np.zeros((16, 16), dtype=np.int64)
+        self._cache = OrderedDict()  # (frozenset of test types or None, limit) -> results
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._writes = 0  # bumped by every write, so a result ranked during one is not cached
+
+    def change(self, model, test_type, old_score, new_score):
+        """Move one test of (model code, type code) from old_score to new_score; NaN means unscored"""
+        self._sum = _grown(self._sum, model + 1, test_type + 1)
+        self._count = _grown(self._count, model + 1, test_type + 1)
+        if old_score == old_score:
+            self._sum[model, test_type] -= old_score
+            self._count[model, test_type] -= 1
+        if new_score == new_score:
+            self._sum[model, test_type] += new_score
+            self._count[model, test_type] += 1
+        self._invalidate(self.types.values[test_type])
+
+    def add_many(self, models, test_types, scores):
+        """Count a batch of tests of (model code, type code); NaN scores are unscored"""
+        shape = (len(self.models), len(self.types))
+        self._sum = _grown(self._sum, *shape)
+        self._count = _grown(self._count, *shape)
+        scored = ~np.isnan(scores)
+        cells = models[scored].astype(np.intp) * shape[1] + test_types[scored]
+        size = shape[0] * shape[1]
+        self._sum[:shape[0], :shape[1]] += np.bincount(cells, weights=scores[scored], minlength=size).reshape(shape)
+        self._count[:shape[0], :shape[1]] += np.bincount(cells, minlength=size).reshape(shape)
+        with self._lock:
+            self._writes += 1
+            self._cache.clear()
+
+    def _invalidate(self, test_type):
+        with self._lock:
+            self._writes += 1
+            stale = [key for key in self._cache if key[0] is None or test_type in key[0]]
+            for key in stale:
+                del self._cache[key]
+
+    def best_speakers(self, test_types=None, limit=5):
+        """Top `limit` models (None: all of them) by average score over test_types (default: all).
+
+        The result may be shared with other callers and must not be modified.
+        """
+        key = (frozenset(test_types) if test_types else None, limit)
+        with self._lock:
+            results = self._cache.get(key)
+            if results is not None:
+                self._cache.move_to_end(key)
+                return results
+            writes = self._writes
+
+        results = self._rank(test_types, limit)
+        with self._lock:
+            if writes == self._writes:
+                self._cache[key] = results
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def _columns(self, test_types):
+        """Type codes of test_types (default: every type), ignoring types never stored"""
+        if not test_types:
+            return np.arange(len(self.types))
+        return np.unique([c for c in map(self.types.lookup, test_types) if c is not None]).astype(np.intp)
+
+    def _rank(self, test_types, limit):
+        n_models, n_types = len(self.models), len(self.types)
+        columns = self._columns(test_types)
+        pair_sum = self._sum[:n_models, columns]
+        pair_count = self._count[:n_models, columns]
+        model_sum = pair_sum.sum(axis=1)
+        model_count = pair_count.sum(axis=1)
+
+        ranked = np.flatnonzero(model_count)
+        averages = model_sum[ranked] / model_count[ranked]
+        # Best average first, ties in the order the models were first stored
+        ranked = ranked[_best(averages, (ranked,), limit)]
+
+        results = []
+        for model in ranked:
+            tested = np.flatnonzero(pair_count[model])
+            results.append({
+                "model": self.models.values[model],
+                "average_score": float(model_sum[model] / model_count[model]),
+                "test_count": int(model_count[model]),
+                "scores_by_type": {self.types.values[columns[t]]: float(pair_sum[model, t] / pair_count[model, t])
+                                   for t in tested}
+            })
+        return results
+
+    def personalized(self, type_counts, test_types=None, limit=5):
+        """personalized_rankings over the stored scores for users with the given (users x types) test counts"""
+        n_models, n_types = len(self.models), len(self.types)
+        return personalized_rankings(self.models.values, self.types.values, self._sum[:n_models, :n_types],
+                                     self._count[:n_models, :n_types], type_counts, self._columns(test_types), limit)
+
+    def state(self):
+        n_models, n_types = len(self.models), len(self.types)
+        return {"sum": self._sum[:n_models, :n_types].copy(), "count": self._count[:n_models, :n_types].copy()}
+
+    @classmethod
+    def from_state(cls, models, types, state):
+        leaderboard = cls(models, types)
+        shape = state["sum"].shape
+        leaderboard._sum = _grown(leaderboard._sum, *shape)
+        leaderboard._count = _grown(leaderboard._count, *shape)
+        leaderboard._sum[:shape[0], :shape[1]] = state["sum"]
+        leaderboard._count[:shape[0], :shape[1]] = state["count"]
+        return leaderboard
+
+
+class AnalyticsEngine:
+    def __init__(self):
+        self.models = StringTable()
+        self.types = StringTable()
+        self.model_code = Column(np.int32)
+        self.type_code = Column(np.int32)
+        self.score = Column(np.float64)  # NaN when missing
+        self.user_rating = Column(np.int8)  # 0 when unrated
+        self.historical = Column(np.bool_)
+        self.epoch = Column(np.int64)  # seconds; NO_EPOCH when the timestamp does not parse
+        self.frequency = FrequencyMatrix()
+        self.leaderboard = Leaderboard(self.models, self.types)
+        self.similarity = SimilarityIndex()
+        self.profiles = UserProfiles(self.types)
+        self.trends = TrendRollups()
+
+    def __len__(self):
+        return self.model_code.size
+
+    def state(self):
+        """Everything the engine holds, for a snapshot taken while writes continue.
+
+        Appended rows never change, so those columns are frozen rather than
+        copied; scores and ratings are updated in place and are copied.
+        """
+        return {
+            "models": list(self.models.values),
+            "types": list(self.types.values),
+            "model_code": self.model_code.frozen(),
+            "type_code": self.type_code.frozen(),
+            "score": Column.from_array(self.score.values.copy()),
+            "user_rating": Column.from_array(self.user_rating.values.copy()),
+            "historical": self.historical.frozen(),
+            "epoch": self.epoch.frozen(),
+            "frequency": self.frequency.state(),
+            "leaderboard": self.leaderboard.state(),
+            "similarity": self.similarity.state(),
+            "profiles": self.profiles.state(),
+            "trends": self.trends.state()
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Engine restored from state(); its columns and arrays are used as they are, memory maps included"""
+        engine = cls()
+        engine.models = StringTable.from_values(state["models"])
+        engine.types = StringTable.from_values(state["types"])
+        for name in ("model_code", "type_code", "score", "user_rating", "historical", "epoch"):
+            setattr(engine, name, state[name])
+        engine.frequency = FrequencyMatrix.from_state(state["frequency"])
+        engine.leaderboard = Leaderboard.from_state(engine.models, engine.types, state["leaderboard"])
+        engine.similarity = SimilarityIndex.from_state(state["similarity"])
+        engine.profiles = UserProfiles.from_state(engine.types, state["profiles"])
+        engine.trends = TrendRollups.from_state(state["trends"])
+        return engine
+
+    def add(self, test, historical=False):
+        """Append a test and return its engine row; raises ValueError, appending nothing, for an invalid field"""
+        row = self.model_code.size
+        speaker_model = test.get("speaker_model", "Unknown")
+        test_type = test.get("test_type", "unknown")
+        user_id = test.get("user_id")
+        # Validate and encode every field first, so a bad one leaves the engine as it was
+        if not (isinstance(speaker_model, str) and isinstance(test_type, str)
+                and isinstance(user_id, (str, type(None)))):
+            raise ValueError("A test's speaker_model, test_type and user_id must be strings")
+        rating = encode_rating(test.get("user_rating"))
+        try:
+            score = np.nan if test.get("score") is None else float(test["score"])
+        except TypeError:
+            raise ValueError("A test's score must be a number")
+        try:
+            epoch = parse_epoch(test.get("timestamp"))
+        except (TypeError, ValueError):
+            epoch = None
+        model = self.models.encode(speaker_model)
+        code = self.types.encode(test_type)
+        user = None if user_id is None else self.profiles.encode(user_id)
+
+        self.model_code.append(model)
+        self.type_code.append(code)
+        self.score.append(score)
+        self.user_rating.append(rating)
+        self.historical.append(historical)
+        self.leaderboard.change(model, code, np.nan, score)
+        self.epoch.append(NO_EPOCH if epoch is None else epoch)
+        if epoch is not None:
+            self.trends.add(self.models.values[self.model_code[row]], test_type, historical, epoch, score)
+        if user is not None:
+            self.profiles.add(user, code)
+
+        if test_type == "frequency_response" and test.get("additional_data"):
+            self.frequency.add(row, test["additional_data"])
+        self.similarity.add(self.models.values[self.model_code[row]], test_type, test.get("additional_data"))
+        return row
+
+    def extend(self, speaker_models, test_types, model_index, type_index, score, user_rating, epoch,
+               historical=False, user_ids=None, user_index=None):
+        """Append a batch of tests given as columns and return the engine row of the first.
+
+        model_index and type_index index into the speaker_models and
+        test_types names, user_index (if given) into user_ids; user_rating is
+        encoded as by encode_rating and epoch is in seconds. The tests carry
+        no frequency or band response data.
+        """
+        row = len(self)
+        models = _encode(self.models, speaker_models, model_index)
+        types = _encode(self.types, test_types, type_index)
+        self.model_code.extend(models)
+        self.type_code.extend(types)
+        self.score.extend(score)
+        self.user_rating.extend(user_rating)
+        self.historical.extend(np.full(len(models), historical))
+        self.epoch.extend(epoch)
+        self.leaderboard.add_many(models, types, np.asarray(score, dtype=np.float64))
+        self.trends.add_many(speaker_models, test_types, historical, model_index, type_index, epoch, score)
+        if user_ids is not None:
+            self.profiles.add_many(user_ids, user_index, types)
+        return row
+
+    def set_rating(self, row, rating):
+        self.user_rating[row] = encode_rating(rating)
+
+    def set_score(self, row, score):
+        score = np.nan if score is None else score
+        self.leaderboard.change(self.model_code[row], self.type_code[row], self.score[row], score)
+        if self.epoch[row] != NO_EPOCH:
+            self.trends.change_score(self.models.values[self.model_code[row]], self.types.values[self.type_code[row]],
+                                     bool(self.historical[row]), int(self.epoch[row]), self.score[row], score)
+        self.score[row] = score
+
+    def rows_matching(self, speaker_model=None, test_type=None, include_historical=False):
+        """Boolean mask of rows matching the filters, or None if nothing can match"""
+        mask = np.ones(len(self), dtype=bool) if include_historical else ~self.historical.values
+        for table, column, value in ((self.models, self.model_code, speaker_model),
+                                     (self.types, self.type_code, test_type)):
+            if value is None:
+                continue
+            code = table.lookup(value)
+            if code is None:
+                return None
+            mask &= column.values == code
+        return mask
+
+    def summary(self, speaker_model=None, include_historical=False):
+        """Return the /analytics payload for the matching tests"""
+        mask = self.rows_matching(speaker_model, include_historical=include_historical)
+        total = 0 if mask is None else int(np.count_nonzero(mask))
+        if not total:
+            return {
+                "total_tests": 0,
+                "average_score": 0,
+                "test_types": {},
+                "speaker_models": {},
+                "average_scores_by_model": {},
+                "frequency_data": dict(DEFAULT_FREQUENCY_DATA),
+                "ratings_distribution": [0, 0, 0, 0, 0]
+            }
+
+        models = self.model_code.values[mask]
+        types = self.type_code.values[mask]
+        scores = self.score.values[mask]
+        ratings = self.user_rating.values[mask]
+        scored = ~np.isnan(scores)
+
+        type_counts = np.bincount(types, minlength=len(self.types))
+        model_counts = np.bincount(models, minlength=len(self.models))
+        model_sum = np.bincount(models[scored], weights=scores[scored], minlength=len(self.models))
+        model_scored = np.bincount(models[scored], minlength=len(self.models))
+
+        rated = (ratings >= 1) & (ratings <= 5)
+        ratings_dist = np.bincount(ratings[rated] - 1, minlength=5)
+
+        labels, average_response = self.frequency.average(mask)
+        if labels:
+            frequency_data = {"labels": labels, "average_response": average_response}
+        else:
+            frequency_data = dict(DEFAULT_FREQUENCY_DATA)
+
+        return {
+            "total_tests": total,
+            "average_score": float(scores[scored].mean()) if scored.any() else 0.0,
+            "test_types": {self.types.values[t]: int(type_counts[t]) for t in np.flatnonzero(type_counts)},
+            "speaker_models": {self.models.values[m]: int(model_counts[m]) for m in np.flatnonzero(model_counts)},
+            "average_scores_by_model": {self.models.values[m]: float(model_sum[m] / model_scored[m])
+                                        for m in np.flatnonzero(model_scored)},
+            "frequency_data": frequency_data,
+            "ratings_distribution": [int(count) for count in ratings_dist]
+        }
+
+    def best_speakers(self, test_types=None, limit=5):
+        """Rank speaker models by average score across current and historical tests"""
+        return self.leaderboard.best_speakers(test_types, limit)
+
+    def score_trends(self, granularity, start=None, end=None, speaker_model=None, test_type=None,
+                     include_historical=True, group_by=None):
+        """Average score and test count per time bucket, see TrendRollups.query"""
+        return self.trends.query(granularity, start, end, speaker_model, test_type, include_historical, group_by)
+
+    def personalized_speakers(self, user_ids=None, test_types=None, limit=5):
+        """{user id: models ranked for that user} for user_ids (default: every user with tests)"""
+        user_ids = list(self.profiles.users.values) if user_ids is None else list(user_ids)
+        return dict(zip(user_ids, self.leaderboard.personalized(self.profiles.type_counts(user_ids), test_types, limit)))
+
+    def similar_speakers(self, speaker_model, limit=5):
+        """Models whose averaged response curves are closest to speaker_model's, or None if it has none"""
+        return self.similarity.nearest(speaker_model, limit)
+
+    def to_dataframe(self):
+        """pandas DataFrame view of the engine columns, for ad-hoc analysis"""
+        import pandas as pd
+
+        return pd.DataFrame({
+            "speaker_model": pd.Categorical.from_codes(self.model_code.values, self.models.values),
+            "test_type": pd.Categorical.from_codes(self.type_code.values, self.types.values),
+            "score": self.score.values,
+            "user_rating": self.user_rating.values,
+            "is_historical": self.historical.values
+        })
+
+
+def encode_rating(rating):
+    """Store a 1-5 star rating as int8, with 0 meaning unrated; raises ValueError for any other rating"""
+    return 0 if rating is None else parse_rating(rating)
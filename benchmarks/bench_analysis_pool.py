@@ -0,0 +1,98 @@
+"""p50/p99 latency of /analytics while sweep captures are being analyzed, inline versus on the process pool.
+
+Serves the app with a threaded werkzeug server, keeps --uploaders clients
+posting 10 s sweep captures to /test/frequency-response, and polls
+/analytics from another thread for --seconds per mode. Captures are posted
+with ?stream=0 so they go through the analysis executor rather than being
+streamed in the request thread.
+
+Usage: python benchmarks/bench_analysis_pool.py [--uploaders 4] [--seconds 5] [--workers N]
+"""
+import argparse
+import http.client
+import io
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from scipy.io import wavfile
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import measurement  # noqa: E402
+import speaker_testing  # noqa: E402
+from analysis_pool import AnalysisExecutor  # noqa: E402
+
+
+def sweep_capture(sample_rate=48000):
+    samples = np.concatenate([measurement.exponential_sweep(20, 20000, 10, sample_rate), np.zeros(sample_rate)])
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, samples.astype(np.float32))
+    return buffer.getvalue()
+
+
+def request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request(method, path, body=body, headers=headers or {})
+    status = conn.getresponse().status
+    conn.close()
+    return status
+
+
+def run(port, uploaders, seconds, capture):
+    stop = threading.Event()
+    analyzed = []
+
+    def upload():
+        while not stop.is_set():
+            if request(port, 'POST', '/test/frequency-response?stream=0', capture, {'Content-Type': 'audio/wav'}) == 200:
+                analyzed.append(1)
+
+    threads = [threading.Thread(target=upload) for _ in range(uploaders)]
+    for thread in threads:
+        thread.start()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        request(port, 'GET', '/analytics')
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies = np.array(latencies) * 1e3
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), len(analyzed) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploaders', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, speaker_testing.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    capture = sweep_capture()
+
+    print(f"{'mode':<24}{'p50':>10}{'p99':>10}{'analyses/s':>12}")
+    p50, p99, _ = run(server.port, 0, args.seconds, capture)
+    print(f"{'idle':<24}{p50:>7.1f} ms{p99:>7.1f} ms")
+    for label, workers in [("inline", 0), (f"process pool ({args.workers})", args.workers)]:
+        speaker_testing.analysis = AnalysisExecutor(workers, max_pending=64)
+        if workers:
+            request(server.port, 'POST', '/test/frequency-response?stream=0', capture, {'Content-Type': 'audio/wav'})  # warm up
+        p50, p99, rate = run(server.port, args.uploaders, args.seconds, capture)
+        speaker_testing.analysis.shutdown()
+        print(f"{label:<24}{p50:>7.1f} ms{p99:>7.1f} ms{rate:>12.1f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Compare the vectorized analytics engine with the old pure-Python aggregation loops.
+
+Usage: python benchmarks/bench_analytics.py [--rows 1000000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import speaker_testing  # noqa: E402
+
+SPEAKER_MODELS = ["Bose SoundLink", "JBL Flip 5", "Sony WH-1000XM4", "Sonos One",
+                  "Klipsch R-51M", "KEF Q150", "Edifier R1280T", "Polk Audio T15"]
+TEST_TYPES = ["frequency_response", "distortion", "bass_response", "stereo_imaging",
+              "clarity", "max_volume", "dynamic_range", "transient_response",
+              "voice_reproduction", "soundstage"]
+FREQUENCIES = ["100", "500", "1000", "5000", "10000", "15000"]
+
+
+# The loops get_analytics and get_best_speakers ran before the engine
+def legacy_analytics(all_tests):
+    scores = [t["score"] for t in all_tests if t.get("score") is not None]
+    average_score = sum(scores) / len(scores) if scores else 0
+
+    test_types = {}
+    for test in all_tests:
+        test_type = test.get("test_type", "unknown")
+        test_types[test_type] = test_types.get(test_type, 0) + 1
+
+    speaker_models = {}
+    for test in all_tests:
+        model = test.get("speaker_model", "Unknown")
+        speaker_models[model] = speaker_models.get(model, 0) + 1
+
+    model_scores = {}
+    for test in all_tests:
+        if test.get("score") is not None:
+            model = test.get("speaker_model", "Unknown")
+            if model not in model_scores:
+                model_scores[model] = {"sum": 0, "count": 0}
+            model_scores[model]["sum"] += test["score"]
+            model_scores[model]["count"] += 1
+    avg_scores_by_model = {model: data["sum"] / data["count"] for model, data in model_scores.items()}
+
+    freq_counts = {}
+    freq_sums = {}
+    for test in all_tests:
+        if test.get("test_type") == "frequency_response" and test.get("additional_data"):
+            for freq, response in json.loads(test["additional_data"]).items():
+                freq_counts[freq] = freq_counts.get(freq, 0) + 1
+                freq_sums[freq] = freq_sums.get(freq, 0) + float(response)
+    labels = sorted(freq_counts, key=lambda x: float(x) if x.replace('.', '').isdigit() else 0)
+
+    ratings_dist = [0, 0, 0, 0, 0]
+    for test in all_tests:
+        if test.get("user_rating") is not None:
+            rating = int(test["user_rating"])
+            if 1 <= rating <= 5:
+                ratings_dist[rating - 1] += 1
+
+    return {
+        "total_tests": len(all_tests),
+        "average_score": float(average_score),
+        "test_types": test_types,
+        "speaker_models": speaker_models,
+        "average_scores_by_model": avg_scores_by_model,
+        "frequency_data": {"labels": labels,
+                           "average_response": [freq_sums[f] / freq_counts[f] for f in labels]},
+        "ratings_distribution": ratings_dist
+    }
+
+
+def legacy_best_speakers(all_tests, test_types=None, limit=5):
+    if test_types:
+        all_tests = [t for t in all_tests if t.get("test_type") in test_types]
+
+    model_scores = {}
+    for test in all_tests:
+        model = test.get("speaker_model", "Unknown")
+        if model not in model_scores:
+            model_scores[model] = {"sum": 0, "count": 0, "scores_by_type": {}}
+        score = test.get("score")
+        if score is not None:
+            model_scores[model]["sum"] += score
+            model_scores[model]["count"] += 1
+            model_scores[model]["scores_by_type"].setdefault(test.get("test_type"), []).append(score)
+
+    results = []
+    for model, data in model_scores.items():
+        if data["count"] > 0:
+            results.append({
+                "model": model,
+                "average_score": data["sum"] / data["count"],
+                "test_count": data["count"],
+                "scores_by_type": {t: sum(s) / len(s) for t, s in data["scores_by_type"].items()}
+            })
+    results.sort(key=lambda x: x["average_score"], reverse=True)
+    return results[:limit]
+
+
+def build_storage(rows):
+    # Half current, half generated history, like a long-running deployment
+    storage = speaker_testing.MemoryStorage(historical_rows=rows // 2)
+    rng = random.Random(rows)
+    for _ in range(rows - rows // 2):
+        test_type = rng.choice(TEST_TYPES)
+        if test_type == "frequency_response":
+            additional_data = json.dumps({f: rng.uniform(0.6, 0.99) for f in FREQUENCIES})
+        else:
+            additional_data = json.dumps({"value": rng.uniform(0, 100)})
+        test = {
+            "id": str(uuid.uuid4()),
+            "timestamp": "2024-01-01T00:00:00",
+            "speaker_model": rng.choice(SPEAKER_MODELS),
+            "test_type": test_type,
+            "score": rng.uniform(50, 99),
+            "user_rating": rng.randint(1, 5) if rng.random() > 0.5 else None,
+            "additional_data": additional_data
+        }
+        storage.add_test(test)
+    return storage
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"building {args.rows:,} rows...")
+    storage = build_storage(args.rows)
+    all_tests = storage.get_all_tests(include_historical=True)
+    speaker_testing.storage = storage
+    client = speaker_testing.app.test_client()
+
+    rows = [
+        ("analytics (all rows)",
+         best_of(lambda: legacy_analytics(all_tests), args.repeat),
+         best_of(lambda: storage.get_analytics_summary(include_historical=True), args.repeat)),
+        ("best speakers",
+         best_of(lambda: legacy_best_speakers(all_tests), args.repeat),
+         best_of(lambda: storage.get_best_speakers(), args.repeat)),
+        ("best speakers (2 types)",
+         best_of(lambda: legacy_best_speakers(all_tests, ["clarity", "distortion"]), args.repeat),
+         best_of(lambda: storage.get_best_speakers(["clarity", "distortion"]), args.repeat)),
+    ]
+    print(f"{'query':<26}{'python loops':>14}{'engine':>12}{'speedup':>10}")
+    for name, old, new in rows:
+        print(f"{name:<26}{old * 1e3:>11.1f} ms{new * 1e3:>9.1f} ms{old / new:>9.1f}x")
+
+    print("\nrequest latency through the Flask test client (engine path)")
+    for url in ('/analytics?include_historical=1', '/recommendations'):
+        latency = best_of(lambda: client.get(url), args.repeat)
+        print(f"  GET {url:<34}{latency * 1e3:>9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
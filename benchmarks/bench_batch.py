@@ -0,0 +1,45 @@
+"""Compare running a full evaluation as one POST per test against a single /test/batch request.
+
+Runs in-process through Flask's test client, so it measures the server-side
+per-request cost only; real rigs also save one network round trip per test.
+
+Usage: python benchmarks/bench_batch.py [--units 24]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import speaker_testing  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--units', type=int, default=24, help='speakers evaluated on every test type')
+    args = parser.parse_args()
+
+    client = speaker_testing.app.test_client()
+    test_types = list(speaker_testing.TEST_TYPES)
+    units = [f"Unit {i}" for i in range(args.units)]
+
+    start = time.perf_counter()
+    for unit in units:
+        for test_type in test_types:
+            client.post(f"/test/{test_type.replace('_', '-')}", json={"speaker_model": unit})
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    jobs = [{"speaker_model": unit, "test_type": test_type} for unit in units for test_type in test_types]
+    response = client.post('/test/batch', json={"jobs": jobs})
+    batch = time.perf_counter() - start
+    assert response.json["completed"] == len(jobs)
+
+    print(f"{len(jobs)} tests ({args.units} units x {len(test_types)} types)")
+    print(f"  one POST per test  {len(jobs):>5} requests {single * 1e3:>9.1f} ms")
+    print(f"  /test/batch        {1:>5} request  {batch * 1e3:>9.1f} ms  ({single / batch:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Append, lookup and sweep throughput of the capture archive, and the memory a full sweep needs.
+
+Fills a fresh archive with --gigabytes of --capture-seconds float32 noise
+captures, reopens it (loading the binary index), looks up --lookups random
+captures and reads one sample of each, then sweeps every capture in segment
+order computing its RMS. Peak RSS is reported after each phase: the sweep
+maps one capture at a time, so it stays near one capture's size whatever the
+size of the archive. Every swept capture is checked against its known RMS.
+
+Usage: python benchmarks/bench_capture_archive.py [--gigabytes 1] [--capture-seconds 10] [--sample-rate 48000]
+       [--directory DIR] [--segment-mb 1024]
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from capture_archive import CaptureArchive  # noqa: E402
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--gigabytes', type=float, default=1.0)
+    parser.add_argument('--capture-seconds', type=float, default=10.0)
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    parser.add_argument('--directory', help='archive directory (default: a temporary one, removed afterwards)')
+    parser.add_argument('--segment-mb', type=int, default=1024)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix='capture-archive-')
+    length = int(args.capture_seconds * args.sample_rate)
+    count = max(1, int(args.gigabytes * 2**30 / (length * 4)))
+    # One noise buffer, scaled per capture so each capture's RMS is known
+    noise = np.random.default_rng(0).standard_normal(length).astype(np.float32)
+    noise /= np.sqrt(np.mean(noise.astype(np.float64) ** 2))
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    gains = {test_id: 0.01 + 0.5 * i / count for i, test_id in enumerate(ids)}
+    print(f"{count} captures of {args.capture_seconds:g} s at {args.sample_rate} Hz, "
+          f"{count * length * 4 / 2**30:.2f} GB, in {directory}")
+
+    try:
+        archive = CaptureArchive(directory, segment_bytes=args.segment_mb * 2**20)
+        start = time.perf_counter()
+        for test_id in ids:
+            archive.append([test_id], args.sample_rate, noise * np.float32(gains[test_id]))
+        elapsed = time.perf_counter() - start
+        archive.close()
+        print(f"append: {count * length * 4 / 2**20 / elapsed:.0f} MB/s, peak RSS {peak_rss_mb():.0f} MB")
+
+        start = time.perf_counter()
+        archive = CaptureArchive(directory, segment_bytes=args.segment_mb * 2**20)
+        print(f"reopen (index of {len(archive)}): {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+        start = time.perf_counter()
+        for test_id in random.choices(ids, k=args.lookups):
+            float(archive.get(test_id).samples[length // 2])
+        print(f"lookup + map + read one sample: {(time.perf_counter() - start) / args.lookups * 1e6:.0f} us")
+
+        ok = True
+        start = time.perf_counter()
+        swept = 0
+        for capture in archive.captures():
+            rms = np.sqrt(np.mean(capture.samples.astype(np.float64) ** 2))
+            ok = ok and abs(rms / gains[capture.test_id] - 1) < 1e-5
+            swept += capture.nbytes
+        elapsed = time.perf_counter() - start
+        print(f"sweep: {swept / 2**30 / elapsed:.2f} GB/s, peak RSS {peak_rss_mb():.0f} MB "
+              f"(one capture is {length * 4 / 2**20:.1f} MB as float32)")
+        archive.close()
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory)
+    if not ok:
+        sys.exit("FAIL: swept capture does not match what was archived")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Cold start of the Vercel entry point api/index.py: import profile and first requests.
+
+Imports the entry point in fresh interpreters under ``python -X importtime``
+and lists the packages whose modules took longest to import, then times a
+cold start as a serverless function sees it: the import, then the first
+GET /, the first /analytics and the first /recommendations (which imports
+NumPy and generates the historical tests). Serving / and /analytics must
+not import NumPy, SciPy or pandas.
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API = os.path.join(ROOT, 'api')
+
+HEAVY_MODULES = ('numpy', 'scipy', 'pandas')
+
+# Run in a fresh interpreter: time the import and the first requests
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {api!r})
+start = time.perf_counter()
+import index
+timings = {{"import": time.perf_counter() - start}}
+client = index.app.test_client()
+heavy = None
+for url in ('/', '/analytics', '/recommendations'):
+    start = time.perf_counter()
+    assert client.get(url).status_code == 200, url
+    timings[url] = time.perf_counter() - start
+    if url == '/analytics':
+        heavy = [name for name in {heavy_modules!r} if name in sys.modules]
+print(json.dumps({{"timings": timings, "heavy": heavy}}))
+"""
+
+
+def child_env():
+    # Vercel runs the function with the project root importable
+    env = dict(os.environ, PYTHONPATH=ROOT, SPEAKER_STORAGE_BACKEND='memory', SPEAKER_ANALYSIS_WORKERS='0')
+    env.pop('SPEAKER_CAPTURE_ARCHIVE', None)
+    return env
+
+
+def import_profile():
+    """{package: microseconds spent importing its modules} of one import of the entry point"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'], cwd=API, env=child_env(),
+                            check=True, capture_output=True, text=True)
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        # Each module's own time, so nested imports are counted once, under their own package
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own)
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per measurement')
+    parser.add_argument('--top', type=int, default=15, help='slowest packages to list')
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    best = {name: min(profile.get(name, 0) for profile in profiles) for name in profiles[0]}
+    print(f"slowest packages to import (best of {args.runs}):")
+    for name, micros in sorted(best.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<36}{micros / 1e3:>9.1f} ms")
+    print(f"  {'total':<36}{sum(best.values()) / 1e3:>9.1f} ms")
+
+    child = CHILD.format(api=API, heavy_modules=HEAVY_MODULES)
+    runs = [json.loads(subprocess.run([sys.executable, '-c', child], env=child_env(), check=True,
+                                      capture_output=True, text=True).stdout) for _ in range(args.runs)]
+    print(f"\ncold start (median of {args.runs}):")
+    for step in runs[0]["timings"]:
+        print(f"  {'import' if step == 'import' else 'first GET ' + step:<36}"
+              f"{statistics.median(run['timings'][step] for run in runs) * 1e3:>9.1f} ms")
+
+    heavy = sorted(set().union(*(run["heavy"] for run in runs)))
+    if heavy:
+        sys.exit(f"FAIL: serving / and /analytics imported {', '.join(heavy)}")
+    print(f"\n/ and /analytics were served without importing {', '.join(HEAVY_MODULES)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Stress MemoryStorage from many request threads at once.
+
+Each of --threads threads acts as its own testing session: it stores tests
+carrying its user id, rates some of them, and reads the dashboard, the
+leaderboard, single tests and its own tests in between. The run is repeated
+with every call serialized behind one lock, as a threaded server would have
+to without a thread-safe storage. A short switch interval makes threads
+interleave far more often than in production.
+
+Afterwards every thread's tests and ratings must be accounted for in the
+indexes, the user lists and the analytics.
+
+Usage: python benchmarks/bench_concurrent_storage.py [--threads 8] [--operations 20000]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from speaker_testing import MemoryStorage  # noqa: E402
+
+MODELS = [f"Model {i}" for i in range(20)]
+TYPES = ["frequency_response", "distortion", "bass_response", "clarity"]
+
+
+class Serialized:
+    """Every call to the wrapped storage under one lock"""
+    def __init__(self, storage):
+        self._storage = storage
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self._storage, name)
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return method(*args, **kwargs)
+        return locked
+
+
+def session(storage, user_id, operations, seed, write_latencies, rated):
+    rng = random.Random(seed)
+    mine = []
+    for _ in range(operations):
+        roll = rng.random()
+        if roll < 0.5 or not mine:
+            test = {"id": str(uuid.uuid4()), "timestamp": datetime.datetime.now().isoformat(),
+                    "speaker_model": rng.choice(MODELS), "test_type": rng.choice(TYPES),
+                    "score": rng.uniform(40, 100), "user_rating": None, "additional_data": None,
+                    "user_id": user_id}
+            start = time.perf_counter()
+            storage.add_test(test)
+            write_latencies.append(time.perf_counter() - start)
+            mine.append(test["id"])
+        elif roll < 0.7:
+            test_id = rng.choice(mine)
+            if not storage.update_rating(test_id, rng.randint(1, 5)):
+                raise AssertionError(f"{user_id} could not rate its own test {test_id}")
+            rated.add(test_id)
+        elif roll < 0.8:
+            if storage.get_test_by_id(rng.choice(mine)) is None:
+                raise AssertionError(f"{user_id} could not read its own test")
+        elif roll < 0.9:
+            storage.get_analytics_summary()
+        elif roll < 0.95:
+            storage.get_best_speakers()
+        else:
+            storage.get_user_tests(user_id)
+    return mine
+
+
+def run(storage, threads, operations):
+    baseline = storage.get_analytics_summary()
+    results, errors, rated, latencies = {}, [], set(), []
+
+    def worker(index):
+        user_id = f"user-{index}"
+        storage.set_user_session(user_id)
+        try:
+            results[user_id] = session(storage, user_id, operations, index, latencies, rated)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        sys.exit(f"FAIL: {errors[0]}")
+
+    stored = sum(len(ids) for ids in results.values())
+    summary = storage.get_analytics_summary()
+    if summary["total_tests"] != baseline["total_tests"] + stored:
+        sys.exit(f"FAIL: {summary['total_tests'] - baseline['total_tests']} tests counted, {stored} stored")
+    for user_id, ids in results.items():
+        found = {test["id"] for test in storage.get_user_tests(user_id)}
+        if found != set(ids):
+            sys.exit(f"FAIL: {user_id} has {len(found)} tests, stored {len(ids)}")
+    ratings = sum(summary["ratings_distribution"]) - sum(baseline["ratings_distribution"])
+    if ratings != len(rated):
+        sys.exit(f"FAIL: {ratings} ratings counted, {len(rated)} tests rated")
+
+    latencies.sort()
+    return threads * operations / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.999)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=20000, help='calls per thread')
+    parser.add_argument('--switch-interval', type=float, default=1e-5, help='seconds, see sys.setswitchinterval')
+    args = parser.parse_args()
+
+    sys.setswitchinterval(args.switch_interval)
+    print(f"{args.threads} threads x {args.operations} calls")
+    print(f"{'':<24}{'calls/s':>10}{'add_test p50':>15}{'p99.9':>12}")
+    for label, storage in (("one lock per call", Serialized(MemoryStorage())),
+                           ("queued inserts", MemoryStorage())):
+        throughput, median, tail = run(storage, args.threads, args.operations)
+        print(f"{label:<24}{throughput:>10,.0f}{median * 1e6:>12.1f} us{tail * 1e6:>9.1f} us")
+    print("every thread's tests and ratings are accounted for")
+
+
+if __name__ == '__main__':
+    main()
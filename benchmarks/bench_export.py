@@ -0,0 +1,55 @@
+"""Peak memory and time-to-first-byte of the streaming CSV export versus building the whole file.
+
+Usage: python benchmarks/bench_export.py [--rows 200000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import speaker_testing  # noqa: E402
+
+
+def build_storage(rows):
+    return speaker_testing.MemoryStorage(historical_rows=rows)
+
+
+def buffered_export(tests):
+    """How /export-historical-data built its response before streaming"""
+    return ''.join(speaker_testing.iter_csv(tests, rows_per_chunk=len(tests) + 1))
+
+
+def measure(label, make_response):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_byte = None
+    total = 0
+    for chunk in make_response():
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total += len(chunk)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22}{peak / 2**20:>9.1f} MiB{first_byte * 1e3:>10.1f} ms{elapsed * 1e3:>10.1f} ms"
+          f"{total / 2**20:>9.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    storage = build_storage(args.rows)
+    print(f"{args.rows:,} historical rows")
+    print(f"{'export':<22}{'peak mem':>13}{'1st byte':>13}{'total':>13}{'size':>13}")
+    measure("buffered string", lambda: [buffered_export(storage.historical_data)])
+    measure("streaming", storage.export_historical_data)
+    measure("streaming + gzip", lambda: speaker_testing.gzip_chunks(storage.export_historical_data()))
+
+
+if __name__ == '__main__':
+    main()
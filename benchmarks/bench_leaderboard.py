@@ -0,0 +1,107 @@
+"""Latency of the speaker leaderboard behind /recommendations, against regrouping every stored test.
+
+Fills a storage backend with --records tests spread over --models speaker
+models and every registered test type, then ranks the models for a mix of
+test type sets: by regrouping all stored scores with np.bincount (what
+get_best_speakers did per request), with the incremental leaderboard
+bypassing its cache, through get_best_speakers with the cache warm, and with
+one score rewrite per ten reads so the cache sees invalidations. Every
+leaderboard answer must match the regrouped one.
+
+Usage: python benchmarks/bench_leaderboard.py [--records 200000] [--models 500] [--backend memory|columnar]
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from registry import TEST_TYPES  # noqa: E402
+
+
+def regroup(engine, test_types, limit):
+    """Models ranked by a fresh group-by over every stored score"""
+    scores = engine.score.values
+    mask = ~np.isnan(scores)
+    if test_types:
+        mask &= np.isin(engine.type_code.values, [engine.types.lookup(t) for t in test_types])
+    models = engine.model_code.values[mask]
+    model_sum = np.bincount(models, weights=scores[mask], minlength=len(engine.models))
+    model_count = np.bincount(models, minlength=len(engine.models))
+    ranked = np.flatnonzero(model_count)
+    averages = model_sum[ranked] / model_count[ranked]
+    order = np.argsort(-averages, kind='stable')[:limit]
+    return [(engine.models.values[m], a) for m, a in zip(ranked[order], averages[order])]
+
+
+def same(speakers, ranking):
+    return [(s["model"], round(s["average_score"], 9)) for s in speakers] == [(m, round(a, 9)) for m, a in ranking]
+
+
+def timed(function, queries):
+    start = time.perf_counter()
+    results = [function(test_types) for test_types in queries]
+    return (time.perf_counter() - start) / len(queries) * 1e6, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--models', type=int, default=500)
+    parser.add_argument('--backend', choices=['memory', 'columnar'], default='memory')
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    from speaker_testing import create_storage
+    storage = create_storage(args.backend)
+    random.seed(0)
+    timestamp = datetime.datetime.now().isoformat()
+    types = list(TEST_TYPES)
+    storage.add_tests([{"id": str(uuid.uuid4()), "timestamp": timestamp, "speaker_model": f"Model {random.randrange(args.models)}",
+                        "test_type": random.choice(types), "score": random.uniform(40, 100), "user_rating": None,
+                        "additional_data": None} for _ in range(args.records)])
+    engine = storage.engine
+    ids = [test_id for test_id, *_ in storage.iter_score_rows()]
+
+    # A handful of popular type sets, as the dashboard sends them, plus "all types"
+    type_sets = [None] + [random.sample(types, random.randint(1, 4)) for _ in range(15)]
+    queries = [random.choice(type_sets) for _ in range(args.queries)]
+    print(f"{len(engine)} tests, {len(engine.models)} models, {len(type_sets)} distinct type sets")
+    print(f"{'':<28}{'per query':>12}")
+
+    regroup_us, expected = timed(lambda t: regroup(engine, t, 5), queries)
+    print(f"{'regroup every test':<28}{regroup_us:>9.1f} us")
+
+    engine.leaderboard._cache.clear()
+    us, results = timed(lambda t: engine.leaderboard._rank(t, 5), queries)
+    print(f"{'leaderboard, no cache':<28}{us:>9.1f} us")
+    mismatched = sum(1 for result, want in zip(results, expected) if not same(result, want))
+
+    us, results = timed(storage.get_best_speakers, queries)
+    print(f"{'leaderboard, warm cache':<28}{us:>9.1f} us")
+    mismatched += sum(1 for result, want in zip(results, expected) if not same(result, want))
+
+    rewritten = iter(random.sample(ids, len(queries) // 10 + 1))
+    steps = itertools.count(1)
+
+    def read_and_write(test_types):
+        if next(steps) % 10 == 0:
+            storage.update_scores([(next(rewritten), random.uniform(40, 100))])
+        return storage.get_best_speakers(test_types)
+    us, _ = timed(read_and_write, queries)
+    print(f"{'1 score write per 10 reads':<28}{us:>9.1f} us")
+
+    mismatched += sum(1 for t in type_sets if not same(storage.get_best_speakers(t), regroup(engine, t, 5)))
+    if mismatched:
+        sys.exit(f"FAIL: {mismatched} leaderboard answers differ from the regrouped ranking")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Check the measurement engine against synthetic captures and time it per capture.
+
+Frequency response: a synthetic exponential sweep is passed through a
+Butterworth band-pass with a small delay; the measured third-octave response
+must match the filter's own response (relative to 1 kHz) within --tolerance
+dB wherever the filter is within 12 dB of its passband.
+
+Streaming: the same sweep capture fed to SweepDeconvolver in --chunk sample
+chunks must match the batch measurement within 0.05 dB on the checked bands;
+the time left once the last chunk arrives is reported.
+
+Bass response: pink noise through a 60 Hz high-pass, measured relative to the
+unfiltered (loopback) capture, must match the filter's band-averaged response
+within --tolerance dB wherever it is within 12 dB of the passband.
+
+Distortion: stepped tones with known 2nd and 3rd harmonics (1% and 0.5%) must
+measure THD within 1% of the exact value; a --minutes long capture is timed.
+
+Usage: python benchmarks/bench_measurement.py [--sample-rate 48000] [--duration 10] [--repeat 10] [--minutes 3]
+       [--chunk 16384]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import measurement  # noqa: E402
+import signals  # noqa: E402
+
+
+def sweep_capture(args):
+    """(recording, filter coefficients, delay in samples) of a band-passed sweep"""
+    fs = args.sample_rate
+    sweep = measurement.exponential_sweep(20, 20000, args.duration, fs)
+    b, a = signal.butter(2, [80, 6000], btype='bandpass', fs=fs)
+    delay = int(0.005 * fs)
+    return np.concatenate([np.zeros(delay), signal.lfilter(b, a, sweep), np.zeros(fs // 2)]), (b, a), delay
+
+
+def check_frequency_response(args):
+    fs = args.sample_rate
+    recording, (b, a), delay = sweep_capture(args)
+
+    result = measurement.measure_frequency_response(recording, fs, duration=args.duration)
+    centers = result["centers"]
+    _, h = signal.freqz(b, a, worN=centers, fs=fs)
+    expected = 20 * np.log10(np.abs(h))
+    reference = np.argmin(np.abs(centers - 1000))
+    error = (result["response_db"] - result["response_db"][reference]) - (expected - expected[reference])
+    checked = expected > expected.max() - 12
+
+    print(f"{'band':>9}{'expected':>10}{'error':>8}")
+    for center, want, err, check in zip(centers, expected, error, checked):
+        print(f"{center:>9.1f}{want:>10.2f}{err:>8.2f}{'' if check else '  (skipped)'}")
+    worst = np.abs(error[checked]).max()
+    print(f"worst error {worst:.2f} dB, latency {result['latency_ms']:.2f} ms (true {delay / fs * 1000:.2f} ms)")
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        measurement.measure_frequency_response(recording, fs, duration=args.duration)
+    elapsed = (time.perf_counter() - start) / args.repeat
+    print(f"{fs} Hz x {args.duration:g} s capture: {elapsed * 1e3:.1f} ms per measurement")
+
+    return worst <= args.tolerance
+
+
+def check_streaming(args):
+    fs = args.sample_rate
+    recording, (b, a), _ = sweep_capture(args)
+    batch = measurement.measure_frequency_response(recording, fs, duration=args.duration)
+    _, h = signal.freqz(b, a, worN=batch["centers"], fs=fs)
+    expected = 20 * np.log10(np.abs(h))
+    checked = expected > expected.max() - 12
+
+    feed_time = finish_time = 0.0
+    for _ in range(args.repeat):
+        deconvolver = measurement.SweepDeconvolver(fs, duration=args.duration)
+        start = time.perf_counter()
+        for i in range(0, len(recording), args.chunk):
+            deconvolver.feed(recording[i:i + args.chunk])
+        fed = time.perf_counter()
+        streamed = deconvolver.result()
+        feed_time += fed - start
+        finish_time += time.perf_counter() - fed
+
+    difference = np.abs(streamed["response_db"] - batch["response_db"])[checked].max()
+    print(f"\nstreaming vs batch: max difference {difference:.4f} dB on the checked bands")
+    print(f"{len(recording) / fs:.1f} s capture in {args.chunk} sample chunks: feed {feed_time / args.repeat * 1e3:.1f} ms, "
+          f"result after the last chunk {finish_time / args.repeat * 1e3:.1f} ms")
+    # The delay line is per capture; the inverse sweep partitions are cached and shared
+    print(f"delay line {deconvolver._delay_line.nbytes / 2**20:.1f} MB, "
+          f"shared partitions {deconvolver._partitions.nbytes / 2**20:.1f} MB, whatever the capture length")
+    return difference <= 0.05
+
+
+def check_bass_response(args):
+    fs = args.sample_rate
+    pink = signals._pink_noise(args.duration, fs)
+    b, a = signal.butter(2, 60, btype='highpass', fs=fs)
+    loopback = measurement.measure_bass_response(pink, fs)
+    result = measurement.measure_bass_response(signal.lfilter(b, a, pink), fs)
+
+    centers = result["centers"]
+    half_band = 2 ** (1 / 6)
+    expected = np.array([10 * np.log10(np.mean(np.abs(signal.freqz(
+        b, a, worN=np.linspace(f / half_band, f * half_band, 256), fs=fs)[1]) ** 2)) for f in centers])
+    error = (result["response_db"] - loopback["response_db"]) - expected
+    checked = expected > expected.max() - 12
+
+    print(f"\n{'band':>9}{'expected':>10}{'error':>8}")
+    for center, want, err, check in zip(centers, expected, error, checked):
+        print(f"{center:>9.1f}{want:>10.2f}{err:>8.2f}{'' if check else '  (skipped)'}")
+    worst = np.abs(error[checked]).max()
+    print(f"bass response worst error {worst:.2f} dB")
+    return worst <= args.tolerance
+
+
+def check_distortion(args):
+    fs = args.sample_rate
+    tones = np.asarray(measurement.DEFAULT_TONES, dtype=np.float64)
+    phase = 2 * np.pi * np.repeat(tones, fs) * (np.arange(len(tones) * fs) % fs) / fs
+    steps = 0.5 * np.sin(phase) + 0.005 * np.sin(2 * phase) + 0.0025 * np.sin(3 * phase)
+    recording = np.concatenate([np.zeros(fs // 10), steps, np.zeros(fs // 2)])
+
+    result = measurement.measure_distortion(recording, fs)
+    # Harmonics above 20 kHz are not counted
+    expected = np.where(3 * tones <= 20000, np.hypot(1.0, 0.5), np.where(2 * tones <= 20000, 1.0, 0.0))
+    error = np.abs(result["thd"] / expected - 1)
+    print(f"\n{'tone':>9}{'THD %':>10}{'THD+N %':>10}{'expected':>10}")
+    for tone, thd, thd_n, want in zip(tones, result["thd"], result["thd_n"], expected):
+        print(f"{tone:>9.0f}{thd:>10.4f}{thd_n:>10.4f}{want:>10.4f}")
+
+    repeats = max(1, int(args.minutes * 60 / len(tones)))
+    long_capture = np.tile(steps, repeats)
+    start = time.perf_counter()
+    measurement.measure_distortion(long_capture, fs, frequencies=np.tile(tones, repeats))
+    elapsed = time.perf_counter() - start
+    print(f"{len(long_capture) / fs / 60:.1f} min stepped-tone capture: {elapsed * 1e3:.1f} ms")
+    return error.max() < 0.01
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--minutes', type=float, default=3.0)
+    parser.add_argument('--tolerance', type=float, default=0.5, help='max frequency response error in dB')
+    parser.add_argument('--chunk', type=int, default=16384, help='samples per streamed chunk')
+    args = parser.parse_args()
+
+    ok = check_frequency_response(args)
+    ok = check_streaming(args) and ok
+    ok = check_bass_response(args) and ok
+    ok = check_distortion(args) and ok
+    if not ok:
+        sys.exit("FAIL: measurement outside tolerance")
+
+
+if __name__ == '__main__':
+    main()
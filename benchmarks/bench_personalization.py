@@ -0,0 +1,97 @@
+"""Personalized recommendation throughput: the old per-user loop versus one matrix product per block of users.
+
+Fills a storage backend with --records tests by --users users over --models
+speaker models, then personalizes recommendations for every user: first as
+get_recommendations used to (get_user_tests, count the user's test types,
+then add a bonus per preferred type to every model's scores), then through
+get_personalized_speakers one user at a time and for all users in one batch.
+Every vectorized ranking must match the per-user loop.
+
+Usage: python benchmarks/bench_personalization.py [--records 200000] [--users 2000] [--models 200]
+       [--backend memory|columnar|sqlite]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from analytics_engine import PREFERENCE_BONUS, PREFERRED_TYPES  # noqa: E402
+from registry import TEST_TYPES  # noqa: E402
+
+
+def per_user(storage, speakers, user_id, limit):
+    """Personalized ranking as the /recommendations loop computed it, over every model"""
+    counts = {}
+    for test in storage.get_user_tests(user_id):
+        counts[test["test_type"]] = counts.get(test["test_type"], 0) + 1
+    # Most-tested first, ties in name order
+    preferred = sorted(counts, key=lambda t: (-counts[t], t))[:PREFERRED_TYPES]
+    personalized = []
+    for speaker in speakers:
+        bonus = sum(speaker["scores_by_type"][t] * PREFERENCE_BONUS for t in preferred if t in speaker["scores_by_type"])
+        personalized.append((min(100, speaker["average_score"] + bonus), speaker["model"]))
+    personalized.sort(key=lambda item: item[0], reverse=True)
+    return personalized[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--models', type=int, default=200)
+    parser.add_argument('--backend', choices=['memory', 'columnar', 'sqlite'], default='memory')
+    parser.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        os.environ['SPEAKER_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='personalization-'), 'tests.db')
+    from speaker_testing import create_storage
+    storage = create_storage(args.backend)
+    random.seed(0)
+    timestamp = datetime.datetime.now().isoformat()
+    users = [f"user-{i}" for i in range(args.users)]
+    types = list(TEST_TYPES)
+    tests_by_user = {}
+    for _ in range(args.records):
+        user_id = random.choice(users)
+        tests_by_user.setdefault(user_id, []).append({
+            "id": str(uuid.uuid4()), "timestamp": timestamp, "speaker_model": f"Model {random.randrange(args.models)}",
+            "test_type": random.choice(types[:random.randint(1, len(types))]), "score": random.uniform(40, 100),
+            "user_rating": None, "additional_data": None, "user_id": user_id})
+    for user_id, tests in tests_by_user.items():
+        storage.set_user_session(user_id)
+        storage.add_tests(tests)
+    users = list(tests_by_user)
+
+    speakers = storage.get_best_speakers(limit=None)
+    start = time.perf_counter()
+    expected = {user_id: per_user(storage, speakers, user_id, args.limit) for user_id in users}
+    loop = time.perf_counter() - start
+    print(f"{len(users)} users, {len(speakers)} models, {args.records} tests in the {args.backend} backend")
+    print(f"{'per-user loop':<28}{len(users) / loop:>10.0f} users/s")
+
+    start = time.perf_counter()
+    single = {user_id: storage.get_personalized_speakers([user_id], limit=args.limit)[user_id] for user_id in users}
+    print(f"{'vectorized, one user each':<28}{len(users) / (time.perf_counter() - start):>10.0f} users/s")
+    start = time.perf_counter()
+    batch = storage.get_personalized_speakers(users, limit=args.limit)
+    print(f"{'vectorized, one batch':<28}{len(users) / (time.perf_counter() - start):>10.0f} users/s")
+
+    def ranking(results):
+        return [(round(r["personalized_score"], 9), r["model"]) for r in results]
+
+    mismatched = sum(1 for user_id in users
+                     if ranking(single[user_id]) != ranking(batch[user_id])
+                     or ranking(batch[user_id]) != [(round(score, 9), model) for score, model in expected[user_id]])
+    if mismatched:
+        sys.exit(f"FAIL: {mismatched} users' personalized rankings differ from the per-user loop")
+
+
+if __name__ == '__main__':
+    main()
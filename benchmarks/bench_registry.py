@@ -0,0 +1,83 @@
+"""Per-test overhead of the registry dispatch versus the old copy-pasted /test/* handler bodies.
+
+Times everything a handler does apart from Flask itself and the storage
+write: simulate metrics, score, serialize additional_data and build the
+record. The legacy function is the body /test/stereo-imaging had before the
+registry, the same shape as the other nine handlers.
+
+Usage: python benchmarks/bench_registry.py [--tests 100000]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import speaker_testing  # noqa: E402
+from registry import TEST_TYPES  # noqa: E402
+
+
+def legacy_stereo_imaging(speaker_model):
+    channel_separation = random.uniform(70, 98)
+    phase_accuracy = random.uniform(75, 95)
+    sound_stage_width = random.uniform(65, 95)
+    score = (channel_separation + phase_accuracy + sound_stage_width) / 3
+    test = {
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "speaker_model": speaker_model,
+        "test_type": "stereo_imaging",
+        "score": score,
+        "user_rating": None,
+        "additional_data": json.dumps({
+            "channel_separation": channel_separation,
+            "phase_accuracy": phase_accuracy,
+            "sound_stage_width": sound_stage_width
+        })
+    }
+    return test, {
+        "test": "stereo_imaging",
+        "channel_separation": channel_separation,
+        "phase_accuracy": phase_accuracy,
+        "sound_stage_width": sound_stage_width,
+        "score": score,
+        "id": test["id"]
+    }
+
+
+def timed(label, fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28}{elapsed / count * 1e6:>8.2f} us/test")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tests', type=int, default=100000)
+    args = parser.parse_args()
+
+    test_type = TEST_TYPES["stereo_imaging"]
+    params = {"speaker_model": "KEF Q150"}
+    metrics = test_type.simulate()
+
+    print("additional_data serialization")
+    timed("json.dumps", lambda: json.dumps(metrics), args.tests)
+    timed("compiled serializer", lambda: test_type.serialize(metrics), args.tests)
+    assert test_type.serialize(metrics) == json.dumps(metrics)
+
+    print("handler body (stereo_imaging)")
+    legacy = timed("legacy handler", lambda: legacy_stereo_imaging("KEF Q150"), args.tests)
+    registry = timed("registry run_test", lambda: speaker_testing.run_test(test_type, params), args.tests)
+    print(f"  {(1 - registry / legacy) * 100:.0f}% less time per test")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Throughput of rescore.py over a large store, versus rescoring one record at a time.
+
+Fills a storage backend with --records simulated tests of every registered
+type, all with a stale score of 0, then recomputes them: first with a
+per-record loop (json.loads plus the scalar formula), then with rescore()
+inline and on --workers processes (dry runs), and once more writing the
+scores back. Every rescored value must equal the per-record one.
+
+Usage: python benchmarks/bench_rescore.py [--records 200000] [--backend memory|columnar] [--workers N]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import scoring  # noqa: E402
+from registry import TEST_TYPES  # noqa: E402
+from rescore import rescore  # noqa: E402
+
+
+def fill(storage, count):
+    random.seed(0)
+    timestamp = datetime.datetime.now().isoformat()
+    types = list(TEST_TYPES.values())
+    tests = []
+    for _ in range(count):
+        test_type = random.choice(types)
+        _, additional_data, _ = test_type.run({})
+        tests.append({"id": str(uuid.uuid4()), "timestamp": timestamp, "speaker_model": "Bench",
+                      "test_type": test_type.name, "score": 0.0, "user_rating": None,
+                      "additional_data": additional_data})
+    storage.add_tests(tests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--backend', choices=['memory', 'columnar'], default='memory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    from speaker_testing import create_storage
+    storage = create_storage(args.backend)
+    fill(storage, args.records)
+    tests = list(storage.iter_tests(include_historical=True))
+    print(f"{len(tests)} records in the {args.backend} backend")
+
+    start = time.perf_counter()
+    expected = {}
+    for test in tests:
+        compute = scoring.formula(test["test_type"])
+        metrics = json.loads(test["additional_data"])
+        try:
+            fields = compute.field_names(metrics)
+            if fields:
+                expected[test["id"]] = float(compute({field: float(metrics[field]) for field in fields}))
+        except KeyError:
+            pass  # historical records hold no metrics
+    elapsed = time.perf_counter() - start
+    print(f"{'per-record loop':<28}{len(tests) / elapsed:>12.0f} records/s")
+
+    runs = [(f'rescore, {workers} worker(s)', workers, True) for workers in sorted({1, args.workers})]
+    for label, workers, dry_run in runs + [('rescore + write-back', args.workers, False)]:
+        report = rescore(storage, workers=workers, dry_run=dry_run)
+        print(f"{label:<28}{report['records_per_second']:>12.0f} records/s "
+              f"({report['changed']} changed, {report['unscorable']} without metrics)")
+
+    mismatched = sum(1 for test in storage.iter_tests(include_historical=True)
+                     if test["id"] in expected and abs(test["score"] - expected[test["id"]]) > 1e-9)
+    if mismatched:
+        sys.exit(f"FAIL: {mismatched} rescored values differ from the per-record formula")
+
+
+if __name__ == '__main__':
+    main()
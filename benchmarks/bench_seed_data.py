@@ -0,0 +1,82 @@
+"""Startup cost of MemoryStorage and the first query that needs its generated history.
+
+Creating a storage must not generate the historical tests: that waits for
+the first query that reads them. The same seed must give the same tests in
+every process, and scores updated through the storage must be what the
+history returns afterwards.
+
+Usage: python benchmarks/bench_seed_data.py [--rows 1000000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from speaker_testing import MemoryStorage  # noqa: E402
+from storage_common import HISTORICAL_ROWS  # noqa: E402
+
+# Prints the tests a fresh interpreter starts with (sample test timestamps follow the clock)
+CHILD = """
+import sys
+sys.path.insert(0, {root!r})
+from speaker_testing import MemoryStorage
+storage = MemoryStorage(historical_rows={rows}, seed={seed})
+print([(t["id"], t["score"], t.get("is_historical") and t["timestamp"])
+       for t in storage.get_all_tests(include_historical=True)])
+"""
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def check(rows):
+    construct, storage = timed(lambda: MemoryStorage(historical_rows=rows))
+    summary, _ = timed(storage.get_analytics_summary)
+    if storage._historical is not None:
+        sys.exit("FAIL: the history was generated before a query needed it")
+    first, best = timed(storage.get_best_speakers)
+    again, _ = timed(storage.get_best_speakers)
+    total = storage.get_analytics_summary(include_historical=True)["total_tests"]
+    if total != rows + len(storage.tests):
+        sys.exit(f"FAIL: {total} tests in the summary, expected {rows + len(storage.tests)}")
+    print(f"{rows:>10,} rows: construct {construct * 1e3:7.1f} ms, /analytics {summary * 1e3:6.1f} ms, "
+          f"first best_speakers {first * 1e3:7.1f} ms, then {again * 1e3:5.2f} ms")
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='generated historical tests for the large run')
+    args = parser.parse_args()
+
+    check(HISTORICAL_ROWS)
+    storage = check(args.rows)
+
+    # Scores updated through the storage come back from the history and its aggregates
+    history = storage.historical_data
+    test_ids = [history.test_id(i) for i in range(0, len(history), max(1, len(history) // 100))]
+    if storage.update_scores([(test_id, 42.0) for test_id in test_ids]) != len(test_ids):
+        sys.exit("FAIL: update_scores missed historical tests")
+    if any(storage.get_test_by_id(test_id)["score"] != 42.0 for test_id in test_ids):
+        sys.exit("FAIL: an updated historical score was not stored")
+    if storage.get_test_by_id("00000000-0000-4000-8000-000000000000") is not None:
+        sys.exit("FAIL: found a test that does not exist")
+
+    # Two processes generate the same tests from the same seed
+    child = CHILD.format(root=ROOT, rows=HISTORICAL_ROWS, seed=7)
+    runs = [subprocess.run([sys.executable, '-c', child], check=True, capture_output=True, text=True).stdout
+            for _ in range(2)]
+    if runs[0] != runs[1]:
+        sys.exit("FAIL: the same seed generated different tests")
+    print("the history is generated on first use, the same for the same seed, and keeps updated scores")
+
+
+if __name__ == '__main__':
+    main()
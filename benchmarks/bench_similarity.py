@@ -0,0 +1,87 @@
+"""Query latency and recall of the speaker similarity index, brute force versus clustered.
+
+Builds a SimilarityIndex over --models synthetic speaker models, each with a
+frequency response and a bass response test drawn around one of --families
+curve shapes, then times --queries nearest-neighbour queries scanning every
+model and probing the clustered (IVF) index, and reports the clustered
+index's recall of the exact top --k. Finally adds one test per query to a
+random model and queries again, to time re-embedding after writes.
+
+Usage: python benchmarks/bench_similarity.py [--models 100000] [--families 200] [--k 5] [--queries 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from similarity import SimilarityIndex  # noqa: E402
+
+FREQUENCY_BANDS = [20, 31, 50, 80, 125, 200, 315, 500, 800, 1250, 2000, 3150, 5000, 8000, 12500, 20000]
+BASS_BANDS = [20, 40, 60, 80, 100, 150, 200]
+
+
+def curve(rng, family, bands):
+    levels = np.clip(family[:len(bands)] + rng.normal(0, 0.03, len(bands)), 0, 1)
+    return json.dumps({str(band): float(level) for band, level in zip(bands, levels)})
+
+
+def build(args, ivf_threshold):
+    rng = np.random.default_rng(0)
+    families = rng.uniform(0.5, 1.0, (args.families, len(FREQUENCY_BANDS)))
+    index = SimilarityIndex(ivf_threshold=ivf_threshold)
+    tests = [(f"Model {i}", curve(rng, families[i % args.families], FREQUENCY_BANDS),
+              curve(rng, families[i % args.families], BASS_BANDS)) for i in range(args.models)]
+    start = time.perf_counter()
+    for model, frequency_response, bass_response in tests:
+        index.add(model, "frequency_response", frequency_response)
+        index.add(model, "bass_response", bass_response)
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    index.nearest("Model 0", args.k)  # embeds every model, and clusters them above the threshold
+    return index, added, time.perf_counter() - start, tests
+
+
+def timed_queries(index, models, k):
+    start = time.perf_counter()
+    results = [index.nearest(model, k) for model in models]
+    return (time.perf_counter() - start) / len(models) * 1e3, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--models', type=int, default=100000)
+    parser.add_argument('--families', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    queries = [f"Model {i}" for i in np.random.default_rng(1).choice(args.models, args.queries, replace=False)]
+    exact_index, added, embedded, tests = build(args, ivf_threshold=args.models + 1)
+    ivf_index, _, clustered, _ = build(args, ivf_threshold=1)
+    print(f"{args.models} models: {added / (2 * args.models) * 1e6:.1f} us per test added, "
+          f"{embedded:.2f} s to embed all, {clustered:.2f} s to embed and cluster all")
+
+    exact_ms, exact = timed_queries(exact_index, queries, args.k)
+    print(f"{'brute force':<24}{exact_ms:>8.2f} ms per query")
+    ivf_ms, approximate = timed_queries(ivf_index, queries, args.k)
+    recall = np.mean([len({m for m, _ in a} & {m for m, _ in e}) / args.k for a, e in zip(approximate, exact)])
+    print(f"{'clustered (IVF)':<24}{ivf_ms:>8.2f} ms per query, recall@{args.k} {recall:.3f}")
+
+    rng = np.random.default_rng(2)
+    start = time.perf_counter()
+    for model in queries:
+        _, frequency_response, _ = tests[rng.integers(args.models)]
+        ivf_index.add(model, "frequency_response", frequency_response)
+        ivf_index.nearest(model, args.k)
+    print(f"{'write + clustered query':<24}{(time.perf_counter() - start) / len(queries) * 1e3:>8.2f} ms")
+    if recall < 0.9:
+        sys.exit(f"FAIL: clustered index recall {recall:.3f} is below 0.9")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Measure SQLiteStorage insert throughput with several worker processes sharing one database.
+
+Usage: python benchmarks/bench_sqlite_writes.py [--workers 4] [--writes 5000]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlite_storage import SQLiteStorage, _dict_to_row, insert_rows  # noqa: E402
+
+
+def make_test():
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "speaker_model": "KEF Q150",
+        "test_type": "distortion",
+        "score": 80.0,
+        "user_rating": None,
+        "additional_data": json.dumps({"distortion_percentage": 2.0})
+    }
+
+
+def write_behind_worker(path, writes, start_event):
+    storage = SQLiteStorage(path)
+    start_event.wait()
+    for _ in range(writes):
+        storage.add_test(make_test())
+    storage.flush()
+
+
+def commit_per_insert_worker(path, writes, start_event):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    start_event.wait()
+    for _ in range(writes):
+        with conn:
+            insert_rows(conn, [_dict_to_row(make_test())])
+
+
+def run(target, path, workers, writes):
+    start_event = multiprocessing.Event()
+    procs = [multiprocessing.Process(target=target, args=(path, writes, start_event)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    time.sleep(1)  # let every worker open its connection and seed check
+    start = time.perf_counter()
+    start_event.set()
+    for proc in procs:
+        proc.join()
+    return workers * writes / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=5000, help='inserts per worker')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        SQLiteStorage(path)  # create schema and seed data up front
+        naive = run(commit_per_insert_worker, path, args.workers, args.writes)
+        batched = run(write_behind_worker, path, args.workers, args.writes)
+
+    print(f"{args.workers} workers x {args.writes} inserts")
+    print(f"  commit per insert     {naive:>10,.0f} writes/s")
+    print(f"  write-behind batches  {batched:>10,.0f} writes/s")
+
+
+if __name__ == '__main__':
+    main()
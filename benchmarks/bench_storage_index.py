@@ -0,0 +1,116 @@
+"""Compare MemoryStorage's indexed lookups against the old linear list scans.
+
+Usage: python benchmarks/bench_storage_index.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from speaker_testing import MemoryStorage  # noqa: E402
+
+SPEAKER_MODELS = ["Bose SoundLink", "JBL Flip 5", "Sony WH-1000XM4", "Sonos One",
+                  "Klipsch R-51M", "KEF Q150", "Edifier R1280T", "Polk Audio T15"]
+TEST_TYPES = ["frequency_response", "distortion", "bass_response", "stereo_imaging",
+              "clarity", "max_volume", "dynamic_range", "transient_response",
+              "voice_reproduction", "soundstage"]
+
+
+# The list scans MemoryStorage used before it kept indexes
+def scan_get_test_by_id(tests, test_id):
+    for test in tests:
+        if test["id"] == test_id:
+            return test
+    return None
+
+
+def scan_update_rating(tests, test_id, rating):
+    for test in tests:
+        if test["id"] == test_id:
+            test["user_rating"] = rating
+            return True
+    return False
+
+
+def scan_get_all_tests(tests, speaker_model=None, user_id=None):
+    return [t for t in tests
+            if (speaker_model is None or t.get("speaker_model") == speaker_model) and
+               (user_id is None or t.get("user_id") == user_id)]
+
+
+def scan_get_user_tests(tests, user_id):
+    return [t for t in tests if t.get("user_id") == user_id]
+
+
+def build_storage(size, users):
+    storage = MemoryStorage()
+    rng = random.Random(size)
+    for _ in range(size):
+        storage.add_test({
+            "id": str(uuid.uuid4()),
+            "user_id": rng.choice(users),
+            "timestamp": "2024-01-01T00:00:00",
+            "speaker_model": rng.choice(SPEAKER_MODELS),
+            "test_type": rng.choice(TEST_TYPES),
+            "score": rng.uniform(50, 99),
+            "user_rating": None,
+            "additional_data": None
+        })
+    return storage
+
+
+def timed(fn, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list)
+
+
+def run(size):
+    users = [f"user_{i}" for i in range(1000)]
+    storage = build_storage(size, users)
+    tests = storage.get_all_tests()
+    rng = random.Random(0)
+
+    # Scans get far fewer repetitions so the largest sizes finish in reasonable time
+    scan_reps = max(3, 200000 // size)
+    ids = [(rng.choice(tests)["id"],) for _ in range(1000)]
+    models = [(rng.choice(SPEAKER_MODELS),) for _ in range(20)]
+    user_ids = [(rng.choice(users),) for _ in range(200)]
+
+    rows = [
+        ("get_test_by_id",
+         timed(lambda i: scan_get_test_by_id(tests, i), ids[:scan_reps]),
+         timed(storage.get_test_by_id, ids)),
+        ("update_rating",
+         timed(lambda i: scan_update_rating(tests, i, 4), ids[:scan_reps]),
+         timed(lambda i: storage.update_rating(i, 4), ids)),
+        ("get_all_tests(model)",
+         timed(lambda m: scan_get_all_tests(tests, speaker_model=m), models[:scan_reps]),
+         timed(lambda m: storage.get_all_tests(speaker_model=m), models)),
+        ("get_all_tests(model, user)",
+         timed(lambda m: scan_get_all_tests(tests, m, users[0]), models[:scan_reps]),
+         timed(lambda m: storage.get_all_tests(m, users[0]), models)),
+        ("get_user_tests",
+         timed(lambda u: scan_get_user_tests(tests, u), user_ids[:scan_reps]),
+         timed(storage.get_user_tests, user_ids)),
+    ]
+
+    print(f"\n{size:,} rows")
+    print(f"{'operation':<28}{'list scan':>14}{'indexed':>14}{'speedup':>10}")
+    for name, scan_time, index_time in rows:
+        print(f"{name:<28}{scan_time * 1e6:>11.1f} us{index_time * 1e6:>11.1f} us"
+              f"{scan_time / index_time:>9.0f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma-separated row counts to benchmark')
+    args = parser.parse_args()
+    for size in args.sizes.split(','):
+        run(int(size))
@@ -0,0 +1,143 @@
+"""Calls to a shared storage server from several worker processes, versus in-process storage.
+
+Starts storage_server.py over --backend on a temporary socket, then:
+- checks that list results (get_all_tests, get_user_tests) come back whole;
+- times single calls in-process, through the socket, pipelined, and from the
+  shared-memory snapshot;
+- has --workers processes each store --writes tests and rate them, and checks
+  that every test and rating is visible to every other client and, once
+  republished, in the snapshot.
+
+Usage: python benchmarks/bench_storage_server.py [--backend memory|columnar|sqlite]
+       [--workers 4] [--writes 2000] [--calls 5000]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage_server import SNAPSHOT_INTERVAL, RemoteStorage, start_server_process  # noqa: E402
+
+
+def make_test(worker):
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "speaker_model": f"Bench {worker}",
+        "test_type": "distortion",
+        "score": 80.0,
+        "user_rating": None,
+        "additional_data": json.dumps({"distortion_percentage": 2.0})
+    }
+
+
+def writer(path, worker, writes, start_event):
+    storage = RemoteStorage(path)
+    storage.get_test_by_id('warm-up')
+    start_event.wait()
+    for _ in range(writes):
+        test = make_test(worker)
+        storage.add_test(test)
+        storage.update_rating(test["id"], 5)
+
+
+def timed(label, calls, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<34}{elapsed / calls * 1e6:>9.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'columnar', 'sqlite'], default='memory',
+                        help='storage the server holds')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=2000, help='tests stored (and rated) per worker')
+    parser.add_argument('--calls', type=int, default=5000, help='calls per latency measurement')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'storage.sock')
+        os.environ['SPEAKER_DB_PATH'] = os.path.join(tmp, 'speaker_tests.db')
+        server = start_server_process(path, args.backend)
+        try:
+            from speaker_testing import MemoryStorage
+            local, remote = MemoryStorage(), RemoteStorage(path)
+
+            # Backends may return lazy views of their rows; clients get plain lists
+            every_test = remote.get_all_tests(include_historical=True)
+            total = remote.get_analytics_summary(include_historical=True)["total_tests"]
+            if not isinstance(every_test, list) or len(every_test) != total:
+                sys.exit(f"FAIL: get_all_tests returned {type(every_test).__name__} of {len(every_test)} tests, "
+                         f"expected a list of {total}")
+            if not isinstance(remote.get_user_tests(), list):
+                sys.exit("FAIL: get_user_tests did not return a list")
+            test_id = remote.get_all_tests()[0]["id"]
+            local_id = next(iter(local.iter_tests()))["id"]
+
+            def pipelined():
+                with remote.pipeline() as pipe:
+                    for _ in range(args.calls):
+                        pipe.get_test_by_id(test_id)
+
+            def through_server():
+                for _ in range(args.calls):
+                    with remote.pipeline() as pipe:
+                        pipe.get_analytics_summary()
+
+            print(f"{args.calls} calls")
+            timed("get_test_by_id, in-process", args.calls,
+                  lambda: [local.get_test_by_id(local_id) for _ in range(args.calls)])
+            timed("get_test_by_id, one per round trip", args.calls,
+                  lambda: [remote.get_test_by_id(test_id) for _ in range(args.calls)])
+            timed("get_test_by_id, pipelined", args.calls, pipelined)
+            timed("get_analytics_summary, in-process", args.calls,
+                  lambda: [local.get_analytics_summary() for _ in range(args.calls)])
+            timed("get_analytics_summary, server call", args.calls, through_server)
+            timed("get_analytics_summary, snapshot", args.calls,
+                  lambda: [remote.get_analytics_summary() for _ in range(args.calls)])
+
+            before = remote.get_analytics_summary(include_historical=True)["total_tests"]
+            start_event = multiprocessing.Event()
+            procs = [multiprocessing.Process(target=writer, args=(path, worker, args.writes, start_event))
+                     for worker in range(args.workers)]
+            for proc in procs:
+                proc.start()
+            time.sleep(1)  # let every worker connect
+            start = time.perf_counter()
+            start_event.set()
+            for proc in procs:
+                proc.join()
+            elapsed = time.perf_counter() - start
+            print(f"{args.workers} workers x {args.writes} stores + ratings: "
+                  f"{2 * args.workers * args.writes / elapsed:,.0f} calls/s")
+
+            expected = args.workers * args.writes
+            stored = remote.get_analytics_summary(include_historical=True)["total_tests"] - before
+            rated = sum(1 for worker in range(args.workers)
+                        for test in remote.iter_tests(speaker_model=f"Bench {worker}") if test["user_rating"] == 5)
+            if stored != expected or rated != expected:
+                sys.exit(f"FAIL: {stored} tests and {rated} ratings visible, expected {expected}")
+            time.sleep(2 * SNAPSHOT_INTERVAL)
+            published = RemoteStorage(path).get_analytics_summary()
+            with remote.pipeline() as pipe:
+                current = pipe.get_analytics_summary()
+            if published != current.result():
+                sys.exit(f"FAIL: the snapshot shows {published['total_tests']} tests, "
+                         f"the server {current.result()['total_tests']}")
+            print(f"every worker's {args.writes} tests and ratings are visible to the others and in the snapshot")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Latency of /analytics/trends range queries from the rollups, against scanning raw records.
+
+Fills a storage backend with --records tests spread over the past year,
+then asks for per-day and per-hour averages over the last week, the last 30
+days and the whole year: once by scanning every record and comparing parsed
+timestamps (what answering it without rollups takes), once through
+get_trends. Both must give the same buckets, counts and averages.
+
+Usage: python benchmarks/bench_trends.py [--records 200000] [--backend memory|columnar|sqlite]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from registry import TEST_TYPES  # noqa: E402
+from trends import bucket_start, parse_epoch  # noqa: E402
+
+
+def scan(storage, granularity, start, end, speaker_model=None):
+    """{bucket: [tests, score sum, scored]} from every stored record"""
+    buckets = {}
+    for test in storage.iter_tests(speaker_model=speaker_model, include_historical=True):
+        epoch = parse_epoch(test["timestamp"])
+        if start <= epoch < end:
+            totals = buckets.setdefault(bucket_start(epoch, granularity), [0, 0.0, 0])
+            totals[0] += 1
+            if test["score"] is not None:
+                totals[1] += test["score"]
+                totals[2] += 1
+    return buckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--models', type=int, default=50)
+    parser.add_argument('--backend', choices=['memory', 'columnar', 'sqlite'], default='memory')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        os.environ['SPEAKER_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='trends-'), 'tests.db')
+    from speaker_testing import create_storage
+    storage = create_storage(args.backend)
+    random.seed(0)
+    now = datetime.datetime.now()
+    types = list(TEST_TYPES)
+    tests = [{"id": str(uuid.uuid4()),
+              "timestamp": (now - datetime.timedelta(seconds=random.uniform(0, 365 * 86400))).isoformat(),
+              "speaker_model": f"Model {random.randrange(args.models)}", "test_type": random.choice(types),
+              "score": random.uniform(40, 100), "user_rating": None, "additional_data": None}
+             for _ in range(args.records)]
+    tests.sort(key=lambda test: test["timestamp"])
+    start = time.perf_counter()
+    storage.add_tests(tests)
+    print(f"{args.records} tests over a year in the {args.backend} backend, "
+          f"{(time.perf_counter() - start) / args.records * 1e6:.1f} us per test stored")
+
+    end = parse_epoch(now.isoformat()) + 1
+    print(f"{'query':<32}{'scan':>10}{'rollups':>12}")
+    mismatched = 0
+    for granularity, days, model in [("day", 7, None), ("day", 30, None), ("day", 365, None),
+                                     ("hour", 30, None), ("day", 365, "Model 0")]:
+        start_epoch = bucket_start(end - days * 86400, granularity)
+        begin = time.perf_counter()
+        expected = scan(storage, granularity, start_epoch, end, model)
+        scanned = time.perf_counter() - begin
+        begin = time.perf_counter()
+        for _ in range(args.repeat):
+            result = storage.get_trends(granularity, start_epoch, end, speaker_model=model)
+        rolled = (time.perf_counter() - begin) / args.repeat
+        label = f"{granularity}, last {days} days" + (f", {model}" if model else "")
+        print(f"{label:<32}{scanned * 1e3:>7.1f} ms{rolled * 1e3:>9.2f} ms")
+
+        series = result["series"][0] if result["series"] else {"buckets": [], "average_score": [], "test_count": []}
+        got = {parse_epoch(b): (c, a) for b, a, c in zip(series["buckets"], series["average_score"], series["test_count"])}
+        want = {b: (t[0], t[1] / t[2] if t[2] else None) for b, t in expected.items()}
+        mismatched += sum(1 for b in set(got) | set(want)
+                          if b not in got or b not in want or got[b][0] != want[b][0]
+                          or abs((got[b][1] or 0) - (want[b][1] or 0)) > 1e-6)
+    if mismatched:
+        sys.exit(f"FAIL: {mismatched} buckets differ from the raw scan")
+
+
+if __name__ == '__main__':
+    main()
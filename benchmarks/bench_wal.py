@@ -0,0 +1,149 @@
+"""Cold start of the durable columnar storage from a snapshot plus a log tail.
+
+Stores --records tests in a data directory and snapshots them, then logs
+--tail more tests and ratings after the snapshot, as a process that crashed
+between snapshots would leave them. A fresh interpreter then starts the
+storage from the directory, timing the snapshot load and log replay, and
+must report the same analytics, leaderboard, trends and tests as the
+process that wrote them.
+
+Also times single writes with the log fsynced per record and group-fsynced
+by the background thread.
+
+Usage: python benchmarks/bench_wal.py [--records 1000000] [--tail N] [--dir DIR]
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from columnar_storage import ColumnarStorage  # noqa: E402
+from durability import SNAPSHOT_RECORDS  # noqa: E402
+
+MODELS = [f"Model {i}" for i in range(200)]
+TYPES = ["frequency_response", "distortion", "bass_response", "stereo_imaging", "clarity",
+         "max_volume", "dynamic_range", "transient_response", "voice_reproduction", "soundstage"]
+START = datetime.datetime(2024, 1, 1)
+
+# Run in a fresh interpreter: time the cold start, then print what the storage holds
+CHILD = """
+import json, sys, time
+sys.path[:0] = [{root!r}, {benchmarks!r}]
+start = time.perf_counter()
+from columnar_storage import ColumnarStorage
+imported = time.perf_counter()
+storage = ColumnarStorage({path!r})
+started = time.perf_counter()
+from bench_wal import digest
+print(json.dumps({{"import": imported - start, "start": started - imported,
+                  "digest": digest(storage, {sample_ids!r})}}))
+"""
+
+
+def digest(storage, sample_ids):
+    """JSON-comparable summary of what a storage holds"""
+    return {
+        "summary": storage.get_analytics_summary(),
+        "all": storage.get_analytics_summary(include_historical=True),
+        "best": storage.get_best_speakers(limit=20),
+        "trends": storage.get_trends("day", group_by="test_type"),
+        "tests": [storage.get_test_by_id(test_id) for test_id in sample_ids],
+        "user_tests": len(storage.get_user_tests("user-7"))
+    }
+
+
+def make_test(rng, i):
+    test_type = TYPES[0] if i % 10 == 0 else rng.choice(TYPES[1:])
+    if test_type == "frequency_response":
+        additional_data = json.dumps({str(f): round(rng.uniform(0.6, 1.0), 3) for f in (100, 1000, 10000)})
+    else:
+        additional_data = json.dumps({"level": round(rng.uniform(0, 10), 2)})
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "timestamp": (START + datetime.timedelta(seconds=rng.randrange(90 * 86400))).isoformat(),
+        "speaker_model": rng.choice(MODELS),
+        "test_type": test_type,
+        "score": round(rng.uniform(40, 100), 2),
+        "user_rating": None,
+        "additional_data": additional_data,
+        "user_id": f"user-{rng.randrange(10000)}"
+    }
+
+
+def write_latency(path, sync_interval, writes=500):
+    storage = ColumnarStorage(path, sync_interval=sync_interval)
+    rng = random.Random(1)
+    tests = [make_test(rng, i) for i in range(writes)]
+    start = time.perf_counter()
+    for test in tests:
+        storage.add_test(test)
+    elapsed = time.perf_counter() - start
+    storage.close()
+    return elapsed / writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=1000000, help='tests in the snapshot')
+    parser.add_argument('--tail', type=int, default=SNAPSHOT_RECORDS,
+                        help='tests logged after the snapshot (default: the most a running storage leaves)')
+    parser.add_argument('--dir', help='data directory (default: a temporary one)')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = args.dir or os.path.join(tmp, 'data')
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        print(f"add_test, fsync per record:   {write_latency(os.path.join(tmp, 'sync'), 0) * 1e6:9.1f} us")
+        print(f"add_test, group fsync:        {write_latency(os.path.join(tmp, 'group'), 0.05) * 1e6:9.1f} us")
+
+        storage = ColumnarStorage(path, snapshot_records=args.records + 2 * args.tail + 1000)
+        rng = random.Random(0)
+        sample_ids = []
+        every = max(1, (args.records + args.tail) // 1000)
+        start = time.perf_counter()
+        for i in range(args.records + args.tail):
+            if i == args.records:
+                print(f"stored {args.records:,} tests in {time.perf_counter() - start:.1f} s")
+                snapshot_start = time.perf_counter()
+                storage.snapshot()
+                size = sum(os.path.getsize(os.path.join(root, name))
+                           for root, _, names in os.walk(path) for name in names)
+                print(f"snapshot written in {time.perf_counter() - snapshot_start:.2f} s, {size / 1e6:,.0f} MB")
+            test = make_test(rng, i)
+            storage.add_test(test)
+            if i % every == 0:
+                sample_ids.append(test["id"])
+            if i % 3 == 0:
+                storage.update_rating(sample_ids[rng.randrange(len(sample_ids))], rng.randint(1, 5))
+        storage.update_scores([(test_id, 50.0) for test_id in sample_ids[::7]])
+        expected = json.loads(json.dumps(digest(storage, sample_ids)))
+        storage.close()
+        del storage
+
+        child = CHILD.format(root=ROOT, benchmarks=os.path.dirname(os.path.abspath(__file__)),
+                             path=path, sample_ids=sample_ids)
+        result = json.loads(subprocess.run([sys.executable, '-c', child], check=True,
+                                           capture_output=True, text=True).stdout)
+        print(f"cold start with {args.records + args.tail:,} tests ({args.tail:,} replayed from the log): "
+              f"{result['start']:.2f} s (+{result['import']:.2f} s imports)")
+        if result["digest"] != expected:
+            differing = [key for key in expected if expected[key] != result["digest"][key]]
+            sys.exit(f"FAIL: the restarted storage differs in {differing}")
+        print("the restarted storage holds the same tests, ratings, scores and aggregates")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
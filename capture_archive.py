@@ -0,0 +1,239 @@
+"""Append-only archive of raw capture audio, read back through numpy.memmap.
+
+Captures are appended as little-endian float32 samples to segment files
+(``segment-000001.f32``, ...) and indexed in ``index.bin``, a file of
+fixed-size binary records: test id, segment, sample rate, offset and length.
+Reading a capture maps just its byte range of the segment, so nothing is
+copied or loaded until the samples are touched, and a sweep over the whole
+archive holds at most one capture's pages at a time.
+
+Each writer appends to a segment no other writer is using, and a segment is
+only ever appended to by the process that created it, so several processes
+can share one archive directory; index records are single O_APPEND writes.
+A capture becomes visible once its index record is written, after its
+samples. Segments roll over once they reach segment_bytes; a capture is never
+split across segments.
+"""
+import os
+import threading
+import uuid
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype('<f4')
+
+INDEX_DTYPE = np.dtype([
+    ('id', 'V16'),  # uuid bytes of the test id (V, not S: S would strip trailing zero bytes)
+    ('segment', '<u4'),
+    ('sample_rate', '<u4'),
+    ('offset', '<u8'),  # in samples
+    ('length', '<u8')
+])
+
+
+def _id_bytes(test_id):
+    try:
+        return uuid.UUID(test_id).bytes
+    except (TypeError, ValueError):
+        raise ValueError(f"Archived test ids must be UUIDs: {test_id!r}")
+
+
+class Capture:
+    """Location of one archived capture; samples are mapped on first access"""
+    def __init__(self, archive, test_id, segment, sample_rate, offset, length):
+        self.archive = archive
+        self.test_id = test_id
+        self.segment = segment
+        self.sample_rate = sample_rate
+        self.offset = offset
+        self.length = length
+        self._samples = None
+
+    @property
+    def duration(self):
+        return self.length / self.sample_rate
+
+    @property
+    def nbytes(self):
+        return self.length * SAMPLE_DTYPE.itemsize
+
+    @property
+    def samples(self):
+        """Read-only float32 memmap of the capture"""
+        if self._samples is None:
+            if not self.length:
+                self._samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+            else:
+                self._samples = np.memmap(self.archive.segment_path(self.segment), dtype=SAMPLE_DTYPE, mode='r',
+                                          offset=self.offset * SAMPLE_DTYPE.itemsize, shape=(self.length,))
+        return self._samples
+
+    def metadata(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "samples": self.length,
+            "duration": self.duration
+        }
+
+
+class CaptureWriter:
+    """Appends one capture, block by block, to a segment held for the writer's lifetime.
+
+    Use as a context manager: leaving the block without commit() truncates
+    the segment back, so a failed upload leaves nothing behind.
+    """
+    def __init__(self, archive, segment, file):
+        self.archive = archive
+        self.segment = segment
+        self.sample_rate = None
+        self.length = 0
+        self._file = file
+        self._start = file.tell()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._closed:
+            self.abort()
+
+    def append(self, sample_rate, samples):
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+        elif sample_rate != self.sample_rate:
+            raise ValueError("A capture has a single sample rate")
+        self._file.write(np.ascontiguousarray(samples, dtype=SAMPLE_DTYPE).data)
+        self.length += len(samples)
+
+    def commit(self, test_ids):
+        """Index the capture under every test id in `test_ids`"""
+        self._file.flush()
+        records = np.zeros(len(test_ids), dtype=INDEX_DTYPE)
+        records['id'] = [_id_bytes(test_id) for test_id in test_ids]
+        records['segment'] = self.segment
+        records['sample_rate'] = self.sample_rate or 0
+        records['offset'] = self._start // SAMPLE_DTYPE.itemsize
+        records['length'] = self.length
+        self.archive._add_records(records)
+        self._release()
+
+    def abort(self):
+        self._file.seek(self._start)
+        self._file.truncate()
+        self._release()
+
+    def _release(self):
+        self._closed = True
+        self.archive._release_segment(self.segment, self._file)
+
+
+class CaptureArchive:
+    def __init__(self, directory, segment_bytes=2**30):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.bin')
+        self._index_fd = os.open(self._index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._entries = {}  # id bytes -> index record
+        self._index_read = 0  # bytes of index.bin loaded so far
+        self._free = []  # (segment, open file) created by this process and not being written
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, test_id):
+        return self.get(test_id) is not None
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'segment-{segment:06d}.f32')
+
+    def refresh(self):
+        """Load index records appended since the last refresh, e.g. by other processes"""
+        with self._lock:
+            with open(self._index_path, 'rb') as f:
+                f.seek(self._index_read)
+                data = f.read()
+            # A record being appended concurrently may be incomplete; it is read next time
+            count = len(data) // INDEX_DTYPE.itemsize
+            records = np.frombuffer(data, dtype=INDEX_DTYPE, count=count)
+            self._index_read += count * INDEX_DTYPE.itemsize
+            self._entries.update(zip(records['id'].tolist(), records))
+
+    def get(self, test_id):
+        """The Capture archived for a test, or None"""
+        try:
+            key = _id_bytes(test_id)
+        except ValueError:
+            return None
+        record = self._entries.get(key)
+        if record is None:
+            self.refresh()
+            record = self._entries.get(key)
+            if record is None:
+                return None
+        return Capture(self, test_id, int(record['segment']), int(record['sample_rate']),
+                       int(record['offset']), int(record['length']))
+
+    def captures(self, test_ids=None):
+        """Iterate over archived captures (all, or those of test_ids) in segment order, for sequential reads"""
+        self.refresh()
+        if test_ids is None:
+            keys = list(self._entries)
+        else:
+            keys = [key for key in map(_id_bytes, test_ids) if key in self._entries]
+        records = [self._entries[key] for key in keys]
+        order = sorted(range(len(records)), key=lambda i: (int(records[i]['segment']), int(records[i]['offset'])))
+        for i in order:
+            record = records[i]
+            yield Capture(self, str(uuid.UUID(bytes=keys[i])), int(record['segment']),
+                          int(record['sample_rate']), int(record['offset']), int(record['length']))
+
+    def writer(self):
+        """CaptureWriter on a segment with room left, creating a segment if every one is full or busy"""
+        with self._lock:
+            while self._free:
+                segment, file = self._free.pop()
+                if file.tell() < self.segment_bytes:
+                    return CaptureWriter(self, segment, file)
+                file.close()
+        segment, file = self._create_segment()
+        return CaptureWriter(self, segment, file)
+
+    def append(self, test_ids, sample_rate, samples):
+        """Archive a whole capture under one or more test ids"""
+        with self.writer() as writer:
+            writer.append(sample_rate, samples)
+            writer.commit(test_ids)
+
+    def close(self):
+        with self._lock:
+            for _, file in self._free:
+                file.close()
+            self._free = []
+            if self._index_fd is not None:
+                os.close(self._index_fd)
+                self._index_fd = None
+
+    def _create_segment(self):
+        segment = 1 + max((int(name[8:14]) for name in os.listdir(self.directory)
+                           if name.startswith('segment-') and name.endswith('.f32')), default=0)
+        while True:
+            try:
+                # O_EXCL: a segment belongs to the process that created it
+                fd = os.open(self.segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                segment += 1
+                continue
+            return segment, os.fdopen(fd, 'wb')
+
+    def _release_segment(self, segment, file):
+        with self._lock:
+            self._free.append((segment, file))
+
+    def _add_records(self, records):
+        with self._lock:
+            os.write(self._index_fd, records.tobytes())
+            self._entries.update(zip(records['id'].tolist(), records.copy()))
@@ -0,0 +1,476 @@
+"""Columnar, NumPy-backed storage backend.
+
+Scores, timestamps and ratings live in typed NumPy arrays, speaker models,
+test types and user ids are dictionary-encoded into integer codes, and test
+ids and the ``additional_data`` JSON are packed into byte buffers. Rows are
+only turned back into dicts when a route actually returns them.
+
+Given a data directory, every write is also appended to a write-ahead log
+and the state is snapshotted as NumPy arrays every SNAPSHOT_RECORDS logged
+writes (see durability.py), so a restart maps the latest snapshot and
+replays only the log written since.
+"""
+import atexit
+import bisect
+import copy
+import hashlib
+import logging
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+
+from aggregates import RunningAggregates
+from analytics_engine import AnalyticsEngine, Column, StringTable, encode_rating
+from durability import (DataDirectory, WriteAheadLog, WAL_SYNC_INTERVAL, SNAPSHOT_RECORDS, OP_ADD, OP_RATE,
+                        OP_SCORES, add_record, rating_record, scores_record, session_record, parse_record)
+from storage_common import (sample_tests, historical_tests, iter_csv,
+                            timestamp_to_epoch_us, epoch_us_to_timestamp)
+
+logger = logging.getLogger(__name__)
+
+
+def id_key(test_id):
+    """64-bit hash of a test id, the same in every process"""
+    return int.from_bytes(hashlib.blake2b(test_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class TextColumn:
+    """Strings (or None) packed as UTF-8 into byte buffers, addressed by offset and length.
+
+    New strings go to a bytearray. Taking a snapshot freezes it into a chunk
+    that is never written again, so the snapshot can be saved while strings
+    are appended; bytes restored from a snapshot stay in their memory map.
+    """
+    def __init__(self, base=None):
+        self.offset = Column(np.int64)
+        self.length = Column(np.int32)  # -1 for None
+        self._chunks = [] if base is None else [memoryview(base)]
+        self._starts = [0] if base is None else [0, len(base)]  # offset of each chunk, then of the open buffer
+        self._tail = bytearray()
+
+    def append(self, value):
+        if value is None:
+            self.offset.append(0)
+            self.length.append(-1)
+            return
+        encoded = value.encode('utf-8')
+        self.offset.append(self._starts[-1] + len(self._tail))
+        self.length.append(len(encoded))
+        self._tail += encoded
+
+    def __getitem__(self, row):
+        length = self.length[row]
+        if length < 0:
+            return None
+        offset = int(self.offset[row])
+        start = self._starts[-1]
+        if offset >= start:
+            return self._tail[offset - start:offset - start + length].decode('utf-8')
+        i = bisect.bisect_right(self._starts, offset) - 1
+        offset -= self._starts[i]
+        return str(self._chunks[i][offset:offset + length], 'utf-8')
+
+    def state(self):
+        """Offsets, lengths and every chunk of bytes, freezing the open buffer first"""
+        if self._tail:
+            self._chunks.append(memoryview(bytes(self._tail)))
+            self._starts.append(self._starts[-1] + len(self._tail))
+            self._tail = bytearray()
+        return {"offset": self.offset.frozen(), "length": self.length.frozen(),
+                "bytes": [np.frombuffer(chunk, dtype=np.uint8) for chunk in self._chunks] or [np.empty(0, np.uint8)]}
+
+    @classmethod
+    def from_state(cls, state):
+        column = cls(state["bytes"])
+        column.offset = state["offset"]
+        column.length = state["length"]
+        return column
+
+
+class _IdIndex:
+    """Test id -> row of its latest version.
+
+    Ids restored from a snapshot are found by binary search over their sorted
+    hashes, which load with the snapshot; ids stored since are kept in a dict.
+    """
+    def __init__(self, ids, sorted_keys=None, order=None):
+        self._ids = ids
+        self._sorted_keys = np.empty(0, dtype=np.uint64) if sorted_keys is None else sorted_keys
+        self._order = order  # row of each sorted key, ascending among equal keys
+        self._recent = {}
+
+    def add(self, test_id, row):
+        self._recent[test_id] = row
+
+    def get(self, test_id):
+        row = self._recent.get(test_id)
+        if row is not None or not len(self._sorted_keys):
+            return row
+        keys = self._sorted_keys
+        key = np.uint64(id_key(test_id))
+        i = int(np.searchsorted(keys, key))
+        while i < len(keys) and keys[i] == key:
+            if self._ids[self._order[i]] == test_id:
+                row = int(self._order[i])
+            i += 1
+        return row
+
+
+class _RowView(Sequence):
+    """Read-only list of test dicts, materialized one row at a time on access"""
+    def __init__(self, storage, rows):
+        self._storage = storage
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _RowView(self._storage, self._rows[index])
+        with self._storage._lock:
+            return self._storage._row_to_dict(self._rows[index])
+
+    def __iter__(self):
+        # The lock is taken per row, so a long export does not hold up writers
+        lock, row_to_dict = self._storage._lock, self._storage._row_to_dict
+        for row in self._rows:
+            with lock:
+                test = row_to_dict(row)
+            yield test
+
+
+class ColumnarStorage:
+    """Test storage in NumPy columns, safe to share between request threads.
+
+    Every call that reads or writes the columns holds one lock (reentrant, as
+    writes nest: add_tests, log replay, snapshots). Rows returned as views are
+    materialized under the lock one at a time.
+    """
+    thread_safe = True
+
+    def __init__(self, data_dir=None, sync_interval=WAL_SYNC_INTERVAL, snapshot_records=SNAPSHOT_RECORDS):
+        self._lock = threading.RLock()
+        self._log = None
+        self._directory = None
+        self._snapshot_records = snapshot_records
+        self._snapshot_thread = None
+        self._logged = 0  # records logged since the last snapshot
+
+        if data_dir is None:
+            self._restore(None)
+        else:
+            self._directory = DataDirectory(data_dir)
+            covered, state = self._directory.load_snapshot()
+            self._restore(state)
+            segments = [segment for segment in self._directory.log_segments() if segment > covered]
+            for segment in segments:
+                for payload in self._directory.read_log(segment):
+                    self._replay(payload)
+                    self._logged += 1
+            self._log = WriteAheadLog(self._directory, max(segments, default=covered) + 1, sync_interval)
+            atexit.register(self.close)
+
+        if not len(self.engine):
+            # Add some sample data
+            for test in sample_tests():
+                self.add_test(test)
+            for test in historical_tests():
+                self._add_historical(test)
+
+    def _restore(self, state):
+        """Take over the state of a snapshot, or start empty for None"""
+        if state is None:
+            self.users = set()
+            # Model, test type, score, rating and historical flag columns live in the
+            # engine; the storage adds the columns only needed to rebuild full rows.
+            self.engine = AnalyticsEngine()
+            self._ids = TextColumn()
+            self._id_keys = Column(np.uint64)
+            self._index = _IdIndex(self._ids)
+            self._timestamp = Column(np.int64)        # microseconds since the epoch
+            self._user_code = Column(np.int32)
+            self._data = TextColumn()                 # additional_data
+            self._user_ids = StringTable()
+            self.aggregates = RunningAggregates()  # Summary of current (non-historical) tests
+            return
+
+        self.users = set(state["users"])
+        self.engine = AnalyticsEngine.from_state(state["engine"])
+        self._ids = TextColumn.from_state(state["ids"])
+        self._id_keys = state["id_keys"]
+        self._index = _IdIndex(self._ids, state["id_sorted_keys"], state["id_order"])
+        self._timestamp = state["timestamp"]
+        self._user_code = state["user_code"]
+        self._data = TextColumn.from_state(state["data"])
+        self._user_ids = StringTable.from_values(state["user_ids"])
+        self.aggregates = state["aggregates"]
+
+    def _state(self):
+        """Everything a snapshot holds, as of now; see AnalyticsEngine.state"""
+        return {
+            "users": list(self.users),
+            "engine": self.engine.state(),
+            "ids": self._ids.state(),
+            "id_keys": self._id_keys.frozen(),
+            "timestamp": self._timestamp.frozen(),
+            "user_code": self._user_code.frozen(),
+            "data": self._data.state(),
+            "user_ids": list(self._user_ids.values),
+            "aggregates": copy.deepcopy(self.aggregates)
+        }
+
+    def _replay(self, payload):
+        op, args = parse_record(payload)
+        if op == OP_ADD:
+            test, historical = args
+            if historical:
+                self._add_historical(test)
+            else:
+                self.add_test(test)
+        elif op == OP_RATE:
+            self.update_rating(*args)
+        elif op == OP_SCORES:
+            self.update_scores(*args)
+        else:
+            self.set_user_session(*args)
+
+    def _write_log(self, payload):
+        """Log a write that has been applied, snapshotting once enough have been logged"""
+        self._log.append(payload)
+        self._logged += 1
+        if self._logged >= self._snapshot_records:
+            self.snapshot(wait=False)
+
+    def snapshot(self, wait=True):
+        """Snapshot the current state and drop the logs it covers; returns False without a data directory,
+        or if wait is False and the previous snapshot is still being written"""
+        with self._lock:
+            if self._log is None:
+                return False
+            if self._snapshot_thread is not None:
+                if not wait and self._snapshot_thread.is_alive():
+                    return False
+                self._snapshot_thread.join()
+            segment = self._log.rotate()
+            state = self._state()
+            self._logged = 0
+            self._snapshot_thread = threading.Thread(target=self._write_snapshot, args=(segment, state),
+                                                     name="columnar-snapshot", daemon=True)
+            self._snapshot_thread.start()
+            if wait:
+                self._snapshot_thread.join()
+            return True
+
+    def _write_snapshot(self, segment, state):
+        try:
+            keys = state["id_keys"].values
+            state["id_order"] = np.argsort(keys, kind='stable')
+            state["id_sorted_keys"] = keys[state["id_order"]]
+            self._directory.write_snapshot(segment, state)
+        except Exception:
+            logger.exception("Failed to write the snapshot of log segment %d", segment)
+
+    def flush(self):
+        """Wait until every logged write is on disk"""
+        if self._log is not None:
+            self._log.sync()
+
+    def close(self):
+        """Sync the log and release the data directory"""
+        with self._lock:
+            if self._log is None:
+                return
+            if self._snapshot_thread is not None:
+                self._snapshot_thread.join()
+            self._log.close()
+            self._directory.close()
+            self._log = None
+
+    def _append(self, test, historical=False):
+        """Store a test in the engine and the row columns, or (raising) in neither"""
+        # Everything that can reject the test runs before any column is written;
+        # engine.add itself validates the whole row before appending
+        test_id = test["id"]
+        timestamp = timestamp_to_epoch_us(test["timestamp"])
+        key = id_key(test_id) if self._directory is not None else None
+        additional_data = test.get("additional_data")
+        if not isinstance(test_id, str) or not isinstance(additional_data, (str, type(None))):
+            raise TypeError("A test's id and additional_data must be strings")
+        row = self.engine.add(test, historical)
+        self._index.add(test_id, row)
+        self._ids.append(test_id)
+        if key is not None:
+            self._id_keys.append(key)
+        self._timestamp.append(timestamp)
+        self._user_code.append(self._user_ids.encode(test.get("user_id")))
+        self._data.append(additional_data)
+
+    def _add_historical(self, test):
+        self._append(test, historical=True)
+        if self._log is not None:
+            self._write_log(add_record(test, True, encode_rating(test.get("user_rating"))))
+
+    def _row_to_dict(self, row):
+        engine = self.engine
+        score = engine.score[row]
+        rating = engine.user_rating[row]
+        test = {
+            "id": self._ids[row],
+            "timestamp": epoch_us_to_timestamp(self._timestamp[row]),
+            "speaker_model": engine.models.values[engine.model_code[row]],
+            "test_type": engine.types.values[engine.type_code[row]],
+            "score": None if np.isnan(score) else float(score),
+            "user_rating": int(rating) if rating else None,
+            "additional_data": self._data[row]
+        }
+        if engine.historical[row]:
+            test["is_historical"] = True
+        user_id = self._user_ids.values[self._user_code[row]]
+        if user_id is not None:
+            test["user_id"] = user_id
+        return test
+
+    @property
+    def tests(self):
+        with self._lock:
+            return _RowView(self, np.flatnonzero(~self.engine.historical.values))
+
+    @property
+    def historical_data(self):
+        with self._lock:
+            return _RowView(self, np.flatnonzero(self.engine.historical.values))
+
+    def set_user_session(self, user_id):
+        """Register a testing session; its tests carry its id as their user_id"""
+        with self._lock:
+            self.users.add(user_id)
+            if self._log is not None:
+                self._write_log(session_record(user_id))
+            return user_id
+
+    def add_test(self, test_data):
+        with self._lock:
+            self._append(test_data)
+            self.aggregates.add(test_data)
+            if self._log is not None:
+                self._write_log(add_record(test_data, False, encode_rating(test_data.get("user_rating"))))
+            return test_data["id"]
+
+    def add_tests(self, tests):
+        """Add several tests at once; returns their ids"""
+        with self._lock:
+            return [self.add_test(test_data) for test_data in tests]
+
+    def update_rating(self, test_id, rating):
+        with self._lock:
+            row = self._index.get(test_id)
+            if row is None or self.engine.historical[row]:
+                return False
+            old_rating = int(self.engine.user_rating[row]) or None
+            self.engine.set_rating(row, rating)
+            self.aggregates.rating_changed(old_rating, rating)
+            if self._log is not None:
+                self._write_log(rating_record(test_id, encode_rating(rating)))
+            return True
+
+    def update_scores(self, scores):
+        """Set the score of many tests from (test_id, score) pairs; returns how many were found"""
+        with self._lock:
+            engine = self.engine
+            updated = []
+            for test_id, score in scores:
+                row = self._index.get(test_id)
+                if row is None:
+                    continue
+                if not engine.historical[row]:
+                    old_score = engine.score[row]
+                    self.aggregates.score_changed(engine.models.values[engine.model_code[row]],
+                                                  None if np.isnan(old_score) else float(old_score), score)
+                engine.set_score(row, score)
+                updated.append((test_id, score))
+            if self._log is not None and updated:
+                self._write_log(scores_record(updated))
+            return len(updated)
+
+    def get_all_tests(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        with self._lock:
+            mask = self.engine.rows_matching(speaker_model, test_type, include_historical=True)
+            if mask is not None and user_id is not None:
+                code = self._user_ids.lookup(user_id)
+                mask = None if code is None else mask & (self._user_code.values == code)
+            if mask is None:
+                return _RowView(self, np.empty(0, dtype=np.intp))
+
+            # Current tests first, then historical ones
+            historical = self.engine.historical.values
+            rows = np.flatnonzero(mask & ~historical)
+            if include_historical:
+                rows = np.concatenate([rows, np.flatnonzero(mask & historical)])
+            return _RowView(self, rows)
+
+    def get_test_by_id(self, test_id):
+        with self._lock:
+            row = self._index.get(test_id)
+            return None if row is None else self._row_to_dict(row)
+
+    def get_user_tests(self, user_id=None):
+        """Get all tests of a testing session"""
+        if not user_id:
+            return []
+
+        return self.get_all_tests(user_id=user_id)
+
+    def iter_tests(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        """Same rows as get_all_tests, yielded one at a time for streaming exports"""
+        return iter(self.get_all_tests(speaker_model, user_id, include_historical, test_type))
+
+    def iter_score_rows(self):
+        """(id, test_type, score, additional_data) of every current and historical test, for rescoring"""
+        with self._lock:
+            engine = self.engine
+            count = len(engine)
+            types = [engine.types.values[code] for code in engine.type_code.values[:count].tolist()]
+            scores = engine.score.values[:count].tolist()
+        for row in range(count):
+            score = scores[row]
+            with self._lock:
+                test_id, additional_data = self._ids[row], self._data[row]
+            yield test_id, types[row], None if score != score else score, additional_data
+
+    def export_user_data(self, user_id=None):
+        """Export the tests of a testing session as a stream of CSV chunks"""
+        return iter_csv(self.get_user_tests(user_id))
+
+    def export_historical_data(self):
+        """Export all historical data as a stream of CSV chunks"""
+        return iter_csv(self.historical_data)
+
+    def get_analytics_summary(self, speaker_model=None, include_historical=False):
+        """Totals, averages and distributions shown on the analytics dashboard"""
+        with self._lock:
+            if speaker_model is None and not include_historical:
+                return self.aggregates.summary()
+            return self.engine.summary(speaker_model, include_historical)
+
+    def get_trends(self, granularity, start=None, end=None, speaker_model=None, test_type=None,
+                   include_historical=True, group_by=None):
+        """Average score and test count per hour, day or week bucket starting in [start, end) (epoch seconds)"""
+        with self._lock:
+            return self.engine.score_trends(granularity, start, end, speaker_model, test_type, include_historical, group_by)
+
+    def get_best_speakers(self, test_types=None, limit=5):
+        """Find the best speakers based on average scores"""
+        with self._lock:
+            return self.engine.best_speakers(test_types, limit)
+
+    def get_personalized_speakers(self, user_ids=None, test_types=None, limit=5):
+        """{user id: best speakers weighted towards the test types that user runs most}; None means every user"""
+        with self._lock:
+            return self.engine.personalized_speakers(user_ids, test_types, limit)
+
+    def similar_speakers(self, speaker_model, limit=5):
+        """[(speaker model, similarity)] of the models that sound most like speaker_model, or None"""
+        with self._lock:
+            return self.engine.similar_speakers(speaker_model, limit)
@@ -0,0 +1,354 @@
+"""Write-ahead log and snapshots that let the columnar backend survive restarts.
+
+A data directory holds:
+
+- ``wal-000001.log``, ``wal-000002.log``, ...: append-only binary logs of
+  every stored test, rating, score update and session, one framed record
+  (length, CRC-32, payload) per call. Records are buffered and a background
+  thread fsyncs them every sync_interval seconds, so one fsync covers every
+  write of the interval; an interval of 0 fsyncs each record before the call
+  returns.
+- ``snapshot-000007/``: the storage state as of the end of ``wal-000007.log``.
+  Each large array is its own ``.npy`` file, loaded as a copy-on-write
+  memory map, so loading costs the same however many tests are stored; the
+  string tables and small counters are pickled in ``state.pickle``.
+
+Starting up loads the newest snapshot and replays only the logs written
+after it. A snapshot is written to a temporary directory and renamed into
+place once complete, after which the logs and snapshots it supersedes are
+deleted; a crash at any point leaves the previous snapshot and its logs
+intact. A record torn by a crash ends its log: replay stops there, and the
+restarted process appends to a fresh log.
+"""
+import fcntl
+import logging
+import os
+import pickle
+import re
+import shutil
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from analytics_engine import Column
+
+logger = logging.getLogger(__name__)
+
+# Seconds between group fsyncs of the log; 0 syncs every record
+WAL_SYNC_INTERVAL = float(os.environ.get('SPEAKER_WAL_SYNC_INTERVAL', 0.05))
+
+# Logged records after which the storage takes a new snapshot, bounding the replay on startup
+SNAPSHOT_RECORDS = int(os.environ.get('SPEAKER_SNAPSHOT_RECORDS', 10000))
+
+# Arrays with at least this many bytes get their own .npy file instead of going into state.pickle
+ARRAY_FILE_BYTES = 1 << 16
+
+# Columns are saved with room for this fraction more rows, so appends after loading do not copy them
+SPARE_ROWS = 0.125
+
+_FRAME = struct.Struct('<II')  # payload length, CRC-32 of the payload
+_LENGTH = struct.Struct('<i')  # UTF-8 length of a string, -1 for None
+_ADD = struct.Struct('<B?dB')  # op, historical, score (NaN for None), rating (0 for None)
+_RATE = struct.Struct('<BB')
+_SCORES = struct.Struct('<BI')
+_SCORE = struct.Struct('<d')
+
+OP_ADD, OP_RATE, OP_SCORES, OP_SESSION = 1, 2, 3, 4
+
+# String fields of a logged test, in record order, and the values stored when a test leaves them out
+TEST_FIELDS = ("id", "timestamp", "speaker_model", "test_type", "additional_data", "user_id")
+TEST_DEFAULTS = {"speaker_model": "Unknown", "test_type": "unknown"}
+
+_LOG_NAME = re.compile(r'wal-(\d+)\.log$')
+_SNAPSHOT_NAME = re.compile(r'snapshot-(\d+)$')
+
+
+def _pack_string(value):
+    if value is None:
+        return _LENGTH.pack(-1)
+    encoded = value.encode('utf-8')
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_string(payload, offset):
+    """(string or None, offset after it)"""
+    length, = _LENGTH.unpack_from(payload, offset)
+    offset += _LENGTH.size
+    if length < 0:
+        return None, offset
+    return payload[offset:offset + length].decode('utf-8'), offset + length
+
+
+def _check_rating(rating):
+    if not 0 <= rating <= 5:
+        raise ValueError(f"Encoded rating out of range: {rating}")
+    return rating
+
+
+def add_record(test, historical, rating):
+    """Log record of a stored test; rating is its 0-5 encoding (see analytics_engine.encode_rating)"""
+    _check_rating(rating)
+    score = test.get("score")
+    return _ADD.pack(OP_ADD, historical, np.nan if score is None else score, rating) + b"".join(
+        _pack_string(test.get(field, TEST_DEFAULTS.get(field))) for field in TEST_FIELDS)
+
+
+def rating_record(test_id, rating):
+    return _RATE.pack(OP_RATE, _check_rating(rating)) + _pack_string(test_id)
+
+
+def scores_record(scores):
+    """Log record of (test_id, score) pairs set together"""
+    return _SCORES.pack(OP_SCORES, len(scores)) + b"".join(
+        _pack_string(test_id) + _SCORE.pack(np.nan if score is None else score) for test_id, score in scores)
+
+
+def session_record(user_id):
+    return bytes([OP_SESSION]) + _pack_string(user_id)
+
+
+def parse_record(payload):
+    """(op, arguments) of a log record, the arguments being those of the storage call it recorded"""
+    op = payload[0]
+    if op == OP_ADD:
+        _, historical, score, rating = _ADD.unpack_from(payload)
+        offset = _ADD.size
+        test = {}
+        for field in TEST_FIELDS:
+            test[field], offset = _unpack_string(payload, offset)
+        if test["user_id"] is None:
+            del test["user_id"]
+        test["score"] = None if score != score else score
+        test["user_rating"] = rating or None
+        return op, (test, historical)
+    if op == OP_RATE:
+        _, rating = _RATE.unpack_from(payload)
+        return op, (_unpack_string(payload, _RATE.size)[0], rating or None)
+    if op == OP_SCORES:
+        _, count = _SCORES.unpack_from(payload)
+        offset = _SCORES.size
+        scores = []
+        for _ in range(count):
+            test_id, offset = _unpack_string(payload, offset)
+            score, = _SCORE.unpack_from(payload, offset)
+            offset += _SCORE.size
+            scores.append((test_id, None if score != score else score))
+        return op, (scores,)
+    if op == OP_SESSION:
+        return op, (_unpack_string(payload, 1)[0],)
+    raise ValueError(f"Unknown log record type {op}")
+
+
+class WriteAheadLog:
+    """Appends records to one log segment; a background thread group-fsyncs them"""
+    def __init__(self, directory, segment, sync_interval=WAL_SYNC_INTERVAL):
+        self.directory = directory
+        self.segment = segment
+        self._sync_interval = sync_interval
+        self._file = open(directory.log_path(segment), 'ab')
+        self._unsynced = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if sync_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="wal-sync", daemon=True)
+            self._thread.start()
+
+    def append(self, payload):
+        frame = _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._file.write(frame)
+            self._unsynced = True
+        if self._sync_interval <= 0:
+            self.sync()
+
+    def sync(self):
+        """Write out and fsync every record appended so far"""
+        with self._lock:
+            if not self._unsynced:
+                return
+            self._file.flush()
+            self._unsynced = False
+            # fsync a duplicate so appends can continue, and rotate() close the file, meanwhile
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def rotate(self):
+        """Sync and close the current segment, continue in the next one; returns the closed segment"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._unsynced = False
+            closed = self.segment
+            self.segment += 1
+            self._file = open(self.directory.log_path(self.segment), 'ab')
+        self.directory.sync()
+        return closed
+
+    def _run(self):
+        while not self._closed.wait(self._sync_interval):
+            try:
+                self.sync()
+            except OSError:
+                logger.exception("Failed to sync the write-ahead log")
+
+    def close(self):
+        self._closed.set()
+        self.sync()
+        with self._lock:
+            self._file.close()
+
+
+class _StoredArray:
+    """Placeholder in state.pickle for an array saved to its own .npy file"""
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows  # for a column, how many of the saved rows are filled
+
+
+class DataDirectory:
+    """Log segments and snapshots of one storage; only one process may use a directory at a time"""
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, 'LOCK'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"{path} is in use by another process; "
+                               f"share one storage between workers with the remote backend") from None
+
+    def log_path(self, segment):
+        return os.path.join(self.path, f'wal-{segment:06d}.log')
+
+    def _snapshot_path(self, segment):
+        return os.path.join(self.path, f'snapshot-{segment:06d}')
+
+    def _numbered(self, pattern):
+        return sorted(int(match.group(1)) for match in map(pattern.match, os.listdir(self.path)) if match)
+
+    def log_segments(self):
+        return self._numbered(_LOG_NAME)
+
+    def snapshots(self):
+        return self._numbered(_SNAPSHOT_NAME)
+
+    def sync(self):
+        """fsync the directory itself, making created, renamed and deleted files durable"""
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def read_log(self, segment):
+        """Yield the payload of every intact record of a log segment"""
+        with open(self.log_path(segment), 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            if offset + _FRAME.size > len(data):
+                break
+            length, checksum = _FRAME.unpack_from(data, offset)
+            payload = data[offset + _FRAME.size:offset + _FRAME.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            yield payload
+            offset += _FRAME.size + length
+        if offset < len(data):
+            logger.warning("Ignoring %d bytes of torn or corrupt records at the end of %s",
+                           len(data) - offset, self.log_path(segment))
+
+    def load_snapshot(self):
+        """(segment, state) of the newest complete snapshot, or (0, None) if there is none"""
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        snapshots = self.snapshots()
+        if not snapshots:
+            return 0, None
+        path = self._snapshot_path(snapshots[-1])
+        with open(os.path.join(path, 'state.pickle'), 'rb') as f:
+            state = pickle.load(f)
+        return snapshots[-1], _load_arrays(state, path)
+
+    def write_snapshot(self, segment, state):
+        """Save state as the snapshot covering logs up to segment, then drop what it supersedes.
+
+        Large arrays and every Column are written to their own files; a list
+        of arrays is saved as their concatenation.
+        """
+        final = self._snapshot_path(segment)
+        path = final + '.tmp'
+        os.makedirs(path)
+        state = _save_arrays(state, path, "")
+        with open(os.path.join(path, 'state.pickle'), 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(path, final)
+        self.sync()
+
+        for old in self.snapshots():
+            if old < segment:
+                shutil.rmtree(self._snapshot_path(old))
+        for old in self.log_segments():
+            if old <= segment:
+                os.remove(self.log_path(old))
+        self.sync()
+
+    def close(self):
+        self._lock_file.close()
+
+
+def _save_arrays(state, path, prefix):
+    """state with its large arrays written to path and replaced by _StoredArray placeholders"""
+    if isinstance(state, dict):
+        return {key: _save_arrays(value, path, f"{prefix}{key}.") for key, value in state.items()}
+    if isinstance(state, Column):
+        values = state.values
+        spare = np.zeros(max(1024, int(len(values) * SPARE_ROWS)), dtype=values.dtype)
+        _write_array(path, prefix, values.dtype, (len(values) + len(spare),), [values, spare])
+        return _StoredArray(prefix, len(values))
+    if isinstance(state, list) and state and all(isinstance(part, np.ndarray) for part in state):
+        total = sum(len(part) for part in state)
+        if total:
+            _write_array(path, prefix, state[0].dtype, (total,) + state[0].shape[1:], state)
+            return _StoredArray(prefix)
+        return state[0]
+    if isinstance(state, np.ndarray) and state.nbytes >= ARRAY_FILE_BYTES:
+        _write_array(path, prefix, state.dtype, state.shape, [state])
+        return _StoredArray(prefix)
+    return state
+
+
+def _write_array(path, prefix, dtype, shape, parts):
+    with open(os.path.join(path, prefix + 'npy'), 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, {
+            "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+        for part in parts:
+            f.write(np.ascontiguousarray(part, dtype=dtype).data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _load_arrays(state, path):
+    if isinstance(state, dict):
+        return {key: _load_arrays(value, path) for key, value in state.items()}
+    if isinstance(state, _StoredArray):
+        # Copy-on-write: pages are read from the file as touched, writes stay private to this process
+        # (viewed as a plain ndarray: np.memmap's Python-level indexing would slow down every row access)
+        values = np.load(os.path.join(path, state.name + 'npy'), mmap_mode='c').view(np.ndarray)
+        return values if state.rows is None else Column.from_array(values, state.rows)
+    return state
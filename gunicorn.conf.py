@@ -0,0 +1,23 @@
+"""gunicorn settings.
+
+With SPEAKER_STORAGE_BACKEND=remote the master starts one storage server
+(storage_server.py) before forking, and every worker stores and reads
+through it instead of keeping its own copy of the data.
+"""
+import os
+
+_storage_server = None
+
+
+def on_starting(server):
+    global _storage_server
+    if os.environ.get('SPEAKER_STORAGE_BACKEND') == 'remote':
+        from storage_server import start_server_process
+        _storage_server = start_server_process()
+        server.log.info("Storage server started (pid %s)", _storage_server.pid)
+
+
+def on_exit(server):
+    if _storage_server is not None:
+        _storage_server.terminate()
+        _storage_server.wait()
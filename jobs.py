@@ -0,0 +1,133 @@
+"""In-memory table of background jobs with progress, waiters and TTL eviction.
+
+A job moves queued -> running -> done | failed. Every update bumps its
+version and wakes anyone waiting on it, which is how ``/jobs/<id>/events``
+streams progress without polling. Finished jobs are evicted ``ttl`` seconds
+after they finish, and the table never holds more than ``max_jobs``: when it
+is full of unfinished jobs, create() raises JobTableFull.
+"""
+import datetime
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+FINISHED = ('done', 'failed')
+
+
+class JobTableFull(Exception):
+    """Raised when every slot in the job table holds an unfinished job"""
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = datetime.datetime.now().isoformat()
+        self.finished_at = None  # time.monotonic() once done or failed
+        self.version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def update(self, status=None, stage=None, progress=None):
+        with self._changed:
+            if status is not None:
+                self.status = status
+            if stage is not None:
+                self.stage = stage
+            if progress is not None:
+                self.progress = progress
+            self.version += 1
+            self._changed.notify_all()
+
+    def finish(self, result=None, error=None):
+        """Mark the job done with `result`, or failed with the exception `error`"""
+        with self._changed:
+            self.status = 'failed' if error is not None else 'done'
+            self.stage = self.status
+            self.result = result
+            self.error = error
+            if error is None:
+                self.progress = 1.0
+            self.finished_at = time.monotonic()
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns whether it did"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the job's version differs from `version`; returns the snapshot, or None on timeout"""
+        with self._changed:
+            if not self._changed.wait_for(lambda: self.version != version, timeout):
+                return None
+            return self.snapshot()
+
+    def snapshot(self):
+        """JSON-ready view of the job"""
+        with self._changed:
+            state = {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": self.progress,
+                "created_at": self.created_at,
+                "version": self.version
+            }
+            if self.status == 'done':
+                state["result"] = self.result
+            elif self.status == 'failed':
+                state["error"] = str(self.error)
+            return state
+
+
+class JobTable:
+    def __init__(self, max_jobs=1000, ttl=600):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()  # job id -> Job, oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def create(self, kind):
+        job = Job(kind)
+        with self._lock:
+            self._evict()
+            if len(self._jobs) >= self.max_jobs:
+                # Make room by dropping the oldest finished job, if there is one
+                oldest = next((job_id for job_id, old in self._jobs.items() if old.finished), None)
+                if oldest is None:
+                    raise JobTableFull(f"Too many unfinished jobs ({self.max_jobs})")
+                del self._jobs[oldest]
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _evict(self):
+        """Drop finished jobs whose TTL has passed"""
+        cutoff = time.monotonic() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,457 @@
+"""Acoustic measurement engine for recorded test captures.
+
+Frequency response is measured with an exponential sine sweep: the recording
+is deconvolved against the analytically inverted sweep (Farina's method) with
+one FFT multiply, the linear impulse response is windowed out ahead of the
+harmonic distortion products, and its magnitude is averaged into
+fractional-octave bands. Everything is vectorized NumPy; the inverse sweep
+spectrum is cached per (sweep, FFT size) so repeated measurements only pay
+for the recording's own FFTs.
+
+Distortion is measured from a stepped-tone capture: every step is cut to the
+same length and analyzed in one batched, windowed 2-D FFT, with THD and THD+N
+summed from the harmonic bins of each row.
+
+Bass response is measured from a pink noise capture with a Welch power
+spectrum, flattened by f and averaged into third-octave bands.
+
+SweepDeconvolver and PinkNoiseAnalyzer compute the same results from a
+capture fed in arbitrary chunks as it is uploaded, holding a bounded amount
+of state instead of the whole recording.
+"""
+import functools
+import io
+import struct
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as sp_fft
+from scipy.io import wavfile
+from scipy.signal import windows as signal_windows
+
+from signals import MAX_DURATION, SAMPLE_RATES
+
+
+def read_wav(data):
+    """Decode WAV bytes into (sample_rate, float64 mono samples in [-1, 1])"""
+    try:
+        sample_rate, samples = wavfile.read(io.BytesIO(data))
+    except (ValueError, EOFError, struct.error) as e:
+        raise ValueError(f"Could not read WAV capture: {e}")
+    if sample_rate not in SAMPLE_RATES:
+        raise ValueError(f"Could not read WAV capture: unsupported sample rate {sample_rate}")
+    return sample_rate, to_float_mono(samples)
+
+
+def to_float_mono(samples):
+    """Scale integer PCM to [-1, 1] floats and keep the first channel"""
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+    if samples.dtype.kind == 'u':  # 8-bit WAV is unsigned
+        info = np.iinfo(samples.dtype)
+        return (samples.astype(np.float64) - (info.max + 1) / 2) / ((info.max + 1) / 2)
+    if samples.dtype.kind == 'i':
+        return samples.astype(np.float64) / -np.iinfo(samples.dtype).min
+    return samples.astype(np.float64)
+
+
+def exponential_sweep(f1, f2, duration, sample_rate):
+    """Exponential (log) sine sweep from f1 to f2 Hz"""
+    t = np.arange(int(round(duration * sample_rate))) / sample_rate
+    rate = duration / np.log(f2 / f1)
+    return np.sin(2 * np.pi * f1 * rate * (np.exp(t / rate) - 1))
+
+
+def inverse_sweep(f1, f2, duration, sample_rate):
+    """Time-reversed sweep with a +6 dB/octave envelope, so sweep * inverse is a band-limited impulse"""
+    sweep = exponential_sweep(f1, f2, duration, sample_rate)
+    t = np.arange(len(sweep)) / sample_rate
+    rate = duration / np.log(f2 / f1)
+    return sweep[::-1] * np.exp(-t / rate)
+
+
+@functools.lru_cache(maxsize=16)
+def _inverse_spectrum(f1, f2, duration, sample_rate, n_fft):
+    """Spectrum of the inverse sweep, scaled so the sweep deconvolves to unit gain across f1..f2.
+
+    The analytic +6 dB/octave envelope ripples near the ends of the sweep, so
+    the gain is corrected bin by bin against the exact sweep * inverse_sweep
+    product.
+    """
+    inverse = sp_fft.rfft(inverse_sweep(f1, f2, duration, sample_rate), n_fft)
+    product = np.abs(sp_fft.rfft(exponential_sweep(f1, f2, duration, sample_rate), n_fft) * inverse)
+    freqs = sp_fft.rfftfreq(n_fft, 1 / sample_rate)
+    in_band = (freqs >= f1) & (freqs <= f2)
+    # Outside the sweep band there is no energy to equalize; use the in-band median gain there
+    gain = np.full(len(freqs), np.median(product[in_band]))
+    gain[in_band] = product[in_band]
+    inverse /= gain
+    inverse.flags.writeable = False
+    return inverse
+
+
+def impulse_response(recording, sample_rate, f1, f2, duration):
+    """Deconvolve a sweep recording; the linear response starts at index len(sweep) - 1"""
+    sweep_length = int(round(duration * sample_rate))
+    n_fft = sp_fft.next_fast_len(len(recording) + sweep_length - 1, real=True)
+    spectrum = sp_fft.rfft(recording, n_fft)
+    spectrum *= _inverse_spectrum(f1, f2, duration, sample_rate, n_fft)
+    return sp_fft.irfft(spectrum, n_fft), sweep_length - 1
+
+
+def fractional_octave_bands(f_low, f_high, fraction=3):
+    """Base-2 band centers and edges (1 kHz reference) covering f_low..f_high"""
+    k = np.arange(np.ceil(fraction * np.log2(f_low / 1000)), np.floor(fraction * np.log2(f_high / 1000)) + 1)
+    centers = 1000 * 2 ** (k / fraction)
+    half_band = 2 ** (1 / (2 * fraction))
+    return centers, centers / half_band, centers * half_band
+
+
+def band_levels(spectrum_power, freqs, lower, upper):
+    """Mean power of the spectrum within each band, via one cumulative sum"""
+    cumulative = np.concatenate([[0.0], np.cumsum(spectrum_power)])
+    lo = np.searchsorted(freqs, lower, side='left')
+    hi = np.searchsorted(freqs, upper, side='right')
+    counts = hi - lo
+    levels = (cumulative[hi] - cumulative[lo]) / np.maximum(counts, 1)
+
+    # Bands narrower than one FFT bin take the interpolated value at their center
+    empty = counts == 0
+    if empty.any():
+        levels[empty] = np.interp(np.sqrt(lower[empty] * upper[empty]), freqs, spectrum_power)
+    return levels
+
+
+# Lowest sweep start frequency and longest impulse response gate: they size the FFTs and buffers
+MIN_SWEEP_START = 1.0
+MAX_WINDOW = 1.0
+
+
+def _check_sweep(f1, f2, window, sample_rate):
+    """The sweep's stop frequency, capped at Nyquist; raises ValueError for options out of range (or NaN)"""
+    if not np.isfinite(f2):
+        raise ValueError("Sweep stop frequency must be a finite number")
+    f2 = min(f2, sample_rate / 2)
+    if not MIN_SWEEP_START <= f1 < f2:
+        raise ValueError(f"Sweep start frequency must be at least {MIN_SWEEP_START:g} Hz "
+                         "and below the stop frequency")
+    if not 0 < window <= MAX_WINDOW:
+        raise ValueError(f"window must be between 0 and {MAX_WINDOW:g} seconds")
+    return f2
+
+
+def measure_frequency_response(recording, sample_rate, f1=20.0, f2=20000.0, duration=10.0,
+                               fraction=3, window=0.25, pre_delay=0.002):
+    """Magnitude response of a recorded exponential sweep in fractional-octave bands.
+
+    ``window`` seconds of impulse response after the direct sound are kept
+    (faded out with a half-Hann tail), which also drops the harmonic
+    distortion products that deconvolution places before the linear response.
+    """
+    f2 = _check_sweep(f1, f2, window, sample_rate)
+    if len(recording) < duration * sample_rate:
+        raise ValueError("Capture is shorter than the sweep")
+
+    ir, linear_start = impulse_response(np.asarray(recording, dtype=np.float64), sample_rate, f1, f2, duration)
+    span = _linear_ir_span(sample_rate, window)
+    return _gated_response(ir[linear_start:linear_start + span], sample_rate, f1, f2, fraction, window, pre_delay)
+
+
+def _linear_ir_span(sample_rate, window):
+    """Samples of linear impulse response needed: one second of peak search plus the gate"""
+    return int(sample_rate) + int(window * sample_rate)
+
+
+def _gated_response(linear_ir, sample_rate, f1, f2, fraction, window, pre_delay):
+    """Band levels of the linear impulse response (index 0 = zero latency), gated around its peak"""
+    # Gate the linear part around its peak (the speaker's latency is unknown)
+    peak = int(np.argmax(np.abs(linear_ir[:int(sample_rate)])))
+    start = max(0, peak - int(pre_delay * sample_rate))
+    length = int(window * sample_rate)
+    gated = linear_ir[start:start + length].copy()
+    fade = min(len(gated) // 4, int(0.005 * sample_rate) * 4)
+    if fade:
+        gated[-fade:] *= np.hanning(2 * fade)[fade:]
+
+    n_fft = sp_fft.next_fast_len(max(len(gated), int(sample_rate / f1) * 4), real=True)
+    power = np.abs(sp_fft.rfft(gated, n_fft)) ** 2
+    freqs = sp_fft.rfftfreq(n_fft, 1 / sample_rate)
+
+    centers, lower, upper = fractional_octave_bands(f1, f2, fraction)
+    levels = band_levels(power, freqs, lower, upper)
+    response_db = 10 * np.log10(np.maximum(levels, 1e-20))
+    return {
+        "centers": centers,
+        "response_db": response_db,
+        # Linear magnitude relative to the loudest band, in (0, 1]
+        "normalized": 10 ** ((response_db - response_db.max()) / 20),
+        "latency_ms": peak / sample_rate * 1000
+    }
+
+
+# Samples of the gain-corrected inverse sweep kept ahead of time zero by the streaming deconvolver
+INVERSE_LEAD = 0.1
+
+
+@functools.lru_cache(maxsize=4)
+def _inverse_partitions(f1, f2, duration, sample_rate, block_size):
+    """Spectra (2 * block_size FFTs) of consecutive block_size slices of the gain-corrected inverse sweep.
+
+    The gain correction leaves a little acausal energy (wrapped to the end of
+    the circular filter), so INVERSE_LEAD seconds of it are moved in front,
+    delaying the output by that many samples.
+    """
+    sweep_length = int(round(duration * sample_rate))
+    lead = int(INVERSE_LEAD * sample_rate)
+    n_fft = sp_fft.next_fast_len(2 * sweep_length, real=True)
+    inverse = sp_fft.irfft(_inverse_spectrum(f1, f2, duration, sample_rate, n_fft), n_fft)
+    count = -(-(sweep_length + lead) // block_size)
+    padded = np.zeros(count * block_size)
+    padded[:lead] = inverse[n_fft - lead:]
+    padded[lead:lead + sweep_length] = inverse[:sweep_length]
+    partitions = sp_fft.rfft(padded.reshape(count, block_size), 2 * block_size, axis=1)
+    partitions.flags.writeable = False
+    return partitions
+
+
+class SweepDeconvolver:
+    """Streaming counterpart of measure_frequency_response.
+
+    Uniformly partitioned overlap-save convolution with the inverse sweep:
+    every block_size input samples cost one FFT into a frequency-domain delay
+    line, and output blocks are only computed where the linear impulse
+    response lies, so the work left once the last block arrives is a handful
+    of block products. Memory is the delay line (about the sweep's length),
+    whatever the length of the capture.
+    """
+    def __init__(self, sample_rate, f1=20.0, f2=20000.0, duration=10.0, fraction=3, window=0.25,
+                 pre_delay=0.002, block_size=8192):
+        self.f2 = _check_sweep(f1, f2, window, sample_rate)
+        self.sample_rate = sample_rate
+        self.f1 = f1
+        self.fraction = fraction
+        self.window = window
+        self.pre_delay = pre_delay
+        self.block_size = block_size
+        self.sweep_length = int(round(duration * sample_rate))
+        self._partitions = _inverse_partitions(f1, self.f2, duration, sample_rate, block_size)
+        self._delay_line = np.zeros(self._partitions.shape, dtype=np.complex128)
+        self._previous = np.zeros(block_size)
+        self._pending = np.zeros(block_size)
+        self._pending_count = 0
+        self._blocks = 0
+        self.samples = 0
+
+        # Output samples [linear_start, linear_start + span) are kept
+        self._linear_start = self.sweep_length - 1 + int(INVERSE_LEAD * sample_rate)
+        self._linear_ir = np.zeros(_linear_ir_span(sample_rate, window))
+
+    def feed(self, samples):
+        self.samples += len(samples)
+        block_size = self.block_size
+        while len(samples):
+            take = min(block_size - self._pending_count, len(samples))
+            self._pending[self._pending_count:self._pending_count + take] = samples[:take]
+            self._pending_count += take
+            samples = samples[take:]
+            if self._pending_count == block_size:
+                self._process(self._pending)
+                self._pending_count = 0
+
+    def _process(self, block):
+        block_size = self.block_size
+        count = len(self._partitions)
+        slot = self._blocks % count
+        self._delay_line[slot] = sp_fft.rfft(np.concatenate([self._previous, block]))
+        self._previous = block.copy()
+
+        out_start = self._blocks * block_size - self._linear_start
+        self._blocks += 1
+        if out_start + block_size <= 0 or out_start >= len(self._linear_ir):
+            return
+
+        # Newest spectrum pairs with the first partition; walk the ring backwards from slot
+        spectrum = np.einsum('pf,pf->f', self._delay_line[slot::-1], self._partitions[:slot + 1])
+        if slot + 1 < count:
+            spectrum += np.einsum('pf,pf->f', self._delay_line[:slot:-1], self._partitions[slot + 1:])
+        output = sp_fft.irfft(spectrum, 2 * block_size)[block_size:]
+
+        lo = max(out_start, 0)
+        hi = min(out_start + block_size, len(self._linear_ir))
+        self._linear_ir[lo:hi] = output[lo - out_start:hi - out_start]
+
+    def result(self):
+        """Same dict as measure_frequency_response, once the whole capture has been fed"""
+        if self.samples < self.sweep_length:
+            raise ValueError("Capture is shorter than the sweep")
+        # Flush the partial block, then zeros until the kept output range is complete
+        end = self._linear_start + len(self._linear_ir)
+        while self._blocks * self.block_size < end:
+            self._pending[self._pending_count:] = 0
+            self._process(self._pending)
+            self._pending_count = 0
+        return _gated_response(self._linear_ir, self.sample_rate, self.f1, self.f2, self.fraction,
+                               self.window, self.pre_delay)
+
+
+@functools.lru_cache(maxsize=8)
+def _hann(n):
+    window = signal_windows.hann(n, sym=False)
+    window.flags.writeable = False
+    return window
+
+
+class WelchAccumulator:
+    """Running Welch power spectral density: Hann-windowed, 50%-overlapping segments averaged as they complete.
+
+    Only the unfinished tail of the input (less than one segment) is kept
+    between feeds; every batch of complete segments goes through one 2-D FFT.
+    """
+    def __init__(self, sample_rate, segment_length=None):
+        # About 1.5 Hz resolution by default, fine enough for the 20 Hz band
+        self.segment_length = segment_length or 1 << int(np.ceil(np.log2(sample_rate / 2)))
+        self.sample_rate = sample_rate
+        self.segments = 0
+        self._window = _hann(self.segment_length)
+        self._power = np.zeros(self.segment_length // 2 + 1)
+        self._tail = np.zeros(0)
+
+    def feed(self, samples):
+        data = np.concatenate([self._tail, samples])
+        hop = self.segment_length // 2
+        count = (len(data) - self.segment_length) // hop + 1
+        if count > 0:
+            frames = sliding_window_view(data, self.segment_length)[:count * hop:hop]
+            self._power += (np.abs(sp_fft.rfft(frames * self._window, axis=1)) ** 2).sum(axis=0)
+            self.segments += count
+            data = data[count * hop:]
+        self._tail = data.copy()
+
+    def psd(self):
+        """(frequencies, one-sided power spectral density)"""
+        if not self.segments:
+            raise ValueError("Capture is shorter than one analysis segment")
+        density = self._power / (self.segments * self.sample_rate * (self._window ** 2).sum())
+        density[1:-1] *= 2
+        return sp_fft.rfftfreq(self.segment_length, 1 / self.sample_rate), density
+
+
+# Bass response bands, as reported by the bass response test
+BASS_BANDS = (20, 40, 60, 80, 100, 150, 200)
+
+
+def bass_response_from_psd(freqs, density, bands=BASS_BANDS, fraction=3):
+    """Bass band levels of a pink noise capture's PSD.
+
+    Pink noise falls at 3 dB/octave, so PSD * f is flat for a flat speaker;
+    each band averages that over a 1/fraction-octave band around its center.
+    """
+    centers = np.asarray(bands, dtype=np.float64)
+    half_band = 2 ** (1 / (2 * fraction))
+    levels = band_levels(density * freqs, freqs, centers / half_band, centers * half_band)
+    response_db = 10 * np.log10(np.maximum(levels, 1e-30))
+    return {
+        "centers": centers,
+        "response_db": response_db,
+        "normalized": 10 ** ((response_db - response_db.max()) / 20)
+    }
+
+
+class PinkNoiseAnalyzer:
+    """Streaming bass response of a pink noise capture"""
+    def __init__(self, sample_rate, bands=BASS_BANDS):
+        self.bands = bands
+        self._welch = WelchAccumulator(sample_rate)
+
+    def feed(self, samples):
+        self._welch.feed(samples)
+
+    def result(self):
+        return bass_response_from_psd(*self._welch.psd(), bands=self.bands)
+
+
+def measure_bass_response(recording, sample_rate, bands=BASS_BANDS):
+    """Bass response of a recorded pink noise capture"""
+    analyzer = PinkNoiseAnalyzer(sample_rate, bands)
+    analyzer.feed(np.asarray(recording, dtype=np.float64))
+    return analyzer.result()
+
+
+# Stepped tones used for distortion measurement, one tone per step
+DEFAULT_TONES = (100, 250, 500, 1000, 2000, 4000, 8000)
+
+
+def stepped_tones(frequencies=DEFAULT_TONES, step_duration=1.0, sample_rate=48000, amplitude=0.5):
+    """Consecutive pure tones, step_duration seconds each"""
+    t = np.arange(int(round(step_duration * sample_rate))) / sample_rate
+    return (amplitude * np.sin(2 * np.pi * np.asarray(frequencies, dtype=np.float64)[:, None] * t)).ravel()
+
+
+@functools.lru_cache(maxsize=8)
+def _blackman_harris(n):
+    """Periodic 4-term Blackman-Harris window (about -92 dB sidelobes)"""
+    window = signal_windows.blackmanharris(n, sym=False)
+    window.flags.writeable = False
+    return window
+
+
+def find_onset(recording, threshold=0.1):
+    """Index of the first sample above threshold * peak level"""
+    magnitude = np.abs(recording)
+    return int(np.argmax(magnitude > threshold * magnitude.max()))
+
+
+def measure_distortion(recording, sample_rate, frequencies=DEFAULT_TONES, step_duration=1.0,
+                       onset=None, settle=0.1, max_harmonic=10, f_low=20.0, f_high=20000.0):
+    """THD and THD+N (as % of the fundamental) for each tone of a stepped-tone capture.
+
+    Every step is cut to the same power-of-two length after ``settle`` seconds
+    of transient and all of them go through one windowed 2-D FFT. Fundamental
+    and harmonic energy is summed over the window's main lobe; THD+N counts
+    everything in f_low..f_high except the fundamental.
+    """
+    if not 0 < step_duration <= MAX_DURATION:
+        raise ValueError(f"step_duration must be between 0 and {MAX_DURATION:g} seconds")
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    if frequencies.ndim != 1 or not len(frequencies):
+        raise ValueError("frequencies must be a non-empty list of tone frequencies")
+    if not ((frequencies > 0) & (frequencies < sample_rate / 2)).all():
+        raise ValueError(f"Tone frequencies must be between 0 and {sample_rate / 2:g} Hz (Nyquist)")
+    recording = np.asarray(recording, dtype=np.float64)
+    if onset is None:
+        onset = find_onset(recording)
+    step = int(round(step_duration * sample_rate))
+    skip = int(settle * sample_rate)
+    if step - 2 * skip < 256:
+        raise ValueError("Tone steps are too short to analyze")
+    n = 1 << int(np.log2(step - 2 * skip))
+    if onset + (len(frequencies) - 1) * step + skip + n > len(recording):
+        raise ValueError("Capture is shorter than the stepped-tone sequence")
+
+    # steps x n frame matrix, one row per tone
+    starts = onset + np.arange(len(frequencies)) * step + skip
+    frames = recording[starts[:, None] + np.arange(n)]
+    window = _blackman_harris(n)
+    power = np.abs(sp_fft.rfft(frames * window, axis=1)) ** 2
+
+    # Main-lobe bins around each harmonic (h = 1 is the fundamental), as a steps x harmonics x lobe index
+    lobe = 4  # Blackman-Harris main lobe half-width in bins
+    harmonics = np.arange(1, max_harmonic + 1)
+    centers = np.rint(frequencies[:, None] * harmonics * n / sample_rate).astype(np.intp)
+    valid = centers * sample_rate / n <= min(f_high, sample_rate / 2)
+    bins = np.clip(centers[:, :, None] + np.arange(-lobe, lobe + 1), 0, power.shape[1] - 1)
+    rows = np.arange(len(frequencies))[:, None, None]
+    harmonic_power = power[rows, bins].sum(axis=2) * valid
+
+    freqs = sp_fft.rfftfreq(n, 1 / sample_rate)
+    in_band = (freqs >= f_low) & (freqs <= f_high)
+    total = power[:, in_band].sum(axis=1)
+    fundamental = harmonic_power[:, 0]
+    if not (fundamental > 0).all():
+        raise ValueError("No tone found in one or more steps")
+
+    return {
+        "frequencies": frequencies,
+        "thd": np.sqrt(harmonic_power[:, 1:].sum(axis=1) / fundamental) * 100,
+        "thd_n": np.sqrt(np.maximum(total - fundamental, 0) / fundamental) * 100
+    }
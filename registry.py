@@ -0,0 +1,258 @@
+"""Registry of speaker test types.
+
+Each test type declares its metrics (simulated ranges, or a measurement for
+uploaded captures) and the schema of the ``additional_data`` it stores; its
+score formula comes from the versioned tables in scoring.py. The generic ``/test/<slug>`` route and
+``/test/batch`` dispatch through ``TEST_TYPES``, so adding a test type is one
+``register(TestType(...))`` call and no route code.
+"""
+import json
+import random
+
+import scoring
+from signals import MAX_DURATION
+
+# Fractional-octave resolutions a band response can be measured in (1/1 to 1/24 octave)
+OCTAVE_FRACTIONS = (1, 2, 3, 6, 12, 24)
+
+
+def compile_serializer(fields):
+    """JSON encoder for a flat dict of floats with exactly these keys, in this order.
+
+    The key text is rendered once into a %-format template, so each call only
+    formats the values; the output is the same as json.dumps. Simulated
+    metrics always match the schema; measured ones go through json.dumps.
+    """
+    template = '{' + ', '.join(json.dumps(field).replace('%', '%%') + ': %r' for field in fields) + '}'
+
+    def serialize(metrics):
+        return template % tuple(metrics.values())
+    return serialize
+
+
+class TestType:
+    """One kind of speaker test.
+
+    ``metrics`` maps each stored field to its (low, high) bounds, which it is
+    drawn uniformly from unless ``simulate(metrics)`` says otherwise.
+    ``score(metrics)`` defaults to the test type's formula in the active
+    scoring version.
+    ``measure(params, capture)`` returns (metrics, extra response fields) for
+    an uploaded capture. ``stream(params, sample_rate)``, if given, returns an
+    analyzer that is fed the capture's samples in chunks and whose result()
+    returns the same pair, so a WAV body can be measured while it uploads.
+    With ``nested`` the metrics are returned under "results" instead of at
+    the top level of the response.
+    """
+    def __init__(self, name, score=None, metrics=None, simulate=None, measure=None, stream=None, nested=False):
+        self.name = name
+        self.slug = name.replace('_', '-')
+        self.metrics = metrics or {}
+        self.score = score or scoring.formula(name)
+        if self.score is None:
+            raise ValueError(f"No score formula for test type {name}")
+        self.measure = measure
+        self.stream = stream
+        self.nested = nested
+        self._simulate = simulate
+        self.serialize = compile_serializer(self.metrics)
+        # (field, low, span) triples, so each draw is random.uniform without the call
+        self._draws = [(field, low, high - low) for field, (low, high) in self.metrics.items()]
+
+    def simulate(self):
+        if self._simulate is not None:
+            return self._simulate(self.metrics)
+        draw = random.random
+        return {field: low + span * draw() for field, low, span in self._draws}
+
+    def run(self, params, capture=None):
+        """(score, stored additional_data JSON, response fields) for one test"""
+        if capture is not None and self.measure is not None:
+            metrics, extra = self.measure(params, capture)
+            additional_data = json.dumps(metrics)
+        else:
+            metrics, extra = self.simulate(), None
+            additional_data = self.serialize(metrics)
+        return self._outcome(metrics, additional_data, extra)
+
+    def run_stream(self, params, stream, sink=None):
+        """run() for a WAV capture read incrementally from a file-like stream (sink: see analyze_stream)"""
+        from wav_stream import analyze_stream
+        metrics, extra = analyze_stream(stream, lambda sample_rate: self.stream(params, sample_rate), sink=sink)
+        return self._outcome(metrics, json.dumps(metrics), extra)
+
+    def _outcome(self, metrics, additional_data, extra):
+        fields = {"results": metrics} if self.nested else metrics
+        if extra:
+            fields = {**fields, **extra}
+        return self.score(metrics), additional_data, fields
+
+
+TEST_TYPES = {}
+TEST_TYPES_BY_SLUG = {}
+
+
+def register(test_type):
+    TEST_TYPES[test_type.name] = test_type
+    TEST_TYPES_BY_SLUG[test_type.slug] = test_type
+    return test_type
+
+
+def lookup(name):
+    """Test type by name ("bass_response") or URL slug ("bass-response"), or None"""
+    return TEST_TYPES.get(name) or TEST_TYPES_BY_SLUG.get(name)
+
+
+def _band_simulation(response):
+    """Simulated per-band response: the nominal response plus noise, clamped to each band's bounds"""
+    def simulate(metrics):
+        results = {}
+        for freq, (low, high) in metrics.items():
+            # Add some random variation
+            results[freq] = max(low, min(high, response[freq] + random.uniform(-0.05, 0.05)))
+        return results
+    return simulate
+
+
+class _StreamingMeasurement:
+    """Streaming analyzer whose result() is converted to (metrics, extra) like a measure() function"""
+    def __init__(self, analyzer, sample_rate, fields):
+        self.analyzer = analyzer
+        self.sample_rate = sample_rate
+        self.fields = fields
+
+    def feed(self, samples):
+        self.analyzer.feed(samples)
+
+    def result(self):
+        return self.fields(self.analyzer.result(), self.sample_rate)
+
+
+def _sweep_options(params):
+    """Sweep analysis options from request params; raises ValueError before any buffer is sized from them"""
+    duration = float(params.get('sweep_duration', 10))
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"sweep_duration must be between 0 and {MAX_DURATION:g} seconds")
+    fraction = int(params.get('fraction', 3))
+    if fraction not in OCTAVE_FRACTIONS:
+        raise ValueError(f"fraction must be one of {', '.join(map(str, OCTAVE_FRACTIONS))}")
+    return {
+        "f1": float(params.get('f1', 20)),
+        "f2": float(params.get('f2', 20000)),
+        "duration": duration,
+        "fraction": fraction,
+        "window": float(params.get('window', 0.25))
+    }
+
+
+def _band_response_fields(measured, sample_rate):
+    """(normalized level per band center, extra response fields) of a band response measurement"""
+    results = {str(int(round(f))): float(v) for f, v in zip(measured["centers"], measured["normalized"])}
+    extra = {"response_db": [float(v) for v in measured["response_db"]]}
+    if "latency_ms" in measured:
+        extra["latency_ms"] = measured["latency_ms"]
+    extra["sample_rate"] = sample_rate
+    return results, extra
+
+
+def _measure_frequency_response(params, capture):
+    # Measure the uploaded recording of an exponential sine sweep
+    from measurement import measure_frequency_response
+    sample_rate, recording = capture
+    measured = measure_frequency_response(recording, sample_rate, **_sweep_options(params))
+    return _band_response_fields(measured, sample_rate)
+
+
+def _stream_frequency_response(params, sample_rate):
+    from measurement import SweepDeconvolver
+    return _StreamingMeasurement(SweepDeconvolver(sample_rate, **_sweep_options(params)),
+                                 sample_rate, _band_response_fields)
+
+
+def _measure_bass_response(params, capture):
+    # Measure the uploaded recording of pink noise
+    from measurement import measure_bass_response
+    sample_rate, recording = capture
+    return _band_response_fields(measure_bass_response(recording, sample_rate), sample_rate)
+
+
+def _stream_bass_response(params, sample_rate):
+    from measurement import PinkNoiseAnalyzer
+    return _StreamingMeasurement(PinkNoiseAnalyzer(sample_rate), sample_rate, _band_response_fields)
+
+
+def _measure_distortion(params, capture):
+    # Measure THD+N of each tone in the uploaded stepped-tone recording
+    from measurement import DEFAULT_TONES, measure_distortion
+    sample_rate, recording = capture
+    frequencies = params.get('frequencies', DEFAULT_TONES)
+    if isinstance(frequencies, str):
+        frequencies = frequencies.split(',')
+    if not isinstance(frequencies, (list, tuple)) or not all(isinstance(f, (int, float, str)) for f in frequencies):
+        raise ValueError("frequencies must be a list of numbers or a comma-separated string")
+    frequencies = [float(f) for f in frequencies]
+    measured = measure_distortion(
+        recording, sample_rate,
+        frequencies=frequencies,
+        step_duration=float(params.get('step_duration', 1.0)))
+    return {"distortion_percentage": float(measured["thd_n"].mean())}, {
+        "thd_percentage": float(measured["thd"].mean()),
+        "tones": [{"frequency": float(f), "thd": float(thd), "thd_n": float(thd_n)}
+                  for f, thd, thd_n in zip(measured["frequencies"], measured["thd"], measured["thd_n"])],
+        "sample_rate": sample_rate
+    }
+
+
+FREQUENCY_RESPONSE_BANDS = {str(freq): 0.9 - (0.2 * abs(freq - 1000) / 14000)
+                            for freq in [100, 500, 1000, 5000, 10000, 15000]}
+BASS_RESPONSE_BANDS = {str(freq): 0.7 + (0.2 * freq / 200)
+                       for freq in [20, 40, 60, 80, 100, 150, 200]}
+
+register(TestType(
+    "frequency_response",
+    metrics={freq: (0.5, 0.99) for freq in FREQUENCY_RESPONSE_BANDS},
+    simulate=_band_simulation(FREQUENCY_RESPONSE_BANDS),
+    measure=_measure_frequency_response,
+    stream=_stream_frequency_response,
+    nested=True))
+
+register(TestType(
+    "distortion",
+    metrics={"distortion_percentage": (0.5, 5.0)},
+    measure=_measure_distortion))
+
+register(TestType(
+    "bass_response",
+    metrics={freq: (0.5, 0.98) for freq in BASS_RESPONSE_BANDS},
+    simulate=_band_simulation(BASS_RESPONSE_BANDS),
+    measure=_measure_bass_response,
+    stream=_stream_bass_response,
+    nested=True))
+
+register(TestType(
+    "stereo_imaging",
+    metrics={"channel_separation": (70, 98), "phase_accuracy": (75, 95), "sound_stage_width": (65, 95)}))
+
+register(TestType(
+    "clarity",
+    metrics={"mid_clarity": (70, 98), "high_clarity": (65, 95), "vocal_clarity": (75, 99)}))
+
+register(TestType(
+    "max_volume",
+    metrics={"max_db": (85, 110), "distortion_at_max": (3, 15)}))
+
+register(TestType(
+    "dynamic_range",
+    metrics={"dynamic_range_db": (60, 95), "detail_preservation": (70, 95)}))
+
+register(TestType(
+    "transient_response",
+    metrics={"attack_speed": (70, 98), "decay_accuracy": (65, 95)}))
+
+register(TestType(
+    "voice_reproduction",
+    metrics={"male_voice": (75, 98), "female_voice": (70, 98), "sibilance": (60, 95)}))
+
+register(TestType(
+    "soundstage",
+    metrics={"width": (65, 95), "depth": (60, 90), "imaging_precision": (70, 95)}))
@@ -0,0 +1,121 @@
+"""Recompute stored test scores with a scoring version, e.g. after a formula changes.
+
+Records are streamed from the storage backend's iter_score_rows and collected
+into per-test-type chunks; each chunk is scored by scoring.score_records (one vectorized formula
+call per metric layout), on a process pool when there is more than one
+worker. Only scores that actually change are written back, in batches
+through the backend's update_scores.
+
+Usage: python rescore.py [DB_PATH] [--version N] [--workers N] [--dry-run]
+
+DB_PATH defaults to SPEAKER_DB_PATH or data/speaker_tests.db; the in-memory
+backends are rescored through POST /rescore instead.
+"""
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+import scoring
+from analysis_pool import mp_context
+
+# Records per scoring chunk, and per update_scores call
+CHUNK_SIZE = 10000
+
+
+def rescore(storage, version=None, workers=None, chunk_size=CHUNK_SIZE, dry_run=False, progress=None):
+    """Rescore every test (current and historical) in `storage`; returns a report of counts and throughput.
+
+    Records without usable metrics keep their score. progress, if given, is
+    called with the number of records scored so far after every chunk.
+    """
+    version = scoring.ACTIVE_VERSION if version is None else version
+    if version not in scoring.SCORING:
+        raise ValueError(f"Unknown scoring version: {version}")
+    workers = (os.cpu_count() or 1) if workers is None else workers
+
+    start = time.perf_counter()
+    report = {"version": version, "records": 0, "scored": 0, "changed": 0, "workers": max(workers, 1)}
+    updates = []  # (test_id, new score)
+    chunks = {}  # test_type -> [(id, test_type, score, additional_data)]
+    pending = deque()  # (ids, old scores, scores or a future of them)
+    pool = ProcessPoolExecutor(workers, mp_context=mp_context()) if workers > 1 else None
+
+    def collect(ids, old_scores, scores):
+        if isinstance(scores, Future):
+            scores = scores.result()
+        old_scores = np.array(old_scores, dtype=np.float64)
+        scored = ~np.isnan(scores)
+        # NaN != anything, so tests without a stored score count as changed
+        changed = scored & ~(np.abs(scores - old_scores) <= 1e-9)
+        updates.extend(zip([ids[i] for i in np.flatnonzero(changed)], scores[changed].tolist()))
+        report["records"] += len(ids)
+        report["scored"] += int(np.count_nonzero(scored))
+        report["changed"] += int(np.count_nonzero(changed))
+        if progress is not None:
+            progress(report["records"])
+
+    def submit(test_type, chunk):
+        ids, _, old_scores, records = zip(*chunk)
+        if None in old_scores:
+            old_scores = [np.nan if score is None else score for score in old_scores]
+        if pool is not None:
+            scores = pool.submit(scoring.score_records, test_type, records, version)
+        else:
+            scores = scoring.score_records(test_type, records, version)
+        pending.append((ids, old_scores, scores))
+        # Keep every worker busy without queueing the whole store in memory
+        while len(pending) > 2 * report["workers"] or (pending and not isinstance(pending[0][2], Future)):
+            collect(*pending.popleft())
+
+    try:
+        for row in storage.iter_score_rows():
+            chunk = chunks.get(row[1])
+            if chunk is None:
+                chunk = chunks[row[1]] = []
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                submit(row[1], chunks.pop(row[1]))
+        for test_type, chunk in chunks.items():
+            submit(test_type, chunk)
+        while pending:
+            collect(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if not dry_run:
+        for i in range(0, len(updates), chunk_size):
+            storage.update_scores(updates[i:i + chunk_size])
+
+    elapsed = time.perf_counter() - start
+    report["unscorable"] = report["records"] - report["scored"]
+    report["seconds"] = elapsed
+    report["records_per_second"] = report["records"] / elapsed if elapsed > 0 else 0.0
+    report["dry_run"] = dry_run
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path', nargs='?', default=os.environ.get(
+        'SPEAKER_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'speaker_tests.db')))
+    parser.add_argument('--version', type=int, default=None, help='scoring version (default: the active one)')
+    parser.add_argument('--workers', type=int, default=None, help='scoring processes (default: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='count the changes without writing them')
+    args = parser.parse_args()
+
+    from sqlite_storage import SQLiteStorage
+    report = rescore(SQLiteStorage(args.db_path), args.version, args.workers, args.chunk_size, args.dry_run)
+    print(f"scoring v{report['version']}: {report['records']} records, {report['changed']} changed, "
+          f"{report['unscorable']} without metrics{' (dry run)' if args.dry_run else ''}; "
+          f"{report['seconds']:.2f} s, {report['records_per_second']:.0f} records/s "
+          f"on {report['workers']} worker(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Versioned score formulas for every test type.
+
+``SCORING[version][test_type]`` is the Formula that turns a test's metrics
+(the dict stored as its ``additional_data``) into its 0-100 score. Formulas
+only use arithmetic and _clip, so the same code scores one test from floats
+or a whole column of tests from NumPy arrays.
+
+Changing a formula means adding a version rather than editing one in place:
+copy the latest version's table, replace the formulas that change, and bump
+CURRENT_VERSION. New tests are scored with SPEAKER_SCORING_VERSION (default
+CURRENT_VERSION), and rescore.py brings stored scores up to date.
+"""
+import json
+import operator
+import os
+
+
+def _clip(value, low=None, high=None):
+    """Clamp a float or an array of them"""
+    if not isinstance(value, (int, float)):
+        import numpy as np
+
+        return np.clip(value, low, high)
+    if low is not None:
+        value = max(low, value)
+    if high is not None:
+        value = min(high, value)
+    return value
+
+
+def is_band(key):
+    """Whether a metric name is a frequency band label, as stored by the band response tests"""
+    return key.replace('.', '', 1).isdigit()
+
+
+class Formula:
+    """One version of one test type's score.
+
+    ``fields`` lists the metrics the formula reads; None means every
+    frequency band the test stored, however many bands it measured.
+    """
+    def __init__(self, compute, fields=None):
+        self.compute = compute
+        self.fields = fields
+
+    def __call__(self, metrics):
+        return self.compute(metrics)
+
+    def field_names(self, metrics):
+        """The metrics this formula reads from one stored record"""
+        if self.fields is not None:
+            return self.fields
+        return tuple(key for key in metrics if is_band(key))
+
+
+def _mean_response(bands):
+    return sum(bands.values()) / len(bands) * 100
+
+
+SCORING = {
+    1: {
+        "frequency_response": Formula(_mean_response),
+        "bass_response": Formula(_mean_response),
+        # Measured THD+N can exceed 10%, keep the score within 0-100
+        "distortion": Formula(
+            lambda m: _clip(100 - m["distortion_percentage"] * 10, 0),
+            ("distortion_percentage",)),
+        "stereo_imaging": Formula(
+            lambda m: (m["channel_separation"] + m["phase_accuracy"] + m["sound_stage_width"]) / 3,
+            ("channel_separation", "phase_accuracy", "sound_stage_width")),
+        "clarity": Formula(
+            lambda m: (m["mid_clarity"] + m["high_clarity"] + m["vocal_clarity"]) / 3,
+            ("mid_clarity", "high_clarity", "vocal_clarity")),
+        # Higher volume is better (0-75 points), higher distortion is worse (6-30 points penalty)
+        "max_volume": Formula(
+            lambda m: _clip(85 + (m["max_db"] - 85) * 3 - m["distortion_at_max"] * 2, 0, 100),
+            ("max_db", "distortion_at_max")),
+        "dynamic_range": Formula(
+            lambda m: _clip((m["dynamic_range_db"] - 60) * 1.5 + m["detail_preservation"] * 0.2, 0, 100),
+            ("dynamic_range_db", "detail_preservation")),
+        "transient_response": Formula(
+            lambda m: (m["attack_speed"] + m["decay_accuracy"]) / 2,
+            ("attack_speed", "decay_accuracy")),
+        "voice_reproduction": Formula(
+            lambda m: _clip((m["male_voice"] + m["female_voice"]) / 2 - (100 - m["sibilance"]) * 0.2, 0, 100),
+            ("male_voice", "female_voice", "sibilance")),
+        "soundstage": Formula(
+            lambda m: (m["width"] + m["depth"] + m["imaging_precision"]) / 3,
+            ("width", "depth", "imaging_precision"))
+    }
+}
+
+CURRENT_VERSION = max(SCORING)
+
+# Version new tests are scored with
+ACTIVE_VERSION = int(os.environ.get('SPEAKER_SCORING_VERSION', CURRENT_VERSION))
+
+
+def formula(test_type, version=None):
+    """The Formula scoring `test_type` under `version` (default ACTIVE_VERSION), or None if it has none"""
+    version = ACTIVE_VERSION if version is None else version
+    if version not in SCORING:
+        raise ValueError(f"Unknown scoring version: {version}")
+    return SCORING[version].get(test_type)
+
+
+# The C scanner json.loads runs, called directly to skip loads()'s per-call Python overhead
+_scan_json = json.JSONDecoder().scan_once
+
+
+def _group_by_layout(records):
+    """{stored metric names: (record indexes, metric dicts)} of the records whose additional_data is a JSON object"""
+    groups = {}
+    for i, additional_data in enumerate(records):
+        try:
+            metrics, end = _scan_json(additional_data, 0)
+        except (StopIteration, TypeError, ValueError):
+            continue
+        if end != len(additional_data) or not isinstance(metrics, dict):
+            continue
+        layout = tuple(metrics)
+        group = groups.get(layout)
+        if group is None:
+            group = groups[layout] = ([], [])
+        group[0].append(i)
+        group[1].append(metrics)
+    return groups
+
+
+def _metric_rows(parsed, fields):
+    """(positions, float matrix with one column per field) of the parsed records whose fields are all numbers"""
+    import numpy as np
+
+    try:
+        return range(len(parsed)), np.array(list(map(operator.itemgetter(*fields), parsed)),
+                                            dtype=np.float64).reshape(len(parsed), -1)
+    except (TypeError, ValueError):
+        pass
+    # Some record holds a non-number: sort them out one by one
+    positions, rows = [], []
+    for position, metrics in enumerate(parsed):
+        try:
+            rows.append([float(metrics[field]) for field in fields])
+        except (TypeError, ValueError):
+            continue
+        positions.append(position)
+    return positions, np.array(rows, dtype=np.float64).reshape(len(rows), len(fields))
+
+
+def score_records(test_type, records, version=None):
+    """Scores of many stored records of one test type, from their additional_data JSON.
+
+    Records are grouped by the metrics they hold and each group is scored
+    with one vectorized formula call. Records without usable metrics (or of
+    a test type the version has no formula for) score NaN.
+    """
+    import numpy as np
+
+    scores = np.full(len(records), np.nan)
+    compute = formula(test_type, version)
+    if compute is None:
+        return scores
+
+    for layout, (indexes, parsed) in _group_by_layout(records).items():
+        fields = compute.field_names(parsed[0])
+        if not fields or not set(fields).issubset(layout):
+            continue
+        positions, values = _metric_rows(parsed, fields)
+        if len(positions):
+            rows = np.asarray(indexes)[np.asarray(positions, dtype=np.intp)]
+            scores[rows] = compute({field: values[:, j] for j, field in enumerate(fields)})
+    return scores
@@ -0,0 +1,142 @@
+"""Server-rendered test signals and a byte-bounded LRU cache of their encoded buffers.
+
+Signals are rendered with NumPy at a peak level in dBFS, then encoded once as
+a 32-bit float WAV file or raw little-endian float32. The encoded bytes are
+cached and served as-is. Every signal is deterministic (the noise generators
+use a fixed seed), so an ETag computed from the bytes stays valid until the
+entry is evicted and re-rendered.
+
+NumPy, SciPy and measurement.py are imported by the first render, not with
+this module, so the web app starts without them.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+FORMATS = {
+    'wav': 'audio/wav',
+    'f32': 'application/octet-stream'
+}
+
+MAX_DURATION = 60.0
+SAMPLE_RATES = (8000, 16000, 22050, 32000, 44100, 48000, 88200, 96000, 192000)
+
+
+def _sweep(duration, sample_rate):
+    from measurement import exponential_sweep
+
+    return exponential_sweep(20.0, min(20000.0, sample_rate / 2), duration, sample_rate)
+
+
+def _stepped(duration, sample_rate):
+    from measurement import DEFAULT_TONES, stepped_tones
+
+    return stepped_tones(DEFAULT_TONES, duration / len(DEFAULT_TONES), sample_rate, amplitude=1.0)
+
+
+def _pink_noise(duration, sample_rate):
+    """White noise shaped to -3 dB/octave in the frequency domain"""
+    import numpy as np
+    from scipy import fft as sp_fft
+
+    n = int(round(duration * sample_rate))
+    spectrum = sp_fft.rfft(np.random.default_rng(0).standard_normal(n))
+    freqs = sp_fft.rfftfreq(n, 1 / sample_rate)
+    spectrum[0] = 0
+    spectrum[1:] /= np.sqrt(freqs[1:])
+    return sp_fft.irfft(spectrum, n)
+
+
+def _mls(duration, sample_rate):
+    """Maximum length sequence, one full period of at least `duration` (orders 10 to 20)"""
+    import numpy as np
+    from scipy.signal import max_len_seq
+
+    order = int(np.clip(np.ceil(np.log2(duration * sample_rate + 1)), 10, 20))
+    return max_len_seq(order)[0] * 2.0 - 1.0
+
+
+def _bass_bursts(duration, sample_rate):
+    """One Hann-windowed burst per bass response test band, each followed by an equal length of silence"""
+    import numpy as np
+    from measurement import BASS_BANDS
+
+    step = int(round(duration * sample_rate / len(BASS_BANDS)))
+    t = np.arange(step // 2) / sample_rate
+    bursts = np.sin(2 * np.pi * np.asarray(BASS_BANDS, dtype=np.float64)[:, None] * t) * np.hanning(len(t))
+    out = np.zeros((len(BASS_BANDS), step))
+    out[:, :len(t)] = bursts
+    return out.ravel()
+
+
+# kind -> (renderer, default duration in seconds)
+GENERATORS = {
+    'sweep': (_sweep, 10.0),
+    'stepped-sine': (_stepped, 7.0),
+    'pink-noise': (_pink_noise, 10.0),
+    'mls': (_mls, 1.0),
+    'bass-bursts': (_bass_bursts, 7.0)
+}
+
+
+def render(kind, sample_rate=48000, duration=None, level=-6.0, fmt='wav'):
+    """Render and encode one signal; returns the encoded bytes"""
+    import io
+    import numpy as np
+    from scipy.io import wavfile
+
+    if kind not in GENERATORS:
+        raise ValueError(f"Unknown signal kind: {kind}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown signal format: {fmt}")
+    if sample_rate not in SAMPLE_RATES:
+        raise ValueError(f"Unsupported sample rate: {sample_rate}")
+    generate, default_duration = GENERATORS[kind]
+    duration = default_duration if duration is None else duration
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"Duration must be between 0 and {MAX_DURATION:g} seconds")
+    if not math.isfinite(level) or level > 0:
+        raise ValueError("Level is a peak level in dBFS and must be a finite number no greater than 0")
+
+    samples = generate(duration, sample_rate)
+    samples *= 10 ** (level / 20) / np.abs(samples).max()
+    samples = samples.astype('<f4')
+    if fmt == 'f32':
+        return samples.tobytes()
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, samples)
+    return buffer.getvalue()
+
+
+class SignalCache:
+    """LRU cache of rendered signals, bounded by the total size of the cached bytes"""
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (data, etag)
+        self._lock = threading.Lock()
+
+    def get(self, kind, sample_rate=48000, duration=None, level=-6.0, fmt='wav'):
+        """(data, etag) for a signal, rendering it on a miss"""
+        key = (kind, sample_rate, duration, level, fmt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        # Render outside the lock; two concurrent misses just render twice
+        data = render(kind, sample_rate, duration, level, fmt)
+        entry = (data, hashlib.blake2b(data, digest_size=16).hexdigest())
+        if len(data) > self.max_bytes:
+            return entry
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, (evicted, _) = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return entry
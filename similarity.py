@@ -0,0 +1,221 @@
+"""Nearest-neighbour search for "speakers that sound like X".
+
+Every speaker model is embedded as a fixed-length vector: its mean frequency
+response and mean bass response, each resampled onto a log-spaced frequency
+grid and with its mean level removed, so curves are compared by shape
+rather than loudness. Similarity is the cosine between two embeddings.
+
+Tests are folded into per-model running sums as they are stored, and only
+the embeddings of models that received tests are recomputed before the next
+query. Up to IVF_THRESHOLD models a query scores every embedding in batched
+matrix products; above it the index clusters the embeddings (spherical
+k-means) and a query only scans the clusters nearest to it.
+"""
+import json
+import math
+import threading
+
+import numpy as np
+
+from scoring import is_band
+
+# Frequencies each curve is resampled to before averaging
+CURVES = {
+    "frequency_response": np.geomspace(20, 20000, 24),
+    "bass_response": np.geomspace(20, 200, 8),
+}
+
+# Models above which queries probe the nearest clusters instead of scanning every model
+IVF_THRESHOLD = 4096
+IVF_PROBES = 8
+IVF_ITERATIONS = 10
+
+# Embeddings scored per matrix product
+BATCH_ROWS = 16384
+
+
+def resample_curve(additional_data, grid):
+    """Levels of a band response record interpolated onto grid (in log frequency), or None"""
+    try:
+        metrics = json.loads(additional_data)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(metrics, dict):
+        return None
+    points = []
+    for key, value in metrics.items():
+        if not is_band(key):
+            continue
+        try:
+            frequency, level = float(key), float(value)
+        except (TypeError, ValueError):
+            continue
+        if frequency > 0 and math.isfinite(level):
+            points.append((frequency, level))
+    if not points:
+        return None
+    points.sort()
+    frequencies, levels = zip(*points)
+    return np.interp(np.log(grid), np.log(frequencies), levels)
+
+
+def _top_k(scores, rows, k):
+    """(rows, scores) of the k highest scores, best first"""
+    if k < len(scores):
+        best = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[best], rows[best]
+    order = np.argsort(-scores, kind='stable')
+    return rows[order], scores[order]
+
+
+class SimilarityIndex:
+    def __init__(self, ivf_threshold=IVF_THRESHOLD):
+        self.ivf_threshold = ivf_threshold
+        self.names = []
+        self._rows = {}  # speaker model -> row
+        self._sums = {name: np.zeros((64, len(grid))) for name, grid in CURVES.items()}
+        self._counts = {name: np.zeros(64, dtype=np.int64) for name in CURVES}
+        self._vectors = np.zeros((64, sum(len(grid) for grid in CURVES.values())), dtype=np.float32)
+        self._dirty = set()  # rows whose embedding is out of date
+        self._centroids = None  # (clusters x dimensions) once the index is large enough to cluster
+        self._cluster = np.full(64, -1, dtype=np.int32)
+        self._trained_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def state(self):
+        """Names and curve sums for a snapshot; embeddings and clusters are rebuilt from them"""
+        with self._lock:
+            n = len(self.names)
+            return {
+                "names": list(self.names),
+                "sums": {name: sums[:n].copy() for name, sums in self._sums.items()},
+                "counts": {name: counts[:n].copy() for name, counts in self._counts.items()}
+            }
+
+    @classmethod
+    def from_state(cls, state, ivf_threshold=IVF_THRESHOLD):
+        index = cls(ivf_threshold)
+        for speaker_model in state["names"]:
+            index._row(speaker_model)
+        n = len(index.names)
+        for name in CURVES:
+            index._sums[name][:n] = state["sums"][name]
+            index._counts[name][:n] = state["counts"][name]
+        index._dirty.update(range(n))
+        return index
+
+    def _row(self, speaker_model):
+        row = self._rows.get(speaker_model)
+        if row is not None:
+            return row
+        row = self._rows[speaker_model] = len(self.names)
+        self.names.append(speaker_model)
+        if row == len(self._vectors):
+            for name in CURVES:
+                self._sums[name] = np.concatenate([self._sums[name], np.zeros_like(self._sums[name])])
+                self._counts[name] = np.concatenate([self._counts[name], np.zeros_like(self._counts[name])])
+            self._vectors = np.concatenate([self._vectors, np.zeros_like(self._vectors)])
+            self._cluster = np.concatenate([self._cluster, np.full_like(self._cluster, -1)])
+        return row
+
+    def add(self, speaker_model, test_type, additional_data):
+        """Fold one stored test into its model's curves; returns whether it held a usable curve"""
+        grid = CURVES.get(test_type)
+        if grid is None or not additional_data:
+            return False
+        curve = resample_curve(additional_data, grid)
+        if curve is None:
+            return False
+        with self._lock:
+            row = self._row(speaker_model)
+            self._sums[test_type][row] += curve
+            self._counts[test_type][row] += 1
+            self._dirty.add(row)
+        return True
+
+    def _embed(self, rows):
+        parts = []
+        for name, grid in CURVES.items():
+            counts = self._counts[name][rows]
+            means = self._sums[name][rows] / np.maximum(counts, 1)[:, None]
+            shapes = means - means.mean(axis=1, keepdims=True)
+            shapes[counts == 0] = 0
+            # Weigh each curve equally however many grid points it has
+            parts.append(shapes / math.sqrt(len(grid)))
+        vectors = np.hstack(parts)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def _refresh(self):
+        """Re-embed the models that received tests and keep the clusters current; call with the lock held"""
+        n = len(self.names)
+        if self._dirty:
+            rows = np.fromiter(self._dirty, dtype=np.intp, count=len(self._dirty))
+            self._dirty.clear()
+            self._vectors[rows] = self._embed(rows)
+            if self._centroids is not None:
+                self._cluster[rows] = self._assign(self._vectors[rows])
+        if n >= self.ivf_threshold and n >= 2 * self._trained_size:
+            self._train(n)
+
+    def _nearest_centroids(self, vectors, count):
+        similarity = vectors @ self._centroids.T
+        if count >= similarity.shape[1]:
+            return np.argsort(-similarity, axis=1)
+        return np.argpartition(-similarity, count - 1, axis=1)[:, :count]
+
+    def _assign(self, vectors):
+        """Nearest centroid of each vector"""
+        return np.concatenate([np.argmax(vectors[i:i + BATCH_ROWS] @ self._centroids.T, axis=1)
+                               for i in range(0, len(vectors), BATCH_ROWS)])
+
+    def _train(self, n):
+        """Cluster the first n embeddings with spherical k-means"""
+        vectors = self._vectors[:n]
+        rng = np.random.default_rng(0)
+        self._centroids = vectors[rng.choice(n, max(1, int(math.sqrt(n))), replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assigned = self._assign(vectors)
+            order = np.argsort(assigned, kind='stable')
+            clusters, starts = np.unique(assigned[order], return_index=True)
+            sums = np.add.reduceat(vectors[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Clusters that lost every member keep their old centroid
+            self._centroids[clusters] = np.where(norms > 0, sums / np.maximum(norms, 1e-12), self._centroids[clusters])
+        self._cluster[:n] = self._assign(vectors)
+        self._trained_size = n
+
+    def _scan(self, query, rows, k):
+        """Top k (rows, similarities) among rows, scored BATCH_ROWS at a time"""
+        best_rows, best_scores = np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        for i in range(0, len(rows), BATCH_ROWS):
+            batch = rows[i:i + BATCH_ROWS]
+            scores = self._vectors[batch] @ query
+            best_rows, best_scores = _top_k(np.concatenate([best_scores, scores]),
+                                            np.concatenate([best_rows, batch]), k)
+        return best_rows, best_scores
+
+    def nearest(self, speaker_model, k=5):
+        """[(speaker model, cosine similarity)] of the k models whose curves are closest, or None if none is known"""
+        with self._lock:
+            row = self._rows.get(speaker_model)
+            if row is None:
+                return None
+            self._refresh()
+            query = self._vectors[row].copy()
+            if k <= 0 or not query.any():
+                return []
+            n = len(self.names)
+            if self._centroids is None:
+                candidates = np.arange(n)
+            else:
+                probes = self._nearest_centroids(query[None, :], IVF_PROBES)[0]
+                probed = np.zeros(len(self._centroids), dtype=bool)
+                probed[probes] = True
+                candidates = np.flatnonzero(probed[self._cluster[:n]])
+            candidates = candidates[candidates != row]
+            rows, scores = self._scan(query, candidates, k)
+            return [(self.names[r], float(s)) for r, s in zip(rows, scores)]
@@ -1,259 +1,362 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 import os
 import json
 import uuid
 import datetime
-import numpy as np
-import random
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from storage_common import SEED, HISTORICAL_ROWS, check_test, sample_tests, iter_csv, gzip_chunks
+from aggregates import RunningAggregates, parse_rating
+from signals import GENERATORS, FORMATS, SignalCache
+from registry import TEST_TYPES, TEST_TYPES_BY_SLUG, lookup as lookup_test_type
+from analysis_pool import AnalysisExecutor, ExecutorBusy
+from jobs import JobTable, JobTableFull
+from scoring import SCORING
 
 # Initialize Flask app
 app = Flask(__name__, 
     static_folder='static',
     template_folder='templates')
 
+class _TestIndex:
+    """Id lookup plus secondary indexes over a list of test records"""
+    def __init__(self):
+        self.by_id = {}
+        self.by_model = {}  # speaker_model -> [tests]
+        self.by_user = {}  # user_id -> [tests]
+        self.by_type = {}  # test_type -> [tests]
+    
+    def add(self, test):
+        self.by_id[test["id"]] = test
+        self.by_model.setdefault(test.get("speaker_model"), []).append(test)
+        self.by_user.setdefault(test.get("user_id"), []).append(test)
+        self.by_type.setdefault(test.get("test_type"), []).append(test)
+    
+    def select(self, tests, speaker_model=None, user_id=None, test_type=None):
+        """Return the tests matching every given filter, scanning only the smallest index bucket"""
+        return list(self.iter_select(tests, speaker_model, user_id, test_type))
+    
+    def iter_select(self, tests, speaker_model=None, user_id=None, test_type=None):
+        """Iterate over the tests matching every given filter without building a list"""
+        filters = [(self.by_model, "speaker_model", speaker_model),
+                   (self.by_user, "user_id", user_id),
+                   (self.by_type, "test_type", test_type)]
+        filters = [f for f in filters if f[2] is not None]
+        if not filters:
+            return iter(tests)
+        
+        buckets = [(index.get(value, []), key, value) for index, key, value in filters]
+        buckets.sort(key=lambda b: len(b[0]))
+        candidates = buckets[0][0]
+        rest = [(key, value) for _, key, value in buckets[1:]]
+        if not rest:
+            return iter(candidates)
+        return (t for t in candidates if all(t.get(key) == value for key, value in rest))
+
+# Tests a writer may leave queued before it applies the queue itself
+PENDING_INSERTS = 256
+
 # In-memory storage for Vercel (since SQLite won't work in serverless)
 class MemoryStorage:
-    def __init__(self):
+    """Test storage held in process memory, safe to share between request threads.
+    
+    Inserts are validated by the writer, then appended to a queue without
+    taking any lock; the indexes and analytics are brought up to date under
+    one lock by the next call that reads or updates them (or by a writer once
+    PENDING_INSERTS are queued), so a burst of concurrent test submissions is
+    applied in one batch and every read still sees every test stored before it.
+    
+    The historical tests are generated from `seed` (see synthetic_history.py)
+    by the first call that reads them, not when the storage is created, and
+    the analytics engine is only built for the first query the running
+    aggregates cannot answer, so a new process serves its first requests
+    without importing NumPy.
+    """
+    thread_safe = True
+    
+    def __init__(self, historical_rows=HISTORICAL_ROWS, seed=SEED):
         self.tests = []
         self.users = {}  # user_id -> [test_ids]
-        self.current_user_id = None
-        self.historical_data = []  # For storing "past" test data
+        self._index = _TestIndex()
+        self._historical = None  # HistoricalDataset of "past" test data, once generated
+        self._historical_start = None  # engine row of its first test
+        self._historical_rows = historical_rows
+        self._seed = seed
+        self.aggregates = RunningAggregates()  # Summary of current (non-historical) tests
+        self._engine = None  # AnalyticsEngine array view of current and historical tests, once built
+        self._engine_rows = {}  # test_id -> engine row
+        self._pending = deque()  # tests added but not applied yet
+        self._lock = threading.Lock()
         
         # Add some sample data
-        self._add_sample_data()
-        self._add_historical_data()
+        self.add_tests(list(sample_tests(seed)))
     
-    def _add_sample_data(self):
-        # Add some sample test data
-        speaker_models = ["Bose SoundLink", "JBL Flip 5", "Sony WH-1000XM4", "Sonos One"]
-        test_types = ["frequency_response", "distortion", "bass_response"]
-        
-        for i in range(10):
-            model = random.choice(speaker_models)
-            test_type = random.choice(test_types)
+    def _analytics(self):
+        """The analytics engine, built from the stored tests on first use; call with the lock held"""
+        if self._engine is None:
+            from analytics_engine import AnalyticsEngine
             
-            if test_type == "frequency_response":
-                additional_data = {
-                    "100": random.uniform(0.7, 0.95),
-                    "500": random.uniform(0.75, 0.98),
-                    "1000": random.uniform(0.8, 0.99),
-                    "5000": random.uniform(0.75, 0.95),
-                    "10000": random.uniform(0.7, 0.9),
-                    "15000": random.uniform(0.6, 0.85)
-                }
-            elif test_type == "distortion":
-                distortion = random.uniform(0.5, 5.0)
-                additional_data = {"distortion_percentage": distortion}
-            else:  # bass_response
-                additional_data = {
-                    "20": random.uniform(0.6, 0.9),
-                    "40": random.uniform(0.65, 0.92),
-                    "60": random.uniform(0.7, 0.94),
-                    "100": random.uniform(0.75, 0.96),
-                    "150": random.uniform(0.8, 0.98),
-                    "200": random.uniform(0.75, 0.95)
-                }
-                
-            self.add_test({
-                "id": str(uuid.uuid4()),
-                "timestamp": (datetime.datetime.now() - datetime.timedelta(days=i)).isoformat(),
-                "speaker_model": model,
-                "test_type": test_type,
-                "score": random.uniform(70, 95),
-                "user_rating": random.randint(3, 5) if random.random() > 0.3 else None,
-                "additional_data": json.dumps(additional_data)
-            })
-    
-    def _add_historical_data(self):
-        # Add historical data for comparison purposes
-        speaker_models = ["Bose SoundLink", "JBL Flip 5", "Sony WH-1000XM4", "Sonos One", 
-                         "Klipsch R-51M", "KEF Q150", "Edifier R1280T", "Polk Audio T15"]
-        test_types = ["frequency_response", "distortion", "bass_response", "stereo_imaging", 
-                     "clarity", "max_volume", "dynamic_range", "transient_response", 
-                     "voice_reproduction", "soundstage"]
-        
-        # Create 50 historical test records
-        for i in range(50):
-            model = random.choice(speaker_models)
-            # Bias some speakers to be better than others
-            if model in ["KEF Q150", "Sony WH-1000XM4"]:
-                base_score = random.uniform(80, 95)
-            elif model in ["Bose SoundLink", "Sonos One"]:
-                base_score = random.uniform(75, 90)
-            else:
-                base_score = random.uniform(65, 85)
-                
-            # Create tests for different types
-            for test_type in random.sample(test_types, k=random.randint(3, 8)):
-                # Add some variation to scores
-                test_score = base_score + random.uniform(-10, 10)
-                test_score = max(50, min(99, test_score))
-                
-                historical_test = {
-                    "id": str(uuid.uuid4()),
-                    "timestamp": (datetime.datetime.now() - datetime.timedelta(days=random.randint(30, 365))).isoformat(),
-                    "speaker_model": model,
-                    "test_type": test_type,
-                    "score": test_score,
-                    "user_rating": random.randint(3, 5) if random.random() > 0.3 else None,
-                    "additional_data": json.dumps({"historical": True}),
-                    "is_historical": True,
-                    "user_id": f"past_user_{random.randint(1, 10)}"
-                }
-                
-                self.historical_data.append(historical_test)
+            engine = AnalyticsEngine()
+            for test in self.tests:
+                self._engine_rows[test["id"]] = engine.add(test)
+            self._engine = engine
+        return self._engine
+    
+    def _history(self):
+        """The historical dataset, generated and added to the analytics on first use; call with the lock held"""
+        if self._historical is None:
+            from synthetic_history import HistoricalDataset
+            
+            historical = HistoricalDataset(self._historical_rows, self._seed)
+            self._historical_start = historical.add_to(self._analytics())
+            self._historical = historical
+        return self._historical
+    
+    @property
+    def engine(self):
+        with self._lock:
+            self._apply_pending()
+            return self._analytics()
+    
+    @property
+    def historical_data(self):
+        with self._lock:
+            self._apply_pending()
+            return self._history()
+    
+    def _apply_pending(self):
+        """Index every queued test; call with the lock held"""
+        pending = self._pending
+        while pending:
+            test_data = pending.popleft()
+            # The engine validates the test before anything else indexes it
+            if self._engine is not None:
+                self._engine_rows[test_data["id"]] = self._engine.add(test_data)
+            user_id = test_data.get("user_id")
+            if user_id:
+                self.users.setdefault(user_id, []).append(test_data["id"])
+            self.tests.append(test_data)
+            self._index.add(test_data)
+            self.aggregates.add(test_data)
+    
+    def _queued(self):
+        # Keep the queue short even if nothing reads for a while; if the lock
+        # is busy, its holder or the next reader applies the queue instead
+        if len(self._pending) >= PENDING_INSERTS and self._lock.acquire(blocking=False):
+            try:
+                self._apply_pending()
+            finally:
+                self._lock.release()
     
     def set_user_session(self, user_id):
-        # Set current user ID and initialize if needed
-        self.current_user_id = user_id
-        if user_id not in self.users:
-            self.users[user_id] = []
+        """Register a testing session; its tests carry its id as their user_id"""
+        self.users.setdefault(user_id, [])
         return user_id
     
     def add_test(self, test_data):
-        # Add user_id to test data if we have a current user
-        if self.current_user_id:
-            test_data["user_id"] = self.current_user_id
-            # Add to user's test list
-            self.users[self.current_user_id].append(test_data["id"])
-        
-        self.tests.append(test_data)
+        # Rejected here, in the writer's request, not by whichever read applies the queue
+        check_test(test_data)
+        self._pending.append(test_data)
+        self._queued()
         return test_data["id"]
     
+    def add_tests(self, tests):
+        """Add several tests at once; returns their ids"""
+        tests = list(tests)
+        for test_data in tests:
+            check_test(test_data)
+        self._pending.extend(tests)
+        self._queued()
+        return [test_data["id"] for test_data in tests]
+    
     def update_rating(self, test_id, rating):
-        for test in self.tests:
-            if test["id"] == test_id:
-                test["user_rating"] = rating
-                return True
-        return False
-    
-    def get_all_tests(self, speaker_model=None, user_id=None, include_historical=False):
-        results = []
-        
-        # Add current tests
-        for test in self.tests:
-            if (speaker_model is None or test.get("speaker_model") == speaker_model) and \
-               (user_id is None or test.get("user_id") == user_id):
-                results.append(test)
-        
-        # Add historical data if requested
-        if include_historical:
-            for test in self.historical_data:
-                if (speaker_model is None or test.get("speaker_model") == speaker_model) and \
-                   (user_id is None or test.get("user_id") == user_id):
-                    results.append(test)
+        rating = parse_rating(rating)
+        with self._lock:
+            self._apply_pending()
+            test = self._index.by_id.get(test_id)
+            if test is None:
+                return False
+            if self._engine is not None:
+                self._engine.set_rating(self._engine_rows[test_id], rating)
+            self.aggregates.rating_changed(test.get("user_rating"), rating)
+            test["user_rating"] = rating
+            return True
+    
+    def update_scores(self, scores):
+        """Set the score of many tests from (test_id, score) pairs; returns how many were found"""
+        updated = 0
+        with self._lock:
+            self._apply_pending()
+            historical = self._history()
+            engine = self._analytics()
+            for test_id, score in scores:
+                test = self._index.by_id.get(test_id)
+                if test is not None:
+                    self.aggregates.score_changed(test.get("speaker_model", "Unknown"), test.get("score"), score)
+                    engine.set_score(self._engine_rows[test_id], score)
+                    test["score"] = score
+                else:
+                    position = historical.find(test_id)
+                    if position is None:
+                        continue
+                    engine.set_score(self._historical_start + position, score)
+                    historical.set_score(position, score)
+                updated += 1
+        return updated
+    
+    def get_all_tests(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        with self._lock:
+            self._apply_pending()
+            # Add current tests
+            results = self._index.select(self.tests, speaker_model, user_id, test_type)
+            
+            # Add historical data if requested
+            if include_historical:
+                results.extend(self._history().select(speaker_model, user_id, test_type))
         
         return results
     
+    def iter_tests(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        """Same rows as get_all_tests, yielded one at a time for streaming exports"""
+        # The indexes only ever grow by appending, so they are walked without the lock
+        with self._lock:
+            self._apply_pending()
+            current = self._index.iter_select(self.tests, speaker_model, user_id, test_type)
+            historical = self._history().iter_select(speaker_model, user_id, test_type) if include_historical else ()
+        yield from current
+        yield from historical
+    
+    def iter_score_rows(self):
+        """(id, test_type, score, additional_data) of every current and historical test, for rescoring"""
+        with self._lock:
+            self._apply_pending()
+            tests = list(self.tests)
+            historical = self._history()
+        for test in tests:
+            yield test["id"], test.get("test_type"), test.get("score"), test.get("additional_data")
+        yield from historical.iter_score_rows()
+    
+    def _find(self, test_id):
+        # Check current tests, then historical tests
+        test = self._index.by_id.get(test_id)
+        if test is None:
+            historical = self._history()
+            position = historical.find(test_id)
+            if position is not None:
+                test = historical.record(position)
+        return test
+    
     def get_test_by_id(self, test_id):
-        # Check current tests
-        for test in self.tests:
-            if test["id"] == test_id:
-                return test
-        
-        # Check historical tests
-        for test in self.historical_data:
-            if test["id"] == test_id:
-                return test
-        
-        return None
+        with self._lock:
+            self._apply_pending()
+            return self._find(test_id)
     
     def get_user_tests(self, user_id=None):
-        """Get all tests for a specific user or current user"""
-        if user_id is None:
-            user_id = self.current_user_id
-        
+        """Get all tests of a testing session"""
         if not user_id:
             return []
         
-        return [t for t in self.tests if t.get("user_id") == user_id]
+        with self._lock:
+            self._apply_pending()
+            return list(self._index.by_user.get(user_id, []))
     
     def export_user_data(self, user_id=None):
-        """Export data for a specific user or current user as CSV"""
-        tests = self.get_user_tests(user_id)
-        return self._tests_to_csv(tests)
+        """Export the tests of a testing session as a stream of CSV chunks"""
+        return iter_csv(self.iter_tests(user_id=user_id) if user_id else [])
     
     def export_historical_data(self):
-        """Export all historical data as CSV"""
-        return self._tests_to_csv(self.historical_data)
-    
-    def _tests_to_csv(self, tests):
-        """Convert tests to CSV string"""
-        from io import StringIO
-        import csv
-        
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Define column names
-        column_names = ["id", "timestamp", "speaker_model", "test_type", 
-                        "score", "user_rating", "additional_data", "user_id"]
-        
-        # Write header
-        writer.writerow(column_names)
-        
-        # Write data rows
-        for test in tests:
-            row = [test.get(col, '') for col in column_names]
-            writer.writerow(row)
-        
-        return output.getvalue()
+        """Export all historical data as a stream of CSV chunks"""
+        return iter_csv(self.historical_data)
+    
+    def get_analytics_summary(self, speaker_model=None, include_historical=False):
+        """Totals, averages and distributions shown on the analytics dashboard"""
+        with self._lock:
+            self._apply_pending()
+            # The unfiltered dashboard view is kept up to date on every write
+            if speaker_model is None and not include_historical:
+                return self.aggregates.summary()
+            if include_historical:
+                self._history()
+            return self._analytics().summary(speaker_model, include_historical)
+    
+    def get_trends(self, granularity, start=None, end=None, speaker_model=None, test_type=None,
+                   include_historical=True, group_by=None):
+        """Average score and test count per hour, day or week bucket starting in [start, end) (epoch seconds)"""
+        with self._lock:
+            self._apply_pending()
+            if include_historical:
+                self._history()
+            return self._analytics().score_trends(granularity, start, end, speaker_model, test_type,
+                                            include_historical, group_by)
     
     def get_best_speakers(self, test_types=None, limit=5):
         """Find the best speakers based on average scores"""
-        # Combine current and historical tests
-        all_tests = self.tests + self.historical_data
-        
-        # Filter by test types if specified
-        if test_types:
-            all_tests = [t for t in all_tests if t.get("test_type") in test_types]
-        
-        # Group tests by speaker model
-        model_scores = {}
-        for test in all_tests:
-            model = test.get("speaker_model", "Unknown")
-            if model not in model_scores:
-                model_scores[model] = {"sum": 0, "count": 0, "scores_by_type": {}}
-            
-            test_type = test.get("test_type")
-            score = test.get("score")
-            
-            if score is not None:
-                model_scores[model]["sum"] += score
-                model_scores[model]["count"] += 1
-                
-                if test_type:
-                    if test_type not in model_scores[model]["scores_by_type"]:
-                        model_scores[model]["scores_by_type"][test_type] = []
-                    model_scores[model]["scores_by_type"][test_type].append(score)
-        
-        # Calculate averages
-        results = []
-        for model, data in model_scores.items():
-            if data["count"] > 0:
-                avg_score = data["sum"] / data["count"]
-                
-                # Calculate scores by test type
-                type_scores = {}
-                for test_type, scores in data["scores_by_type"].items():
-                    if scores:
-                        type_scores[test_type] = sum(scores) / len(scores)
-                
-                results.append({
-                    "model": model,
-                    "average_score": avg_score,
-                    "test_count": data["count"],
-                    "scores_by_type": type_scores
-                })
-        
-        # Sort by average score (descending)
-        results.sort(key=lambda x: x["average_score"], reverse=True)
-        
-        # Return top N results
-        return results[:limit]
+        with self._lock:
+            self._apply_pending()
+            self._history()
+            return self._analytics().best_speakers(test_types, limit)
+    
+    def get_personalized_speakers(self, user_ids=None, test_types=None, limit=5):
+        """{user id: best speakers weighted towards the test types that user runs most}; None means every user"""
+        with self._lock:
+            self._apply_pending()
+            self._history()
+            return self._analytics().personalized_speakers(user_ids, test_types, limit)
+    
+    def similar_speakers(self, speaker_model, limit=5):
+        """[(speaker model, similarity)] of the models that sound most like speaker_model, or None"""
+        with self._lock:
+            self._apply_pending()
+            return self._analytics().similar_speakers(speaker_model, limit)
+
+def create_storage(backend=None):
+    """Build the storage backend named by SPEAKER_STORAGE_BACKEND ("memory", "columnar", "sqlite" or "remote")"""
+    backend = backend or os.environ.get('SPEAKER_STORAGE_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'columnar':
+        # With SPEAKER_DATA_DIR set, writes are logged there and survive restarts
+        from columnar_storage import ColumnarStorage
+        return ColumnarStorage(os.environ.get('SPEAKER_DATA_DIR'))
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        default_path = os.path.join(os.path.dirname(app.static_folder), 'data', 'speaker_tests.db')
+        return SQLiteStorage(os.environ.get('SPEAKER_DB_PATH', default_path))
+    if backend == 'remote':
+        # A client of the process started by storage_server.py, shared by every worker
+        from storage_server import RemoteStorage
+        return RemoteStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
 
 # Initialize storage
-storage = MemoryStorage()
+storage = create_storage()
+
+# Capture analyses run in worker processes; SPEAKER_ANALYSIS_WORKERS=0 runs them inline
+analysis = AnalysisExecutor(
+    workers=int(os.environ['SPEAKER_ANALYSIS_WORKERS']) if os.environ.get('SPEAKER_ANALYSIS_WORKERS') else None,
+    max_pending=int(os.environ.get('SPEAKER_ANALYSIS_QUEUE', 0)) or None)
+ANALYSIS_TIMEOUT = float(os.environ.get('SPEAKER_ANALYSIS_TIMEOUT', 60))
+
+# Background jobs: async tests and POST /jobs. Finished jobs are kept for SPEAKER_JOB_TTL seconds.
+jobs = JobTable(max_jobs=int(os.environ.get('SPEAKER_JOB_LIMIT', 1000)),
+                ttl=float(os.environ.get('SPEAKER_JOB_TTL', 600)))
+job_runner = ThreadPoolExecutor(int(os.environ.get('SPEAKER_JOB_THREADS', 4)), thread_name_prefix='speaker-job')
+SSE_KEEPALIVE = 15
+
+# Rendered test signals, shared by every request
+signal_cache = SignalCache(int(os.environ.get('SPEAKER_SIGNAL_CACHE_MB', 64)) * 2**20)
+
+# Processes used by POST /rescore; by default one per CPU
+RESCORE_WORKERS = int(os.environ['SPEAKER_RESCORE_WORKERS']) if os.environ.get('SPEAKER_RESCORE_WORKERS') else None
+
+# Raw audio of measured captures, kept for re-analysis when SPEAKER_CAPTURE_ARCHIVE names a directory
+archive = None
+if os.environ.get('SPEAKER_CAPTURE_ARCHIVE'):
+    from capture_archive import CaptureArchive
+    archive = CaptureArchive(
+        os.environ['SPEAKER_CAPTURE_ARCHIVE'],
+        segment_bytes=int(os.environ.get('SPEAKER_CAPTURE_SEGMENT_MB', 1024)) * 2**20)
 
 # Routes
 @app.route('/')
@@ -262,7 +365,7 @@ def index():
 
 @app.route('/static/<path:path>')
 def serve_static(path):
-    return send_from_directory('../static', path)
+    return send_from_directory(app.static_folder, path)
 
 @app.route('/detect-speakers', methods=['GET'])
 def detect_speakers():
@@ -281,361 +384,464 @@ def detect_speakers():
         }
     })
 
-@app.route('/test/frequency-response', methods=['POST'])
-def test_frequency_response():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated test results
-    frequencies = [100, 500, 1000, 5000, 10000, 15000]
-    results = {}
-    
-    for freq in frequencies:
-        # Generate realistic simulated response
-        simulated_response = 0.9 - (0.2 * abs(freq - 1000) / 14000)
-        # Add some random variation
-        simulated_response += random.uniform(-0.05, 0.05)
-        simulated_response = max(0.5, min(0.99, simulated_response))
-        results[str(freq)] = simulated_response
+@app.route('/signals/<kind>', methods=['GET'])
+def get_signal(kind):
+    """Serve a rendered test signal (sweep, stepped-sine, pink-noise, mls, bass-bursts) as WAV or raw float32"""
+    if kind not in GENERATORS:
+        return jsonify({"error": f"Unknown signal kind: {kind}"}), 404
     
-    score = sum(results.values()) / len(results) * 100
-    
-    # Save results
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "frequency_response",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps(results)
-    })
-    
-    return jsonify({
-        "test": "frequency_response",
-        "results": results,
-        "score": score,
-        "id": test_id
-    })
+    fmt = request.args.get('format', 'wav')
+    try:
+        duration = request.args.get('duration')
+        data, etag = signal_cache.get(
+            kind,
+            sample_rate=int(request.args.get('sample_rate', 48000)),
+            duration=float(duration) if duration else None,
+            level=float(request.args.get('level', -6)),
+            fmt=fmt)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # The cached bytes are the response body; If-None-Match and Range are answered from them too
+    response = Response(data, mimetype=FORMATS[fmt])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    response.headers['X-Sample-Rate'] = request.args.get('sample_rate', '48000')
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
-@app.route('/test/distortion', methods=['POST'])
-def test_distortion():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated distortion test
-    distortion_percentage = random.uniform(0.5, 5.0)
-    score = 100 - (distortion_percentage * 10)
+def request_params():
+    """Parameters from a JSON body, form fields or the query string"""
+    params = request.args.to_dict()
+    params.update(request.form.to_dict())
+    params.update(request.get_json(silent=True) or {})
+    return params
+
+def text_param(params, name, default=None):
+    """params[name] (default if absent), which must be a string; raises ValueError for any other JSON value"""
+    value = params.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+def request_user_id(params=None):
+    """The testing session a request belongs to: an X-User-Id header or a user_id parameter"""
+    params = request.args if params is None else params
+    return request.headers.get('X-User-Id') or text_param(params, 'user_id') or None
+
+def read_capture_bytes():
+    """Raw bytes of an uploaded capture (multipart "capture" file or audio/wav body), or None"""
+    upload = request.files.get('capture')
+    if upload is not None:
+        return upload.read()
+    if is_wav_body():
+        return request.get_data()
+    return None
+
+def is_wav_body():
+    return request.mimetype in ('audio/wav', 'audio/x-wav', 'audio/wave')
+
+def read_capture():
+    """Decode an uploaded WAV capture into (sample_rate, samples), or None if the request has none"""
+    data = read_capture_bytes()
+    if data is None:
+        return None
     
-    # Save results
-    test_id = storage.add_test({
+    from measurement import read_wav
+    return read_wav(data)
+
+def build_test(test_type, params, outcome, timestamp=None):
+    """Turn a TestType.run outcome into a test record; returns (test record, response fields)"""
+    score, additional_data, fields = outcome
+    test = {
         "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "distortion",
+        "timestamp": timestamp or datetime.datetime.now().isoformat(),
+        "speaker_model": text_param(params, 'speaker_model', 'Unknown'),
+        "test_type": test_type.name,
         "score": score,
         "user_rating": None,
-        "additional_data": json.dumps({"distortion_percentage": distortion_percentage})
-    })
-    
-    return jsonify({
-        "test": "distortion",
-        "distortion_percentage": distortion_percentage,
-        "score": score,
-        "id": test_id
-    })
+        "additional_data": additional_data
+    }
+    user_id = text_param(params, 'user_id')
+    if user_id:
+        test["user_id"] = user_id
+    return test, {"test": test_type.name, **fields, "score": score, "id": test["id"]}
 
-@app.route('/test/bass-response', methods=['POST'])
-def test_bass_response():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
+def submit_analysis(test_type, params, capture, timestamp):
+    """Queue a capture measurement on the analysis pool, tracked as a job that ends with the stored response.
     
-    # Simulated bass response test
-    frequencies = [20, 40, 60, 80, 100, 150, 200]
+    Raises ExecutorBusy when the analysis queue is full and JobTableFull when the job table is.
+    """
+    job = jobs.create(test_type.name)
+    try:
+        outcome = analysis.submit(test_type, params, capture)
+    except BaseException:
+        jobs.discard(job.id)  # never ran: don't leave it queued in the table
+        raise
+    job.update(status='running', stage='analyzing')
+    
+    def store(done):
+        try:
+            test, response = build_test(test_type, params, done.result(), timestamp)
+            archive_capture([test["id"]], capture)
+            storage.add_test(test)
+        except Exception as e:
+            job.finish(error=e)
+        else:
+            job.finish(result=response)
+    outcome.add_done_callback(store)
+    return job
+
+def archive_capture(test_ids, capture):
+    """Keep the raw samples of a measured capture, if the capture archive is enabled"""
+    if archive is not None and test_ids:
+        sample_rate, recording = capture
+        archive.append(test_ids, sample_rate, recording)
+
+def run_streaming_test(test_type, params):
+    """Measure a raw WAV body as it is read, archiving its samples block by block alongside"""
+    if archive is None:
+        return build_test(test_type, params, test_type.run_stream(params, request.stream))
+    
+    with archive.writer() as writer:
+        test, response = build_test(test_type, params,
+                                    test_type.run_stream(params, request.stream, sink=writer.append))
+        writer.commit([test["id"]])
+    return test, response
+
+def job_accepted(job):
+    state = job.snapshot()
+    state["status_url"] = f"/jobs/{job.id}"
+    state["events_url"] = f"/jobs/{job.id}/events"
+    return jsonify(state), 202, {'Location': state["status_url"]}
+
+def service_busy(e):
+    return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+
+# Largest number of jobs accepted by one /test/batch request
+MAX_BATCH_JOBS = 500
+
+def parse_jobs(data):
+    """The job list of a batch request, sent as JSON or as a JSON-encoded "jobs" form field"""
+    specs = data.get('jobs')
+    if isinstance(specs, str):
+        try:
+            specs = json.loads(specs)
+        except ValueError as e:
+            raise ValueError(f"Invalid jobs JSON: {e}")
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("jobs must be a non-empty list")
+    if len(specs) > MAX_BATCH_JOBS:
+        raise ValueError(f"At most {MAX_BATCH_JOBS} jobs per batch")
+    return specs
+
+def read_uploads(specs):
+    """Bytes of every capture file the jobs reference, read while the request is still open"""
+    uploads = {}
+    for spec in specs:
+        field = spec.get('capture') if isinstance(spec, dict) else None
+        if field and field not in uploads and field in request.files:
+            uploads[field] = request.files[field].read()
+    return uploads
+
+def run_jobs(specs, uploads, timestamp, job=None, user_id=None, errors=None):
+    """Run (speaker_model, test_type, params, capture) jobs and store all results with one storage call.
+    
+    Capture measurements run in parallel on the analysis pool. Returns the per-job results
+    and the number stored; a job that fails, for any reason, gets an error result and the
+    others are still stored. `errors`, if given, collects each failed job's exception by index.
+    With a background `job`, progress is reported on it and a full analysis queue is waited
+    out instead of failing the job.
+    """
+    captures = {}  # one upload can be shared by several jobs
+    pending = []   # (index, test type, params, capture field, outcome or future of one)
     results = {}
-    
-    for freq in frequencies:
-        # Generate realistic simulated response
-        simulated_response = 0.7 + (0.2 * freq / 200)
-        # Add some random variation
-        simulated_response += random.uniform(-0.05, 0.05)
-        simulated_response = max(0.5, min(0.98, simulated_response))
-        results[str(freq)] = simulated_response
-    
-    score = sum(results.values()) / len(results) * 100
-    
-    # Save results
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "bass_response",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps(results)
-    })
-    
-    return jsonify({
-        "test": "bass_response",
-        "results": results,
-        "score": score,
-        "id": test_id
-    })
+    errors = {} if errors is None else errors
+    
+    def fail(index, error):
+        errors[index] = error
+        message = str(error) if isinstance(error, (ValueError, ExecutorBusy)) else f"Analysis failed: {error!r}"
+        results[index] = {"index": index, "error": message}
+    
+    for index, spec in enumerate(specs):
+        try:
+            if not isinstance(spec, dict):
+                raise ValueError("Each job must be an object")
+            test_type = lookup_test_type(str(spec.get('test_type', '')))
+            if test_type is None:
+                raise ValueError(f"Unknown test type: {spec.get('test_type')}")
+            
+            capture = None
+            field = spec.get('capture')
+            if field:
+                if field not in captures:
+                    if field not in uploads:
+                        raise ValueError(f"Missing capture file: {field}")
+                    from measurement import read_wav
+                    captures[field] = read_wav(uploads[field])
+                capture = captures[field]
+            
+            params = {**(spec.get('params') or {}), 'speaker_model': text_param(spec, 'speaker_model', 'Unknown'),
+                      'user_id': text_param(spec, 'user_id', user_id)}
+            if capture is not None and test_type.measure is not None:
+                outcome = analysis.submit(test_type, params, capture, block=job is not None)
+            else:
+                outcome = test_type.run(params)
+            pending.append((index, test_type, params, field if capture is not None else None, outcome))
+        except Exception as e:
+            fail(index, e)
+    
+    tests = []
+    measured = {}  # capture field -> ids of the tests measured from it
+    for index, test_type, params, field, outcome in pending:
+        try:
+            if isinstance(outcome, Future):
+                outcome = outcome.result()
+        except Exception as e:
+            # A worker crash fails its own jobs, not the ones already measured
+            fail(index, e)
+        else:
+            test, response = build_test(test_type, params, outcome, timestamp)
+            tests.append(test)
+            if field is not None and test_type.measure is not None:
+                measured.setdefault(field, []).append(test["id"])
+            results[index] = {"index": index, "speaker_model": test["speaker_model"], **response}
+        if job is not None:
+            job.update(progress=len(results) / (len(specs) + 1))  # the storage write is the last step
+    
+    # Each upload is archived once, under every test measured from it
+    for field, test_ids in measured.items():
+        archive_capture(test_ids, captures[field])
+    storage.add_tests(tests)
+    return [results[index] for index in sorted(results)], len(tests)
 
-@app.route('/test/stereo-imaging', methods=['POST'])
-def test_stereo_imaging():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated stereo imaging test
-    channel_separation = random.uniform(70, 98)
-    phase_accuracy = random.uniform(75, 95)
-    sound_stage_width = random.uniform(65, 95)
-    
-    # Calculate overall score
-    score = (channel_separation + phase_accuracy + sound_stage_width) / 3
-    
-    # Save results
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "stereo_imaging",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "channel_separation": channel_separation,
-            "phase_accuracy": phase_accuracy,
-            "sound_stage_width": sound_stage_width
-        })
-    })
-    
-    return jsonify({
-        "test": "stereo_imaging",
-        "channel_separation": channel_separation,
-        "phase_accuracy": phase_accuracy,
-        "sound_stage_width": sound_stage_width,
-        "score": score,
-        "id": test_id
-    })
+@app.route('/test/batch', methods=['POST'])
+def test_batch():
+    """Run many jobs in one request and store all results with one storage call.
+    
+    Captures are multipart file fields, referenced by name from a job's "capture" key; with
+    multipart requests the job list itself is sent as a JSON-encoded "jobs" form field.
+    """
+    data = request_params()
+    try:
+        specs = parse_jobs(data)
+        user_id = request_user_id(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    results, completed = run_jobs(specs, read_uploads(specs), datetime.datetime.now().isoformat(),
+                                  user_id=user_id)
+    return jsonify({"results": results, "completed": completed, "failed": len(specs) - completed})
 
-@app.route('/test/clarity', methods=['POST'])
-def test_clarity():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated clarity test
-    mid_clarity = random.uniform(70, 98)
-    high_clarity = random.uniform(65, 95)
-    vocal_clarity = random.uniform(75, 99)
-    
-    # Calculate overall score
-    score = (mid_clarity + high_clarity + vocal_clarity) / 3
-    
-    # Save results
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "clarity",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "mid_clarity": mid_clarity,
-            "high_clarity": high_clarity,
-            "vocal_clarity": vocal_clarity
-        })
-    })
-    
-    return jsonify({
-        "test": "clarity",
-        "mid_clarity": mid_clarity,
-        "high_clarity": high_clarity,
-        "vocal_clarity": vocal_clarity,
-        "score": score,
-        "id": test_id
-    })
+@app.route('/test/<slug>', methods=['POST'])
+def run_single_test(slug):
+    """Run any registered test type, e.g. /test/frequency-response.
+    
+    Uploaded captures are measured on the analysis pool; ?mode=async returns a job right
+    away instead of waiting for the result. A raw audio/wav body for a test type that
+    supports streaming is instead analyzed block by block as it is read, so the result is
+    ready moments after the upload ends and the capture is never buffered whole
+    (?stream=0 sends it to the pool like any other upload).
+    """
+    test_type = TEST_TYPES_BY_SLUG.get(slug)
+    if test_type is None:
+        return jsonify({"error": f"Unknown test type: {slug}"}), 404
+    
+    params = request_params()
+    try:
+        params['user_id'] = request_user_id(params)
+        text_param(params, 'speaker_model')
+        if (test_type.stream is not None and is_wav_body()
+                and params.get('stream') != '0' and params.get('mode') != 'async'):
+            test, response = run_streaming_test(test_type, params)
+            storage.add_test(test)
+            return jsonify(response)
+        
+        capture = read_capture()
+        if capture is None or test_type.measure is None:
+            test, response = build_test(test_type, params, test_type.run(params))
+            storage.add_test(test)
+            return jsonify(response)
+        
+        job = submit_analysis(test_type, params, capture, datetime.datetime.now().isoformat())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (ExecutorBusy, JobTableFull) as e:
+        return service_busy(e)
+    
+    if params.get('mode') == 'async' or not job.wait(ANALYSIS_TIMEOUT):
+        # The client polls /jobs/<id> or follows /jobs/<id>/events
+        return job_accepted(job)
+    if job.status == 'failed':
+        return jsonify({"error": str(job.error)}), 400 if isinstance(job.error, ValueError) else 500
+    return jsonify(job.result)
 
-@app.route('/test/max-volume', methods=['POST'])
-def test_max_volume():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated max volume test
-    max_db = random.uniform(85, 110)
-    distortion_at_max = random.uniform(3, 15)
-    
-    # Calculate score (higher volume is better, but higher distortion is worse)
-    volume_score = (max_db - 85) * 3  # 0-75 points
-    distortion_penalty = distortion_at_max * 2  # 6-30 points penalty
-    score = max(0, min(100, 85 + volume_score - distortion_penalty))
-    
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "max_volume",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "max_db": max_db,
-            "distortion_at_max": distortion_at_max
-        })
-    })
-    
-    return jsonify({
-        "test": "max_volume",
-        "max_db": max_db,
-        "distortion_at_max": distortion_at_max,
-        "score": score,
-        "id": test_id
-    })
+def run_background_jobs(job, specs, uploads, timestamp, single=False, user_id=None):
+    """Job runner body for POST /jobs"""
+    job.update(status='running', stage='analyzing')
+    errors = {}
+    try:
+        results, completed = run_jobs(specs, uploads, timestamp, job, user_id, errors)
+    except Exception as e:
+        app.logger.exception("Background job %s failed", job.id)
+        job.finish(error=e)
+        return
+    
+    if not single:
+        job.finish(result={"results": results, "completed": completed, "failed": len(specs) - completed})
+    elif completed:
+        job.finish(result={key: value for key, value in results[0].items() if key != 'index'})
+    else:
+        job.finish(error=errors[0])
 
-@app.route('/test/dynamic-range', methods=['POST'])
-def test_dynamic_range():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated dynamic range test
-    dynamic_range_db = random.uniform(60, 95)
-    detail_preservation = random.uniform(70, 95)
-    
-    # Calculate score
-    score = (dynamic_range_db - 60) * 1.5 + detail_preservation * 0.2
-    score = max(0, min(100, score))
-    
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "dynamic_range",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "dynamic_range_db": dynamic_range_db,
-            "detail_preservation": detail_preservation
-        })
-    })
-    
-    return jsonify({
-        "test": "dynamic_range",
-        "dynamic_range_db": dynamic_range_db,
-        "detail_preservation": detail_preservation,
-        "score": score,
-        "id": test_id
-    })
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Start a test (test_type plus optional capture) or a batch ("jobs", as for /test/batch) in the background"""
+    data = request_params()
+    try:
+        if 'jobs' in data:
+            specs = parse_jobs(data)
+            uploads = read_uploads(specs)
+            kind = 'batch'
+        else:
+            kind = text_param(data, 'test_type')
+            if not kind:
+                raise ValueError("test_type or jobs is required")
+            spec = {"test_type": kind, "speaker_model": text_param(data, 'speaker_model', 'Unknown'), "params": data}
+            uploads = {}
+            capture = read_capture_bytes()
+            if capture is not None:
+                spec["capture"] = 'capture'
+                uploads['capture'] = capture
+            specs = [spec]
+        user_id = request_user_id(data)
+        job = jobs.create(kind)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except JobTableFull as e:
+        return service_busy(e)
+    
+    job_runner.submit(run_background_jobs, job, specs, uploads, datetime.datetime.now().isoformat(),
+                      single=kind != 'batch', user_id=user_id)
+    return job_accepted(job)
 
-@app.route('/test/transient-response', methods=['POST'])
-def test_transient_response():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated transient response test
-    attack_speed = random.uniform(70, 98)
-    decay_accuracy = random.uniform(65, 95)
-    
-    # Calculate score
-    score = (attack_speed + decay_accuracy) / 2
-    
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "transient_response",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "attack_speed": attack_speed,
-            "decay_accuracy": decay_accuracy
-        })
-    })
-    
-    return jsonify({
-        "test": "transient_response",
-        "attack_speed": attack_speed,
-        "decay_accuracy": decay_accuracy,
-        "score": score,
-        "id": test_id
-    })
+def run_rescore_job(job, version, workers, dry_run):
+    """Job runner body for POST /rescore"""
+    from rescore import rescore
+    job.update(status='running', stage='rescoring')
+    total = storage.get_analytics_summary(include_historical=True)["total_tests"]
+    try:
+        report = rescore(storage, version, workers, dry_run=dry_run,
+                         progress=lambda done: job.update(progress=min(done / max(total, 1), 0.99)))
+    except Exception as e:
+        app.logger.exception("Rescore job %s failed", job.id)
+        job.finish(error=e)
+        return
+    job.finish(result=report)
 
-@app.route('/test/voice-reproduction', methods=['POST'])
-def test_voice_reproduction():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated voice reproduction test
-    male_voice = random.uniform(75, 98)
-    female_voice = random.uniform(70, 98)
-    sibilance = random.uniform(60, 95)
-    
-    # Calculate score
-    score = (male_voice + female_voice) / 2 - (100 - sibilance) * 0.2
-    score = max(0, min(100, score))
-    
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "voice_reproduction",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "male_voice": male_voice,
-            "female_voice": female_voice,
-            "sibilance": sibilance
-        })
-    })
-    
-    return jsonify({
-        "test": "voice_reproduction",
-        "male_voice": male_voice,
-        "female_voice": female_voice,
-        "sibilance": sibilance,
-        "score": score,
-        "id": test_id
-    })
+@app.route('/rescore', methods=['POST'])
+def start_rescore():
+    """Recompute every stored score with a scoring version (default: the active one) as a background job"""
+    data = request_params()
+    try:
+        version = int(data['version']) if data.get('version') is not None else None
+        if version is not None and version not in SCORING:
+            raise ValueError(f"Unknown scoring version: {version}")
+        workers = int(data['workers']) if data.get('workers') is not None else RESCORE_WORKERS
+        dry_run = str(data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        job = jobs.create('rescore')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except JobTableFull as e:
+        return service_busy(e)
+    
+    job_runner.submit(run_rescore_job, job, version, workers, dry_run)
+    return job_accepted(job)
 
-@app.route('/test/soundstage', methods=['POST'])
-def test_soundstage():
-    data = request.json or {}
-    speaker_model = data.get('speaker_model', 'Unknown')
-    
-    # Simulated soundstage test
-    width = random.uniform(65, 95)
-    depth = random.uniform(60, 90)
-    imaging_precision = random.uniform(70, 95)
-    
-    # Calculate score
-    score = (width + depth + imaging_precision) / 3
-    
-    test_id = storage.add_test({
-        "id": str(uuid.uuid4()),
-        "timestamp": datetime.datetime.now().isoformat(),
-        "speaker_model": speaker_model,
-        "test_type": "soundstage",
-        "score": score,
-        "user_rating": None,
-        "additional_data": json.dumps({
-            "width": width,
-            "depth": depth,
-            "imaging_precision": imaging_precision
-        })
-    })
-    
-    return jsonify({
-        "test": "soundstage",
-        "width": width,
-        "depth": depth,
-        "imaging_precision": imaging_precision,
-        "score": score,
-        "id": test_id
-    })
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and progress of a background job, with its result once done"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream of a job's progress, ending with a "done" or "failed" event"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    def events():
+        state = job.snapshot()
+        while True:
+            event = state["status"] if state["status"] in ('done', 'failed') else 'progress'
+            yield f"event: {event}\nid: {state['version']}\ndata: {json.dumps(state)}\n\n"
+            if event != 'progress':
+                return
+            version = state["version"]
+            state = job.wait_for_change(version, timeout=SSE_KEEPALIVE)
+            while state is None:
+                # Comment lines keep proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                state = job.wait_for_change(version, timeout=SSE_KEEPALIVE)
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/tests/<test_id>', methods=['GET'])
+def get_test(test_id):
+    """One stored test; an archived capture is described under "capture", with its download URL"""
+    test = storage.get_test_by_id(test_id)
+    if test is None:
+        return jsonify({"error": "Test not found"}), 404
+    
+    capture = archive.get(test_id) if archive is not None else None
+    if capture is not None:
+        test = {**test, "capture": {**capture.metadata(), "url": f"/tests/{test_id}/capture"}}
+    return jsonify(test)
+
+# Bytes per chunk when serving archived captures
+CAPTURE_CHUNK_BYTES = 2**20
+
+@app.route('/tests/<test_id>/capture', methods=['GET'])
+def get_test_capture(test_id):
+    """The archived capture of a test as 32-bit float WAV (or ?format=f32 raw samples), read from its memory map"""
+    capture = archive.get(test_id) if archive is not None else None
+    if capture is None:
+        return jsonify({"error": "No archived capture for this test"}), 404
+    fmt = request.args.get('format', 'wav')
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unknown capture format: {fmt}"}), 400
+    
+    from wav_stream import float_wav_header
+    header = float_wav_header(capture.sample_rate, capture.length) if fmt == 'wav' else b''
+    
+    def chunks():
+        # Pages of the segment are only read as each chunk is sent
+        if header:
+            yield header
+        data = memoryview(capture.samples).cast('B')
+        for start in range(0, len(data), CAPTURE_CHUNK_BYTES):
+            yield bytes(data[start:start + CAPTURE_CHUNK_BYTES])
+    
+    # Archived captures never change, so Range and conditional requests can be answered from the stream
+    response = Response(chunks(), mimetype=FORMATS[fmt])
+    response.content_length = len(header) + capture.nbytes
+    response.set_etag(f"{test_id}-{fmt}")
+    response.headers['X-Sample-Rate'] = str(capture.sample_rate)
+    return response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
 
 @app.route('/submit-rating', methods=['POST'])
 def submit_rating():
     data = request.json
-    test_id = data.get('test_id')
-    rating = data.get('rating')
+    try:
+        test_id = text_param(data, 'test_id')
+        speaker_model = text_param(data, 'speaker_model', 'Unknown')
+        rating = parse_rating(data.get('rating'))
+        user_id = request_user_id(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # Update rating if test_id is provided
     if test_id:
@@ -645,22 +851,24 @@ def submit_rating():
             storage.add_test({
                 "id": str(uuid.uuid4()),
                 "timestamp": datetime.datetime.now().isoformat(),
-                "speaker_model": data.get('speaker_model', 'Unknown'),
+                "speaker_model": speaker_model,
                 "test_type": "user_rating_only",
                 "score": float(rating) * 20,  # Convert 1-5 rating to percentage
                 "user_rating": rating,
-                "additional_data": None
+                "additional_data": None,
+                "user_id": user_id
             })
     else:
         # For general ratings without specific test
         storage.add_test({
             "id": str(uuid.uuid4()),
             "timestamp": datetime.datetime.now().isoformat(),
-            "speaker_model": data.get('speaker_model', 'Unknown'),
+            "speaker_model": speaker_model,
             "test_type": "user_rating_only",
             "score": float(rating) * 20,  # Convert 1-5 rating to percentage
             "user_rating": rating,
-            "additional_data": None
+            "additional_data": None,
+            "user_id": user_id
         })
     
     return jsonify({"status": "success", "message": "Rating submitted"})
@@ -668,101 +876,9 @@ def submit_rating():
 @app.route('/analytics', methods=['GET'])
 def get_analytics():
     try:
-        # Get all tests
-        all_tests = storage.get_all_tests()
-        
-        if not all_tests:
-            return jsonify({
-                "total_tests": 0,
-                "average_score": 0,
-                "test_types": {},
-                "speaker_models": {},
-                "average_scores_by_model": {},
-                "frequency_data": {
-                    "labels": ["100Hz", "500Hz", "1kHz", "5kHz", "10kHz", "15kHz"],
-                    "average_response": [0.8, 0.85, 0.9, 0.85, 0.8, 0.7]
-                },
-                "ratings_distribution": [0, 0, 0, 0, 0]
-            })
-        
-        # Calculate basic statistics
-        total_tests = len(all_tests)
-        scores = [t["score"] for t in all_tests if t.get("score") is not None]
-        average_score = sum(scores) / len(scores) if scores else 0
-        
-        # Count test types
-        test_types = {}
-        for test in all_tests:
-            test_type = test.get("test_type", "unknown")
-            test_types[test_type] = test_types.get(test_type, 0) + 1
-        
-        # Count speaker models
-        speaker_models = {}
-        for test in all_tests:
-            model = test.get("speaker_model", "Unknown")
-            speaker_models[model] = speaker_models.get(model, 0) + 1
-        
-        # Calculate average scores by model
-        model_scores = {}
-        for test in all_tests:
-            if test.get("score") is not None:
-                model = test.get("speaker_model", "Unknown")
-                if model not in model_scores:
-                    model_scores[model] = {"sum": 0, "count": 0}
-                model_scores[model]["sum"] += test["score"]
-                model_scores[model]["count"] += 1
-        
-        avg_scores_by_model = {}
-        for model, data in model_scores.items():
-            avg_scores_by_model[model] = data["sum"] / data["count"]
-        
-        # Process frequency data
-        freq_counts = {}
-        freq_sums = {}
-        
-        for test in all_tests:
-            if test.get("test_type") == "frequency_response" and test.get("additional_data"):
-                try:
-                    data = json.loads(test["additional_data"])
-                    for freq, response in data.items():
-                        if freq not in freq_counts:
-                            freq_counts[freq] = 0
-                            freq_sums[freq] = 0
-                        freq_counts[freq] += 1
-                        freq_sums[freq] += float(response)
-                except:
-                    continue
-        
-        frequency_data = {"labels": [], "average_response": []}
-        if freq_counts:
-            frequency_data["labels"] = sorted(freq_counts.keys(), key=lambda x: float(x) if x.replace('.', '').isdigit() else 0)
-            frequency_data["average_response"] = [freq_sums[freq] / freq_counts[freq] for freq in frequency_data["labels"]]
-        else:
-            frequency_data = {
-                "labels": ["100Hz", "500Hz", "1kHz", "5kHz", "10kHz", "15kHz"],
-                "average_response": [0.8, 0.85, 0.9, 0.85, 0.8, 0.7]
-            }
-        
-        # Calculate rating distribution
-        ratings_dist = [0, 0, 0, 0, 0]
-        for test in all_tests:
-            if test.get("user_rating") is not None:
-                try:
-                    rating = int(test["user_rating"])
-                    if 1 <= rating <= 5:
-                        ratings_dist[rating-1] += 1
-                except:
-                    pass
-        
-        return jsonify({
-            "total_tests": total_tests,
-            "average_score": float(average_score),
-            "test_types": test_types,
-            "speaker_models": speaker_models,
-            "average_scores_by_model": avg_scores_by_model,
-            "frequency_data": frequency_data,
-            "ratings_distribution": ratings_dist
-        })
+        speaker_model = request.args.get('speaker_model')
+        include_historical = request.args.get('include_historical', '').lower() in ('1', 'true', 'yes')
+        return jsonify(storage.get_analytics_summary(speaker_model, include_historical))
         
     except Exception as e:
         return jsonify({
@@ -770,46 +886,48 @@ def get_analytics():
             "message": "Could not load analytics data"
         }), 500
 
+@app.route('/analytics/trends', methods=['GET'])
+def get_trends():
+    """Average score and test count per hour, day or week, optionally per speaker model or test type.
+    
+    start and end are ISO timestamps (end exclusive, both optional); historical tests are
+    included unless include_historical=0.
+    """
+    from trends import GRANULARITIES, parse_epoch
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+    group_by = request.args.get('group_by') or None
+    if group_by not in (None, 'speaker_model', 'test_type'):
+        return jsonify({"error": "group_by must be speaker_model or test_type"}), 400
+    try:
+        start = parse_epoch(request.args.get('start'))
+        end = parse_epoch(request.args.get('end'))
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO timestamps"}), 400
+    include_historical = request.args.get('include_historical', '1').lower() not in ('0', 'false', 'no')
+    
+    return jsonify(storage.get_trends(granularity, start, end, request.args.get('speaker_model'),
+                                      request.args.get('test_type'), include_historical, group_by))
+
 @app.route('/export-results', methods=['GET'])
 def export_results():
     format_type = request.args.get('format', 'csv')
     speaker_model = request.args.get('speaker_model')
     
     try:
-        # Get filtered results
-        results = storage.get_all_tests(speaker_model)
-        
-        # Define column names based on our data structure
-        column_names = ["id", "timestamp", "speaker_model", "test_type", 
-                        "score", "user_rating", "additional_data"]
-        
         if format_type == 'json':
-            return jsonify(results)
+            return jsonify(list(storage.get_all_tests(speaker_model)))
         
         elif format_type == 'csv':
-            from io import StringIO
-            import csv
+            # Define column names based on our data structure
+            column_names = ["id", "timestamp", "speaker_model", "test_type", 
+                            "score", "user_rating", "additional_data"]
             
-            output = StringIO()
-            writer = csv.writer(output)
-            
-            # Write header
-            writer.writerow(column_names)
-            
-            # Write data rows
-            for test in results:
-                row = [test.get(col, '') for col in column_names]
-                writer.writerow(row)
-            
-            # Create response
-            response_data = output.getvalue()
+            chunks = iter_csv(storage.iter_tests(speaker_model), column_names)
             filename = f"speaker_test_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
-            # Return as downloadable file
-            return response_data, 200, {
-                'Content-Type': 'text/csv',
-                'Content-Disposition': f'attachment; filename="{filename}"'
-            }
+            return csv_download(chunks, filename)
         
         else:
             return jsonify({"error": "Unsupported export format"}), 400
@@ -817,6 +935,18 @@ def export_results():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def csv_download(chunks, filename):
+    """Stream CSV chunks as a file download, gzip-encoded when the client accepts it"""
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    
+    # ?compress=0 opts out, e.g. for clients that mishandle Content-Encoding
+    if request.args.get('compress') != '0' and request.accept_encodings['gzip']:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    
+    return Response(chunks, content_type='text/csv', headers=headers)
+
 # Add these new routes
 
 @app.route('/user/start-session', methods=['POST'])
@@ -827,7 +957,7 @@ def start_user_session():
     # Create a unique user ID
     user_id = f"user_{uuid.uuid4().hex[:12]}"
     
-    # Set the user session
+    # Register the session; clients send its id with each request (user_id or X-User-Id)
     storage.set_user_session(user_id)
     
     return jsonify({
@@ -838,33 +968,69 @@ def start_user_session():
 
 @app.route('/user/export-data', methods=['GET'])
 def export_user_data():
-    user_id = request.args.get('user_id')
-    
-    # Export user data to CSV
-    csv_data = storage.export_user_data(user_id)
+    user_id = request_user_id()
     
-    # Create response
+    # Stream user data as CSV
     filename = f"user_speaker_tests_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    
-    # Return as downloadable file
-    return csv_data, 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': f'attachment; filename="{filename}"'
-    }
+    return csv_download(storage.export_user_data(user_id), filename)
 
 @app.route('/export-historical-data', methods=['GET'])
 def export_historical_data():
-    # Export historical data to CSV
-    csv_data = storage.export_historical_data()
-    
-    # Create response
+    # Stream historical data as CSV
     filename = f"historical_speaker_tests_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return csv_download(storage.export_historical_data(), filename)
+
+@app.route('/compare', methods=['GET'])
+def compare_speaker():
+    """A model's scores per test type against the average and best model, and the models that sound like it"""
+    speaker_model = request.args.get('speaker_model')
+    if not speaker_model:
+        return jsonify({"error": "speaker_model is required"}), 400
+    try:
+        limit = int(request.args.get('limit', 5))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    
+    speakers = storage.get_best_speakers(limit=None)
+    target = next((speaker for speaker in speakers if speaker["model"] == speaker_model), None)
+    similar = storage.similar_speakers(speaker_model, limit)
+    if target is None and similar is None:
+        return jsonify({"error": f"No tests found for speaker model: {speaker_model}"}), 404
+    
+    comparison = average = top_performer = None
+    insights = []
+    if target is not None:
+        comparison, average, top_performer = target["scores_by_type"], {}, {}
+        for test_type in comparison:
+            scores = [(speaker["scores_by_type"][test_type], speaker["model"])
+                      for speaker in speakers if test_type in speaker["scores_by_type"]]
+            average[test_type] = sum(score for score, _ in scores) / len(scores)
+            best_score, best_model = max(scores, key=lambda item: item[0])
+            top_performer[test_type] = {"model": best_model, "score": best_score}
+        
+        rank = speakers.index(target) + 1
+        insights.append(f"Ranked {rank} of {len(speakers)} speakers by average score ({target['average_score']:.1f}).")
+        margins = sorted((comparison[t] - average[t], t) for t in comparison)
+        if len(speakers) > 1:
+            margin, test_type = margins[-1]
+            insights.append(f"Strongest in {test_type.replace('_', ' ')}: {margin:+.1f} points against the average.")
+            if len(margins) > 1:
+                margin, test_type = margins[0]
+                insights.append(f"Weakest in {test_type.replace('_', ' ')}: {margin:+.1f} points against the average.")
+        leads = [t.replace('_', ' ') for t in comparison if top_performer[t]["model"] == speaker_model]
+        if leads and len(speakers) > 1:
+            insights.append(f"Top performer in {', '.join(leads)}.")
+    if similar and similar[0][1] > 0:
+        insights.append(f"Sounds most like {similar[0][0]} ({similar[0][1]:.0%} similar response curves).")
     
-    # Return as downloadable file
-    return csv_data, 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': f'attachment; filename="{filename}"'
-    }
+    return jsonify({
+        "speaker_model": speaker_model,
+        "comparison": comparison,
+        "average": average,
+        "top_performer": top_performer,
+        "similar_speakers": [{"model": model, "similarity": similarity} for model, similarity in similar or []],
+        "insights": insights
+    })
 
 # Add this new route
 
@@ -877,50 +1043,15 @@ def get_recommendations():
             test_types = test_types.split(',')
         
         # Get user ID (optional)
-        user_id = request.args.get('user_id')
+        user_id = request_user_id()
         
         # Get the best speakers based on all data
         best_speakers = storage.get_best_speakers(test_types)
         
-        # Get user's test data if available
-        user_tests = []
-        if user_id:
-            user_tests = storage.get_user_tests(user_id)
-        
-        # Personalize recommendations if we have user data
+        # Personalize recommendations towards the test types the user runs most
         personalized = []
-        if user_tests:
-            # Extract user's preferred test types
-            user_test_types = {}
-            for test in user_tests:
-                test_type = test.get("test_type")
-                if test_type:
-                    user_test_types[test_type] = user_test_types.get(test_type, 0) + 1
-            
-            # Sort by most tested types
-            preferred_types = sorted(user_test_types.items(), key=lambda x: x[1], reverse=True)
-            preferred_types = [t[0] for t in preferred_types[:3]]  # Top 3 preferred test types
-            
-            # Calculate weighted scores for speakers based on user preferences
-            for speaker in best_speakers:
-                weighted_score = speaker["average_score"]
-                type_bonus = 0
-                
-                for test_type in preferred_types:
-                    if test_type in speaker["scores_by_type"]:
-                        type_score = speaker["scores_by_type"][test_type]
-                        type_bonus += type_score * 0.05  # Small bonus for matching preferred test types
-                
-                personalized.append({
-                    "model": speaker["model"],
-                    "base_score": speaker["average_score"],
-                    "personalized_score": min(100, weighted_score + type_bonus),
-                    "test_count": speaker["test_count"],
-                    "preferred_type_scores": {t: speaker["scores_by_type"].get(t, 0) for t in preferred_types if t in speaker["scores_by_type"]}
-                })
-            
-            # Sort by personalized score
-            personalized.sort(key=lambda x: x["personalized_score"], reverse=True)
+        if user_id:
+            personalized = storage.get_personalized_speakers([user_id], test_types)[user_id]
         
         return jsonify({
             "best_speakers": best_speakers,
@@ -934,6 +1065,27 @@ def get_recommendations():
             "message": "Could not generate recommendations"
         }), 500
 
+@app.route('/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    """Personalized recommendations for many users in one pass, e.g. for email digests and reports.
+    
+    JSON body: user_ids (default: every user with tests), test_types and limit as for /recommendations.
+    """
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids')
+    test_types = data.get('test_types')
+    if user_ids is not None and (not isinstance(user_ids, list) or not all(isinstance(u, str) for u in user_ids)):
+        return jsonify({"error": "user_ids must be a list of strings"}), 400
+    if test_types is not None and (not isinstance(test_types, list) or not all(isinstance(t, str) for t in test_types)):
+        return jsonify({"error": "test_types must be a list of strings"}), 400
+    try:
+        limit = int(data.get('limit', 5))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+    
+    recommendations = storage.get_personalized_speakers(user_ids, test_types, limit)
+    return jsonify({"recommendations": recommendations, "users": len(recommendations)})
+
 # Required for Vercel
 app.debug = False
 
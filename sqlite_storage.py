@@ -0,0 +1,538 @@
+"""Persistent SQLite storage backend shared by every worker on a node.
+
+The database runs in WAL mode so readers never wait on the writer, each thread
+keeps its own connection (and with it sqlite3's prepared-statement cache), and
+inserts go through a write-behind queue that group-commits them in batches.
+"""
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from aggregates import DEFAULT_FREQUENCY_DATA, frequency_sort_key, parse_rating
+from analytics_engine import StringTable, personalized_rankings
+from similarity import CURVES, SimilarityIndex
+from trends import GRANULARITIES, WEEK_OFFSET, bucket_start, parse_epoch, trend_payload
+from storage_common import check_test, sample_tests, historical_tests, iter_csv
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (
+    id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    speaker_model TEXT NOT NULL,
+    test_type TEXT NOT NULL,
+    score REAL,
+    user_rating INTEGER,
+    additional_data TEXT
+)
+"""
+
+# Columns added after the original schema shipped in data/speaker_tests.db
+MIGRATIONS = {
+    "user_id": "ALTER TABLE tests ADD COLUMN user_id TEXT",
+    "is_historical": "ALTER TABLE tests ADD COLUMN is_historical INTEGER NOT NULL DEFAULT 0",
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_tests_speaker_model ON tests (speaker_model)",
+    "CREATE INDEX IF NOT EXISTS idx_tests_user_id ON tests (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_tests_test_type ON tests (test_type)",
+    "CREATE INDEX IF NOT EXISTS idx_tests_timestamp ON tests (timestamp)",
+]
+
+# Hour, day and week rollups of every test (see trends.py)
+TREND_SCHEMA = [
+    """CREATE TABLE trend_rollups (
+        granularity TEXT NOT NULL,
+        speaker_model TEXT NOT NULL,
+        test_type TEXT NOT NULL,
+        is_historical INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        test_count INTEGER NOT NULL,
+        score_sum REAL NOT NULL,
+        scored INTEGER NOT NULL,
+        PRIMARY KEY (granularity, bucket, speaker_model, test_type, is_historical)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX idx_trend_rollups_model ON trend_rollups (granularity, speaker_model, bucket)",
+    "CREATE INDEX idx_trend_rollups_type ON trend_rollups (granularity, test_type, bucket)",
+]
+
+
+def _trend_bucket(granularity, timestamp):
+    """SQL for bucket_start() of an ISO timestamp column"""
+    width = GRANULARITIES[granularity]
+    offset = WEEK_OFFSET if granularity == "week" else 0
+    return f"(CAST(strftime('%s', {timestamp}) AS INTEGER) - {offset}) / {width} * {width} + {offset}"
+
+
+def _trend_rollup(row, sign):
+    """Statements adding (sign 1) or removing (sign -1) the NEW or OLD row to its rollup buckets"""
+    return "".join(f"""
+        INSERT INTO trend_rollups
+        SELECT '{granularity}', {row}.speaker_model, {row}.test_type, {row}.is_historical,
+               {_trend_bucket(granularity, row + '.timestamp')},
+               {sign}, {sign} * IFNULL({row}.score, 0), {sign} * ({row}.score IS NOT NULL)
+        WHERE strftime('%s', {row}.timestamp) IS NOT NULL
+        ON CONFLICT (granularity, bucket, speaker_model, test_type, is_historical) DO UPDATE SET
+            test_count = test_count + excluded.test_count,
+            score_sum = score_sum + excluded.score_sum,
+            scored = scored + excluded.scored;""" for granularity in GRANULARITIES)
+
+
+TREND_UPSERT_SQL = """
+INSERT INTO trend_rollups (granularity, bucket, speaker_model, test_type, is_historical, test_count, score_sum, scored)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (granularity, bucket, speaker_model, test_type, is_historical) DO UPDATE SET
+    test_count = test_count + excluded.test_count,
+    score_sum = score_sum + excluded.score_sum,
+    scored = scored + excluded.scored
+"""
+
+# Inserts are rolled up a batch at a time by insert_rows; triggers cover the rarer updates and deletes
+TREND_TRIGGERS = [
+    # Also fires for the row INSERT OR REPLACE removes, with recursive_triggers on
+    f"CREATE TRIGGER trend_rollups_delete AFTER DELETE ON tests BEGIN {_trend_rollup('OLD', -1)} END",
+    "CREATE TRIGGER trend_rollups_update AFTER UPDATE OF timestamp, speaker_model, test_type, score, is_historical "
+    f"ON tests BEGIN {_trend_rollup('OLD', -1)} {_trend_rollup('NEW', 1)} END",
+]
+
+COLUMNS = ["id", "timestamp", "speaker_model", "test_type", "score",
+           "user_rating", "additional_data", "user_id", "is_historical"]
+
+INSERT_SQL = f"INSERT OR REPLACE INTO tests ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+SELECT_SQL = f"SELECT {', '.join(COLUMNS)} FROM tests"
+
+
+def _row_to_dict(row):
+    test = {
+        "id": row[0],
+        "timestamp": row[1],
+        "speaker_model": row[2],
+        "test_type": row[3],
+        "score": row[4],
+        "user_rating": row[5],
+        "additional_data": row[6]
+    }
+    if row[8]:
+        test["is_historical"] = True
+    if row[7] is not None:
+        test["user_id"] = row[7]
+    return test
+
+
+def _dict_to_row(test, historical=False):
+    """Row of a test dict for INSERT_SQL; raises ValueError for a test the table cannot hold"""
+    test = {"speaker_model": "Unknown", "test_type": "unknown", **test}
+    check_test(test)
+    score = test.get("score")
+    return (test["id"], test["timestamp"], test["speaker_model"], test["test_type"],
+            None if score is None else float(score), test.get("user_rating"),
+            test.get("additional_data"), test.get("user_id"), 1 if historical else 0)
+
+
+def insert_rows(conn, rows):
+    """Insert test rows and add them to the trend rollups, pre-aggregated per bucket, in the caller's transaction"""
+    conn.executemany(INSERT_SQL, rows)
+    rollups = {}
+    for row in rows:
+        try:
+            epoch = parse_epoch(row[1])
+        except (TypeError, ValueError):
+            continue
+        score = row[4]
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(epoch, granularity), row[2], row[3], row[8])
+            totals = rollups.get(key)
+            if totals is None:
+                totals = rollups[key] = [0, 0.0, 0]
+            totals[0] += 1
+            if score is not None:
+                totals[1] += score
+                totals[2] += 1
+    conn.executemany(TREND_UPSERT_SQL, [key + tuple(totals) for key, totals in rollups.items()])
+
+
+class _WriteBehindQueue:
+    """Background thread that group-commits queued inserts, one transaction per batch"""
+    def __init__(self, connect, batch_size, max_delay):
+        self._connect = connect
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-write-behind", daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        self._queue.put(row)
+
+    def flush(self):
+        """Block until every queued insert has been committed"""
+        self._queue.join()
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_delay
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    insert_rows(conn, batch)
+            except Exception:
+                # Commit the rows one by one instead, so a bad row only loses itself
+                for row in batch:
+                    try:
+                        with conn:
+                            insert_rows(conn, [row])
+                    except Exception:
+                        logger.exception("Failed to commit queued test result %s", row[0])
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class SQLiteStorage:
+    def __init__(self, path, batch_size=500, max_delay=0.005):
+        self.path = path
+        self.users = set()
+        self._local = threading.local()
+        self.similarity = SimilarityIndex()
+        self._similarity_rowid = 0  # last row folded into the similarity index
+        self._similarity_lock = threading.Lock()
+
+        self._initialize()
+        self._writes = _WriteBehindQueue(self._connect, batch_size, max_delay)
+        atexit.register(self.flush)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA recursive_triggers=ON")
+        return conn
+
+    def _connection(self):
+        """Connection owned by the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _initialize(self):
+        conn = self._connection()
+        conn.execute(SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(tests)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in existing:
+                conn.execute(statement)
+        for statement in INDEXES:
+            conn.execute(statement)
+        conn.commit()
+
+        # Seed once per database; the immediate transaction stops two workers
+        # starting together from both seeding it
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'trend_rollups'").fetchone():
+                for statement in TREND_SCHEMA + TREND_TRIGGERS:
+                    conn.execute(statement)
+                # Roll up the tests stored before the triggers existed
+                for granularity in GRANULARITIES:
+                    conn.execute(
+                        f"INSERT INTO trend_rollups SELECT ?, speaker_model, test_type, is_historical, "
+                        f"{_trend_bucket(granularity, 'timestamp')} AS bucket, COUNT(*), IFNULL(SUM(score), 0), COUNT(score) "
+                        f"FROM tests WHERE strftime('%s', timestamp) IS NOT NULL "
+                        f"GROUP BY speaker_model, test_type, is_historical, bucket", (granularity,))
+            if not conn.execute("SELECT 1 FROM tests LIMIT 1").fetchone():
+                insert_rows(conn, [_dict_to_row(t) for t in sample_tests()])
+            if not conn.execute("SELECT 1 FROM tests WHERE is_historical = 1 LIMIT 1").fetchone():
+                insert_rows(conn, [_dict_to_row(t, historical=True) for t in historical_tests()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def flush(self):
+        """Wait until every queued write from this process is committed"""
+        self._writes.flush()
+
+    def _query(self, sql, params=()):
+        # Reads see everything this process has queued so far
+        self.flush()
+        return self._connection().execute(sql, params).fetchall()
+
+    def set_user_session(self, user_id):
+        """Register a testing session; its tests carry its id as their user_id"""
+        self.users.add(user_id)
+        return user_id
+
+    def add_test(self, test_data):
+        # Validated here, so the writer gets the error and not the group commit
+        self._writes.put(_dict_to_row(test_data))
+        return test_data["id"]
+
+    def add_tests(self, tests):
+        """Insert several tests in one transaction, committed before returning; returns their ids"""
+        rows = [_dict_to_row(test_data) for test_data in tests]
+        conn = self._connection()
+        with conn:
+            insert_rows(conn, rows)
+        return [row[0] for row in rows]
+
+    def update_rating(self, test_id, rating):
+        rating = parse_rating(rating)
+        self.flush()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("UPDATE tests SET user_rating = ? WHERE id = ? AND is_historical = 0",
+                                  (rating, test_id))
+        return cursor.rowcount > 0
+
+    def update_scores(self, scores):
+        """Set the score of many tests from (test_id, score) pairs in one transaction; returns how many were found"""
+        self.flush()
+        conn = self._connection()
+        with conn:
+            cursor = conn.executemany("UPDATE tests SET score = ? WHERE id = ?",
+                                      [(score, test_id) for test_id, score in scores])
+        return cursor.rowcount
+
+    def _where(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        clauses, params = [], []
+        for column, value in (("speaker_model", speaker_model), ("user_id", user_id), ("test_type", test_type)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if not include_historical:
+            clauses.append("is_historical = 0")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def get_all_tests(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        where, params = self._where(speaker_model, user_id, include_historical, test_type)
+        rows = self._query(f"{SELECT_SQL}{where} ORDER BY is_historical, rowid", params)
+        return [_row_to_dict(row) for row in rows]
+
+    def iter_tests(self, speaker_model=None, user_id=None, include_historical=False, test_type=None):
+        """Same rows as get_all_tests, fetched in batches from a cursor for streaming exports"""
+        where, params = self._where(speaker_model, user_id, include_historical, test_type)
+        return self._iter_query(f"{SELECT_SQL}{where} ORDER BY is_historical, rowid", params)
+
+    def _iter_query(self, sql, params=(), batch_size=1000):
+        self.flush()
+        cursor = self._connection().execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _row_to_dict(row)
+        finally:
+            cursor.close()
+
+    def iter_score_rows(self, batch_size=1000):
+        """(id, test_type, score, additional_data) of every current and historical test, for rescoring"""
+        self.flush()
+        cursor = self._connection().execute("SELECT id, test_type, score, additional_data FROM tests ORDER BY rowid")
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def get_test_by_id(self, test_id):
+        rows = self._query(f"{SELECT_SQL} WHERE id = ?", (test_id,))
+        return _row_to_dict(rows[0]) if rows else None
+
+    def get_user_tests(self, user_id=None):
+        """Get all tests of a testing session"""
+        if not user_id:
+            return []
+
+        return self.get_all_tests(user_id=user_id)
+
+    def export_user_data(self, user_id=None):
+        """Export the tests of a testing session as a stream of CSV chunks"""
+        return iter_csv(self.iter_tests(user_id=user_id) if user_id else [])
+
+    def export_historical_data(self):
+        """Export all historical data as a stream of CSV chunks"""
+        return iter_csv(self._iter_query(f"{SELECT_SQL} WHERE is_historical = 1 ORDER BY rowid"))
+
+    def get_analytics_summary(self, speaker_model=None, include_historical=False):
+        """Totals, averages and distributions shown on the analytics dashboard"""
+        where, params = self._where(speaker_model, include_historical=include_historical)
+
+        by_group = self._query(
+            f"SELECT speaker_model, test_type, COUNT(*), SUM(score), COUNT(score) FROM tests{where} "
+            "GROUP BY speaker_model, test_type", params)
+        if not by_group:
+            return {
+                "total_tests": 0,
+                "average_score": 0,
+                "test_types": {},
+                "speaker_models": {},
+                "average_scores_by_model": {},
+                "frequency_data": dict(DEFAULT_FREQUENCY_DATA),
+                "ratings_distribution": [0, 0, 0, 0, 0]
+            }
+
+        test_types, speaker_models, model_sum, model_scored = {}, {}, {}, {}
+        for model, test_type, count, score_sum, scored in by_group:
+            test_types[test_type] = test_types.get(test_type, 0) + count
+            speaker_models[model] = speaker_models.get(model, 0) + count
+            if scored:
+                model_sum[model] = model_sum.get(model, 0) + score_sum
+                model_scored[model] = model_scored.get(model, 0) + scored
+
+        ratings_dist = [0, 0, 0, 0, 0]
+        for rating, count in self._query(
+                f"SELECT CAST(user_rating AS INTEGER) AS r, COUNT(*) FROM tests{where} GROUP BY r", params):
+            if rating is not None and 1 <= rating <= 5:
+                ratings_dist[rating - 1] += count
+
+        total_scored = sum(model_scored.values())
+        return {
+            "total_tests": sum(speaker_models.values()),
+            "average_score": float(sum(model_sum.values()) / total_scored) if total_scored else 0.0,
+            "test_types": test_types,
+            "speaker_models": speaker_models,
+            "average_scores_by_model": {model: model_sum[model] / model_scored[model] for model in model_scored},
+            "frequency_data": self._frequency_data(where, params),
+            "ratings_distribution": ratings_dist
+        }
+
+    def _frequency_data(self, where, params):
+        where = (where + " AND " if where else " WHERE ") + "test_type = 'frequency_response' AND json_valid(additional_data)"
+        rows = self._query(
+            "SELECT j.key, SUM(CAST(j.value AS REAL)), COUNT(*) "
+            f"FROM (SELECT additional_data FROM tests{where}) AS t, json_each(t.additional_data) AS j "
+            "GROUP BY j.key", params)
+        if not rows:
+            return dict(DEFAULT_FREQUENCY_DATA)
+        rows.sort(key=lambda row: frequency_sort_key(row[0]))
+        return {"labels": [row[0] for row in rows],
+                "average_response": [row[1] / row[2] for row in rows]}
+
+    def _score_pairs(self):
+        """(speaker_model, test_type, score sum, scored count) rows, reused until any connection commits a change"""
+        self.flush()
+        conn = self._connection()
+        # data_version moves when another connection commits, total_changes when this one writes
+        version = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        cached = getattr(self._local, "score_pairs", None)
+        if cached is None or cached[0] != version:
+            rows = conn.execute("SELECT speaker_model, test_type, SUM(score), COUNT(score) FROM tests "
+                                "WHERE score IS NOT NULL GROUP BY speaker_model, test_type").fetchall()
+            cached = self._local.score_pairs = (version, rows)
+        return cached[1]
+
+    def get_trends(self, granularity, start=None, end=None, speaker_model=None, test_type=None,
+                   include_historical=True, group_by=None):
+        """Average score and test count per hour, day or week bucket starting in [start, end) (epoch seconds)"""
+        clauses, params = ["granularity = ?"], [granularity]
+        for clause, value in (("bucket >= ?", None if start is None else bucket_start(start, granularity)),
+                              ("bucket < ?", end), ("speaker_model = ?", speaker_model), ("test_type = ?", test_type)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if not include_historical:
+            clauses.append("is_historical = 0")
+        label = {"speaker_model": "speaker_model", "test_type": "test_type"}.get(group_by, "NULL")
+        rows = self._query(
+            f"SELECT {label}, bucket, SUM(test_count), SUM(score_sum), SUM(scored) FROM trend_rollups "
+            f"WHERE {' AND '.join(clauses)} GROUP BY 1, 2 HAVING SUM(test_count) > 0 ORDER BY 1, 2", params)
+
+        groups = {}
+        for group, *values in rows:
+            columns = groups.setdefault(group, ([], [], [], []))
+            for column, value in zip(columns, values):
+                column.append(value)
+        return trend_payload(granularity, group_by, {group: (np.array(buckets, dtype=np.int64), counts, sums, scored)
+                                                     for group, (buckets, counts, sums, scored) in groups.items()})
+
+    def get_best_speakers(self, test_types=None, limit=5):
+        """Find the best speakers based on average scores"""
+        wanted = set(test_types) if test_types else None
+        model_scores = {}
+        for model, test_type, score_sum, count in self._score_pairs():
+            if wanted is not None and test_type not in wanted:
+                continue
+            data = model_scores.setdefault(model, {"sum": 0, "count": 0, "scores_by_type": {}})
+            data["sum"] += score_sum
+            data["count"] += count
+            data["scores_by_type"][test_type] = score_sum / count
+
+        results = [{
+            "model": model,
+            "average_score": data["sum"] / data["count"],
+            "test_count": data["count"],
+            "scores_by_type": data["scores_by_type"]
+        } for model, data in model_scores.items()]
+        results.sort(key=lambda x: x["average_score"], reverse=True)
+        return results[:limit]
+
+    def get_personalized_speakers(self, user_ids=None, test_types=None, limit=5):
+        """{user id: best speakers weighted towards the test types that user runs most}; None means every user"""
+        pairs = self._score_pairs()
+        sql = "SELECT user_id, test_type, COUNT(*) FROM tests WHERE user_id IS NOT NULL"
+        if user_ids is None:
+            user_counts = self._query(sql + " GROUP BY user_id, test_type")
+            user_ids = list(dict.fromkeys(user_id for user_id, _, _ in user_counts))
+        else:
+            user_ids, user_counts = list(user_ids), []
+            # Stay under SQLite's bound parameter limit
+            for i in range(0, len(user_ids), 500):
+                block = user_ids[i:i + 500]
+                user_counts += self._query(
+                    f"{sql} AND user_id IN ({', '.join('?' * len(block))}) GROUP BY user_id, test_type", block)
+
+        models, types = StringTable(), StringTable()
+        for model, test_type, _, _ in pairs:
+            models.encode(model)
+            types.encode(test_type)
+        for _, test_type, _ in user_counts:
+            types.encode(test_type)
+        pair_sum = np.zeros((len(models), len(types)))
+        pair_count = np.zeros((len(models), len(types)), dtype=np.int64)
+        for model, test_type, score_sum, count in pairs:
+            pair_sum[models.lookup(model), types.lookup(test_type)] = score_sum
+            pair_count[models.lookup(model), types.lookup(test_type)] = count
+        rows = {user_id: i for i, user_id in enumerate(user_ids)}
+        type_counts = np.zeros((len(user_ids), len(types)), dtype=np.int64)
+        for user_id, test_type, count in user_counts:
+            type_counts[rows[user_id], types.lookup(test_type)] = count
+
+        columns = np.arange(len(types))
+        if test_types:
+            columns = np.unique([c for c in map(types.lookup, test_types) if c is not None]).astype(np.intp)
+        return dict(zip(user_ids, personalized_rankings(models.values, types.values, pair_sum, pair_count,
+                                                        type_counts, columns, limit)))
+
+    def similar_speakers(self, speaker_model, limit=5):
+        """[(speaker model, similarity)] of the models that sound most like speaker_model, or None"""
+        # Fold in the curve tests stored since the last call, by any worker
+        with self._similarity_lock:
+            rows = self._query(
+                f"SELECT rowid, speaker_model, test_type, additional_data FROM tests "
+                f"WHERE rowid > ? AND test_type IN ({', '.join('?' * len(CURVES))}) ORDER BY rowid",
+                (self._similarity_rowid, *CURVES))
+            for _, model, test_type, additional_data in rows:
+                self.similarity.add(model, test_type, additional_data)
+            if rows:
+                self._similarity_rowid = rows[-1][0]
+        return self.similarity.nearest(speaker_model, limit)
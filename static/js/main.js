@@ -322,7 +322,7 @@ async function runTest(testType) {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ speaker_model: speakerModel })
+            body: JSON.stringify({ speaker_model: speakerModel, user_id: currentUserId })
         });
         
         if (!response.ok) {
@@ -650,7 +650,8 @@ async function submitRating() {
             body: JSON.stringify({
                 test_id: lastTestId, 
                 rating: currentRating,
-                speaker_model: speakerModel
+                speaker_model: speakerModel,
+                user_id: currentUserId
             })
         });
         
@@ -1294,6 +1295,23 @@ function displayComparison(data, speakerModel) {
     
     compareDiv.innerHTML = html;
     
+    // Models with the most similar frequency and bass response curves; model names are
+    // user-supplied, so they are set as text rather than parsed as HTML
+    if (data.similar_speakers && data.similar_speakers.length > 0) {
+        const section = document.createElement('div');
+        section.className = 'comparison-insights';
+        const heading = document.createElement('h4');
+        heading.textContent = 'Sounds Similar To';
+        const list = document.createElement('ul');
+        for (const speaker of data.similar_speakers) {
+            const item = document.createElement('li');
+            item.textContent = `${speaker.model} (${(speaker.similarity * 100).toFixed(0)}% similar)`;
+            list.appendChild(item);
+        }
+        section.append(heading, list);
+        compareDiv.appendChild(section);
+    }
+    
     // Create comparison chart if data exists
     if (data.comparison && data.average && data.top_performer) {
         createComparisonChart(data, speakerModel);
@@ -0,0 +1,139 @@
+"""Helpers shared by the storage backends: record validation, seed data, CSV export and timestamps"""
+import datetime
+import json
+import os
+import random
+import uuid
+
+from aggregates import parse_rating
+
+# Columns written by the CSV exports
+CSV_COLUMNS = ["id", "timestamp", "speaker_model", "test_type",
+               "score", "user_rating", "additional_data", "user_id"]
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Seed of the generated sample and historical tests, and how many historical tests to generate
+SEED = int(os.environ.get('SPEAKER_SEED', 0))
+HISTORICAL_ROWS = int(os.environ.get('SPEAKER_HISTORICAL_ROWS', 275))
+
+
+def check_test(test):
+    """Raise ValueError unless test is a record every backend can store and index"""
+    if not isinstance(test, dict):
+        raise ValueError("A test must be an object")
+    for field in ("id", "timestamp", "speaker_model", "test_type"):
+        if not isinstance(test.get(field), str):
+            raise ValueError(f"A test's {field} must be a string")
+    for field in ("user_id", "additional_data"):
+        if not isinstance(test.get(field), (str, type(None))):
+            raise ValueError(f"A test's {field} must be a string or null")
+    score = test.get("score")
+    if score is not None and (isinstance(score, bool) or not isinstance(score, (int, float))):
+        raise ValueError("A test's score must be a number or null")
+    rating = test.get("user_rating")
+    if rating is not None and (not isinstance(rating, int) or parse_rating(rating) != rating):
+        raise ValueError("A test's user_rating must be an integer from 1 to 5 or null")
+    try:
+        timestamp_to_epoch_us(test["timestamp"])
+    except ValueError:
+        raise ValueError("A test's timestamp must be an ISO 8601 timestamp")
+
+
+def timestamp_to_epoch_us(timestamp):
+    """Convert an ISO timestamp string to integer microseconds since the epoch"""
+    dt = datetime.datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def epoch_us_to_timestamp(epoch_us):
+    """Convert integer microseconds since the epoch back to an ISO timestamp string"""
+    return (EPOCH + datetime.timedelta(microseconds=int(epoch_us))).isoformat()
+
+
+def sample_tests(seed=SEED):
+    """Yield the sample test records a fresh storage starts with; the same seed gives the same tests"""
+    rng = random.Random(seed)
+    speaker_models = ["Bose SoundLink", "JBL Flip 5", "Sony WH-1000XM4", "Sonos One"]
+    test_types = ["frequency_response", "distortion", "bass_response"]
+    now = datetime.datetime.now()
+
+    for i in range(10):
+        model = rng.choice(speaker_models)
+        test_type = rng.choice(test_types)
+
+        if test_type == "frequency_response":
+            additional_data = {
+                "100": rng.uniform(0.7, 0.95),
+                "500": rng.uniform(0.75, 0.98),
+                "1000": rng.uniform(0.8, 0.99),
+                "5000": rng.uniform(0.75, 0.95),
+                "10000": rng.uniform(0.7, 0.9),
+                "15000": rng.uniform(0.6, 0.85)
+            }
+        elif test_type == "distortion":
+            distortion = rng.uniform(0.5, 5.0)
+            additional_data = {"distortion_percentage": distortion}
+        else:  # bass_response
+            additional_data = {
+                "20": rng.uniform(0.6, 0.9),
+                "40": rng.uniform(0.65, 0.92),
+                "60": rng.uniform(0.7, 0.94),
+                "100": rng.uniform(0.75, 0.96),
+                "150": rng.uniform(0.8, 0.98),
+                "200": rng.uniform(0.75, 0.95)
+            }
+
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "timestamp": (now - datetime.timedelta(days=i)).isoformat(),
+            "speaker_model": model,
+            "test_type": test_type,
+            "score": rng.uniform(70, 95),
+            "user_rating": rng.randint(3, 5) if rng.random() > 0.3 else None,
+            "additional_data": json.dumps(additional_data)
+        }
+
+
+def historical_tests(rows=HISTORICAL_ROWS, seed=SEED):
+    """Yield the "past" test records used for comparisons and recommendations (see synthetic_history.py)"""
+    from synthetic_history import HistoricalDataset
+
+    yield from HistoricalDataset(rows, seed)
+
+
+def iter_csv(tests, columns=CSV_COLUMNS, rows_per_chunk=500):
+    """Yield tests as CSV text, rows_per_chunk rows at a time, holding only one chunk in memory"""
+    from io import StringIO
+    import csv
+
+    output = StringIO()
+    writer = csv.writer(output)
+
+    # Write header
+    writer.writerow(columns)
+
+    # Write data rows
+    for count, test in enumerate(tests, 1):
+        writer.writerow([test.get(col, '') for col in columns])
+        if count % rows_per_chunk == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    if output.tell():
+        yield output.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of text chunks on the fly"""
+    import zlib
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
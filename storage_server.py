@@ -0,0 +1,583 @@
+"""Storage server: one local process owns the test data and every app worker shares it.
+
+Under gunicorn each worker process would otherwise build its own storage
+backend, so a rating stored through one worker is invisible to the others
+and every worker pays for its own copy of the seed and historical data.
+With SPEAKER_STORAGE_BACKEND=remote the app's storage is a RemoteStorage
+that calls the backend held by this server over a Unix socket instead.
+
+Calls are pickled (method name, args, kwargs) frames answered in order, so a
+client can pipeline many calls on one connection; each client process keeps
+a pool of idle connections. Methods returning iterators (iter_tests, the CSV
+exports) stream their items back in chunks; lazy sequences (ColumnarStorage's
+row views) are sent as lists.
+
+The read-mostly dashboard aggregates (SNAPSHOT_CALLS) are also published
+into a multiprocessing.shared_memory block, at most every
+SPEAKER_SNAPSHOT_INTERVAL seconds after a write, and clients read them from
+there without a round trip. A client falls back to calling the server while
+the snapshot predates one of its own process's writes.
+
+The socket carries pickles, so it is meant for processes of one user on
+one host. It lives in a directory only that user can enter:
+$XDG_RUNTIME_DIR, or else one made with mkdtemp by start_server_process and
+passed to the workers in SPEAKER_STORAGE_SOCKET. It is created owner-only,
+and both ends check that the process at the other end runs as the same user
+(SO_PEERCRED) before reading anything from it.
+
+Usage: python storage_server.py [--socket PATH] [--backend memory|columnar|sqlite]
+
+gunicorn.conf.py starts it automatically when SPEAKER_STORAGE_BACKEND=remote.
+"""
+import argparse
+import atexit
+import os
+import pickle
+import shutil
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Sequence
+from concurrent.futures import Future
+from contextlib import nullcontext
+from itertools import islice
+from multiprocessing import resource_tracker, shared_memory
+
+SOCKET_NAME = 'speaker-storage.sock'
+
+# Calls answered from the shared snapshot, with the arguments they are published for
+SNAPSHOT_CALLS = {
+    "get_analytics_summary": {"speaker_model": None, "include_historical": False},
+    "get_best_speakers": {"test_types": None, "limit": 5},
+}
+
+# Calls after which the snapshot is republished
+WRITE_METHODS = {"add_test", "add_tests", "update_rating", "update_scores"}
+
+SNAPSHOT_INTERVAL = float(os.environ.get('SPEAKER_SNAPSHOT_INTERVAL', 0.2))
+SNAPSHOT_BYTES = int(os.environ.get('SPEAKER_SNAPSHOT_MB', 4)) * 2**20
+
+# Idle connections each client process keeps open
+POOL_SIZE = int(os.environ.get('SPEAKER_STORAGE_POOL', 8))
+
+# Items per frame when streaming an iterator back, and calls per pipelined round trip
+STREAM_CHUNK = 1000
+PIPELINE_DEPTH = 64
+
+_FRAME = struct.Struct('!I')
+# Sequence number (odd while a snapshot is being written), write generation, payload length
+_SNAPSHOT_HEADER = struct.Struct('<QQQ')
+_HELLO = "_hello"
+_MISSING = object()
+
+
+def socket_path():
+    """The server's socket: SPEAKER_STORAGE_SOCKET, else one in $XDG_RUNTIME_DIR; None if neither is set"""
+    path = os.environ.get('SPEAKER_STORAGE_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    return os.path.join(runtime_dir, SOCKET_NAME) if runtime_dir else None
+
+
+def _private_socket_path():
+    """A socket path in a new directory only this user can enter"""
+    return os.path.join(tempfile.mkdtemp(prefix='speaker-storage-'), SOCKET_NAME)
+
+
+def _peer_uid(sock):
+    """User id of the process at the other end of a Unix socket, or None where the OS cannot tell"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def _frame(message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _FRAME.pack(len(data)) + data
+
+
+def _read_frame(reader):
+    header = reader.read(_FRAME.size)
+    if len(header) < _FRAME.size:
+        raise EOFError("Storage connection closed")
+    size, = _FRAME.unpack(header)
+    data = reader.read(size)
+    if len(data) < size:
+        raise EOFError("Storage connection closed")
+    return pickle.loads(data)
+
+
+def _published(name, args, kwargs):
+    """Whether a call asks for exactly what SNAPSHOT_CALLS publishes"""
+    defaults = SNAPSHOT_CALLS.get(name)
+    if defaults is None or len(args) > len(defaults):
+        return False
+    bound = dict(defaults)
+    bound.update(zip(defaults, args))
+    bound.update(kwargs)
+    return bound == defaults
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        if _peer_uid(self.request) not in (None, os.getuid()):
+            return  # another user's process: never unpickle what it sends
+        try:
+            while True:
+                try:
+                    name, args, kwargs = _read_frame(self.rfile)
+                except EOFError:
+                    return
+                try:
+                    if name == _HELLO:
+                        result, generation = {"methods": server.methods, "snapshot": server.snapshot.name}, 0
+                    else:
+                        result, generation = server.call(name, args, kwargs)
+                except Exception as e:
+                    self._send("error", e, server.generation)
+                    continue
+                if hasattr(result, '__next__'):
+                    self._stream(result, generation)
+                else:
+                    self._send("ok", result, generation)
+        except OSError:
+            return  # the client went away mid-reply
+
+    def _send(self, status, value, generation):
+        try:
+            data = _frame((status, value, generation))
+        except Exception as e:
+            data = _frame(("error", RuntimeError(f"Could not send the {status} reply: {e}"), generation))
+        self.wfile.write(data)
+
+    def _stream(self, items, generation):
+        while True:
+            try:
+                with self.server.lock:
+                    chunk = list(islice(items, STREAM_CHUNK))
+            except Exception as e:
+                self._send("error", e, generation)
+                return
+            if not chunk:
+                self._send("end", None, generation)
+                return
+            self._send("item", chunk, generation)
+
+
+class StorageServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves one storage backend to RemoteStorage clients"""
+    daemon_threads = True
+
+    def __init__(self, storage, path, snapshot_bytes=SNAPSHOT_BYTES, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.storage = storage
+        # One call at a time, unless the backend synchronizes itself (MemoryStorage, ColumnarStorage)
+        self.lock = nullcontext() if getattr(storage, 'thread_safe', False) else threading.Lock()
+        self.generation = 0  # number of writes so far
+        self.methods = sorted(name for name in dir(storage)
+                              if not name.startswith('_') and callable(getattr(storage, name)))
+        self._method_names = set(self.methods)
+        self.snapshot_interval = snapshot_interval
+
+        if os.path.exists(path):
+            try:
+                _Connection(path).close()
+            except PermissionError as e:
+                raise RuntimeError(f"Cannot use {path}: {e}")
+            except OSError:
+                os.unlink(path)  # left behind by a server that died
+            else:
+                raise RuntimeError(f"A storage server is already listening on {path}")
+        # Owner-only from the moment it is bound, not after a chmod
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+
+        self.snapshot = shared_memory.SharedMemory(create=True, size=snapshot_bytes)
+        self._sequence = 0
+        self._dirty = threading.Event()
+        self._closed = threading.Event()
+        self._publish()
+        self._publisher = threading.Thread(target=self._publish_loop, name="storage-snapshot", daemon=True)
+        self._publisher.start()
+
+    def call(self, name, args, kwargs):
+        """(result, write generation) of one storage method call"""
+        if name not in self._method_names:
+            raise AttributeError(f"Storage has no method {name!r}")
+        with self.lock:
+            result = getattr(self.storage, name)(*args, **kwargs)
+            if isinstance(result, Sequence) and not isinstance(result, (list, tuple, str, bytes)):
+                # Lazy views (ColumnarStorage's row lists) read the backend on access: send a copy
+                result = list(result)
+            if name in WRITE_METHODS:
+                self.generation += 1
+                self._dirty.set()
+            return result, self.generation
+
+    def _publish(self):
+        with self.lock:
+            generation = self.generation
+            # Each value pickled on its own, so a reader only unpickles the one it asked for
+            payload = pickle.dumps({name: pickle.dumps(getattr(self.storage, name)(**defaults), pickle.HIGHEST_PROTOCOL)
+                                    for name, defaults in SNAPSHOT_CALLS.items()}, pickle.HIGHEST_PROTOCOL)
+        buf = self.snapshot.buf
+        if len(payload) > len(buf) - _SNAPSHOT_HEADER.size:
+            payload = b""  # too large to publish: clients call the server instead
+
+        # Seqlock: readers retry (or call the server) if the sequence changed while they copied
+        header = _SNAPSHOT_HEADER.unpack_from(buf)
+        _SNAPSHOT_HEADER.pack_into(buf, 0, self._sequence + 1, header[1], header[2])
+        buf[_SNAPSHOT_HEADER.size:_SNAPSHOT_HEADER.size + len(payload)] = payload
+        self._sequence += 2
+        _SNAPSHOT_HEADER.pack_into(buf, 0, self._sequence, generation, len(payload))
+
+    def _publish_loop(self):
+        while True:
+            self._dirty.wait()
+            if self._closed.is_set():
+                return
+            self._dirty.clear()
+            self._publish()
+            # At most one snapshot per interval however fast writes arrive
+            if self._closed.wait(self.snapshot_interval):
+                return
+
+    def server_close(self):
+        self._closed.set()
+        self._dirty.set()
+        self._publisher.join()
+        # Leave the sequence odd so clients still attached stop reading the block and call (and reconnect) instead
+        _SNAPSHOT_HEADER.pack_into(self.snapshot.buf, 0, self._sequence + 1, 0, 0)
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        self.snapshot.close()
+        self.snapshot.unlink()
+
+
+class _Connection:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+            uid = _peer_uid(self.sock)
+            if uid not in (None, os.getuid()):
+                # Replies are unpickled: only trust a server run by this user
+                raise PermissionError(f"The storage server on {path} runs as user {uid}, not {os.getuid()}")
+        except OSError:
+            self.sock.close()
+            raise
+        self.reader = self.sock.makefile('rb')
+
+    def send(self, *messages):
+        self.sock.sendall(b"".join(_frame(message) for message in messages))
+
+    def receive(self):
+        return _read_frame(self.reader)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class RemoteStorage:
+    """Storage backend whose methods are calls to a StorageServer.
+
+    Any public method of the server's backend can be called; results are
+    copies, so changing a returned test does not change the stored one.
+    Connections are opened lazily, so an instance made before a fork is
+    safe to use in the child. Without a path, the socket is found with
+    socket_path() when the first connection is opened.
+    """
+    def __init__(self, path=None, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._methods = None
+        self._snapshot = None
+        self._published = None  # (sequence, {name: pickled value}) last read from the snapshot
+        self._generation = 0  # newest server write generation caused by this process
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()  # forked: the parent's connections are not ours
+            if self._idle:
+                return self._idle.pop(), True
+            if self.path is None:
+                self.path = socket_path()
+                if self.path is None:
+                    raise RuntimeError("No storage server socket: set SPEAKER_STORAGE_SOCKET or XDG_RUNTIME_DIR")
+        conn = _Connection(self.path)
+        if self._methods is None:
+            try:
+                conn.send((_HELLO, (), {}))
+                _, info, _ = conn.receive()
+            except BaseException:
+                conn.close()
+                raise
+            self._attach(info)
+        return conn, False
+
+    def _attach(self, info):
+        with self._lock:
+            if self._methods is not None:
+                return
+            self._methods = set(info["methods"])
+            try:
+                snapshot = shared_memory.SharedMemory(name=info["snapshot"])
+            except OSError:
+                return
+            # The server owns the block: don't let this process's resource tracker unlink it at exit
+            resource_tracker.unregister(snapshot._name, 'shared_memory')
+            self._snapshot = snapshot
+
+    def _release(self, conn):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _discard_pool(self):
+        """Forget every pooled connection, e.g. after the server restarted"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._methods = None
+            self._snapshot = None
+            self._published = None
+            self._generation = 0
+        for conn in idle:
+            conn.close()
+
+    def _seen(self, name, generation):
+        if name in WRITE_METHODS and generation > self._generation:
+            self._generation = generation
+
+    def _call(self, name, args, kwargs):
+        if _published(name, args, kwargs):
+            value = self._read_snapshot(name)
+            if value is not _MISSING:
+                return value
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.send((name, args, kwargs))
+                status, value, generation = conn.receive()
+            except (EOFError, ConnectionError):
+                conn.close()
+                if not reused:
+                    raise
+                # A pooled connection to a server that has since restarted
+                self._discard_pool()
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            break
+        if status == "item":
+            return self._stream(conn, value)
+        self._release(conn)
+        self._seen(name, generation)
+        if status == "error":
+            raise value
+        return value
+
+    def _stream(self, conn, first):
+        try:
+            yield from first
+            while True:
+                status, value, _ = conn.receive()
+                if status == "end":
+                    break
+                if status == "error":
+                    raise value
+                yield from value
+        except BaseException:
+            conn.close()  # unread frames may still follow
+            raise
+        self._release(conn)
+
+    def _read_snapshot(self, name):
+        """A published value, or _MISSING if there is no snapshot current enough for this process"""
+        if self._methods is None:
+            self._release(self._acquire()[0])
+        if self._snapshot is None:
+            return _MISSING
+        buf = self._snapshot.buf
+        for _ in range(3):
+            sequence, generation, length = _SNAPSHOT_HEADER.unpack_from(buf)
+            if sequence & 1:
+                continue
+            if generation < self._generation or not length:
+                return _MISSING
+            published = self._published
+            if published is None or published[0] != sequence:
+                payload = bytes(buf[_SNAPSHOT_HEADER.size:_SNAPSHOT_HEADER.size + length])
+                if _SNAPSHOT_HEADER.unpack_from(buf)[0] != sequence:
+                    continue
+                published = self._published = (sequence, pickle.loads(payload))
+            return pickle.loads(published[1][name])
+        return _MISSING
+
+    def _method_names(self):
+        if self._methods is None:
+            self._release(self._acquire()[0])
+        return self._methods
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._method_names():
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+        def method(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        method.__name__ = name
+        return method
+
+    def pipeline(self):
+        """Batch calls into as few round trips as possible.
+
+            with storage.pipeline() as pipe:
+                summary = pipe.get_analytics_summary()
+                best = pipe.get_best_speakers()
+            summary.result(), best.result()
+        """
+        return Pipeline(self)
+
+    def _pipelined(self, calls):
+        """Send (name, args, kwargs, future) calls PIPELINE_DEPTH at a time, resolving their futures in order"""
+        conn, _ = self._acquire()
+        try:
+            for i in range(0, len(calls), PIPELINE_DEPTH):
+                batch = calls[i:i + PIPELINE_DEPTH]
+                conn.send(*[(name, args, kwargs) for name, args, kwargs, _ in batch])
+                for name, _, _, future in batch:
+                    status, value, generation = conn.receive()
+                    if status == "item":
+                        # Streams are read to the end to get at the replies behind them
+                        items = list(value)
+                        while status != "end":
+                            status, value, _ = conn.receive()
+                            if status == "error":
+                                break
+                            items.extend(value or ())
+                        value = iter(items) if status == "end" else value
+                    self._seen(name, generation)
+                    if status == "error":
+                        future.set_exception(value)
+                    else:
+                        future.set_result(value)
+        except BaseException as e:
+            conn.close()
+            for _, _, _, future in calls:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        self._release(conn)
+
+
+class Pipeline:
+    """Calls queued on a RemoteStorage and sent together; each returns a Future"""
+    def __init__(self, storage):
+        self._storage = storage
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._storage._method_names():
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+        def method(*args, **kwargs):
+            future = Future()
+            self._calls.append((name, args, kwargs, future))
+            return future
+        method.__name__ = name
+        return method
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        if calls:
+            self._storage._pipelined(calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.execute()
+
+
+def start_server_process(path=None, backend=None, timeout=60):
+    """Run this module as a separate process and wait until it accepts connections; returns its Popen.
+
+    Without a path, the socket goes where socket_path() says or, failing that, in
+    a new private directory that is exported as SPEAKER_STORAGE_SOCKET, so
+    processes started or forked afterwards find it.
+    """
+    path = path or socket_path()
+    if path is None:
+        path = _private_socket_path()
+        os.environ['SPEAKER_STORAGE_SOCKET'] = path
+        atexit.register(shutil.rmtree, os.path.dirname(path), True)
+    command = [sys.executable, os.path.abspath(__file__), '--socket', path]
+    if backend:
+        command += ['--backend', backend]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _Connection(path).close()
+            return process
+        except PermissionError:
+            process.terminate()
+            raise
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"Storage server exited with code {process.returncode}")
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError(f"Storage server did not start within {timeout} s")
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=socket_path(),
+                        help='socket path (default: SPEAKER_STORAGE_SOCKET, $XDG_RUNTIME_DIR, or a new private directory)')
+    parser.add_argument('--backend', choices=['memory', 'columnar', 'sqlite'],
+                        default=os.environ.get('SPEAKER_STORAGE_SERVER_BACKEND', 'memory'))
+    args = parser.parse_args()
+
+    # The app module builds its storage from this at import: the real backend, not a client of ourselves
+    os.environ['SPEAKER_STORAGE_BACKEND'] = args.backend
+    from speaker_testing import storage
+
+    path = args.socket or _private_socket_path()
+    server = StorageServer(storage, path)
+    print(f"Storage server listening on {path}", file=sys.stderr)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Seeded synthetic "past" test records, generated as NumPy columns.
+
+The historical tests used for comparisons and recommendations are drawn
+from ``np.random.default_rng(seed)`` all at once: one column each for the
+speaker model, test type, score, rating, timestamp and user, plus the test
+ids as raw UUID bytes. A million rows take a fraction of a second and about
+40 MB, and the same seed always gives the same tests (timestamps count back
+from today's midnight). Records are only turned into dicts when they are
+read, and scores can be updated in place.
+"""
+import datetime
+import uuid
+from collections.abc import Sequence
+
+import numpy as np
+
+SPEAKER_MODELS = ["Bose SoundLink", "JBL Flip 5", "Sony WH-1000XM4", "Sonos One",
+                  "Klipsch R-51M", "KEF Q150", "Edifier R1280T", "Polk Audio T15"]
+TEST_TYPES = ["frequency_response", "distortion", "bass_response", "stereo_imaging",
+              "clarity", "max_volume", "dynamic_range", "transient_response",
+              "voice_reproduction", "soundstage"]
+USER_IDS = [f"past_user_{i}" for i in range(1, 11)]
+
+# Range of each model's base score: some speakers are biased to be better than others
+BASE_SCORES = np.array([(75, 90), (65, 85), (80, 95), (75, 90), (65, 85), (80, 95), (65, 85), (65, 85)])
+
+# Test types run per session; a session tests one model
+SESSION_TESTS = (3, 8)
+
+HISTORICAL_DATA = '{"historical": true}'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Records converted to dicts per batch of column reads
+RECORD_BATCH = 1024
+
+
+def _code(names, value):
+    try:
+        return names.index(value)
+    except ValueError:
+        return None
+
+
+def _uuid_strings(ids):
+    """Canonical UUID strings of the rows of an (n, 16) uint8 array"""
+    digits = ids.tobytes().hex()
+    return [f"{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}"
+            for i in range(0, len(digits), 32)]
+
+
+class HistoricalDataset(Sequence):
+    """`rows` historical tests generated from `seed`, as columns; indexing returns record dicts"""
+    def __init__(self, rows, seed=0, today=None):
+        rng = np.random.default_rng(seed)
+        low, high = SESSION_TESTS
+        sizes = rng.integers(low, high + 1, rows // low + 1)
+        ends = np.cumsum(sizes)
+        sessions = int(np.searchsorted(ends, rows)) + 1 if rows else 0
+        sizes, ends = sizes[:sessions], ends[:sessions]
+        if sessions:
+            # The last session is cut short at `rows`
+            sizes[-1] -= ends[-1] - rows
+            ends[-1] = rows
+
+        session_model = rng.integers(0, len(SPEAKER_MODELS), sessions)
+        base_score = rng.uniform(*BASE_SCORES[session_model].T)
+        # Each session runs distinct test types: the first tests of a random permutation
+        type_order = np.argsort(rng.random((sessions, len(TEST_TYPES))), axis=1)
+        session = np.repeat(np.arange(sessions), sizes)
+        position = np.arange(rows) - np.repeat(ends - sizes, sizes)
+
+        self.model = session_model[session].astype(np.int8)
+        self.test_type = type_order[session, position].astype(np.int8)
+        self.score = np.clip(base_score[session] + rng.uniform(-10, 10, rows), 50, 99)
+        self.user_rating = np.where(rng.random(rows) > 0.3, rng.integers(3, 6, rows), 0).astype(np.int8)  # 0: unrated
+        midnight = datetime.datetime.combine(today or datetime.date.today(), datetime.time())
+        days = rng.integers(30, 366, rows)
+        self.epoch = (midnight - EPOCH) // datetime.timedelta(seconds=1) - days * 86400 + rng.integers(0, 86400, rows)
+        self.user = rng.integers(0, len(USER_IDS), rows).astype(np.int8)
+        # Version 4, variant 1 UUIDs
+        self.ids = np.frombuffer(rng.bytes(16 * rows), dtype=np.uint8).reshape(rows, 16).copy()
+        self.ids[:, 6] = self.ids[:, 6] & 0x0f | 0x40
+        self.ids[:, 8] = self.ids[:, 8] & 0x3f | 0x80
+        self._sorted = None  # (sorted id prefixes, their positions), built by the first find
+
+    def __len__(self):
+        return len(self.score)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self.records(range(*i.indices(len(self)))))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.record(i)
+
+    def __iter__(self):
+        return self.records(range(len(self)))
+
+    def test_id(self, i):
+        return str(uuid.UUID(bytes=self.ids[i].tobytes()))
+
+    def record(self, i):
+        """The test at position i as a dict, in the shape the storages keep"""
+        return next(self.records([i]))
+
+    def records(self, positions):
+        """Yield the tests at positions as dicts, converting RECORD_BATCH of them at a time"""
+        positions = np.asarray(positions, dtype=np.intp)
+        for start in range(0, len(positions), RECORD_BATCH):
+            batch = positions[start:start + RECORD_BATCH]
+            timestamps = np.datetime_as_string(self.epoch[batch].astype('datetime64[s]')).tolist()
+            for test_id, timestamp, model, test_type, score, rating, user in zip(
+                    _uuid_strings(self.ids[batch]), timestamps, self.model[batch].tolist(),
+                    self.test_type[batch].tolist(), self.score[batch].tolist(),
+                    self.user_rating[batch].tolist(), self.user[batch].tolist()):
+                yield {
+                    "id": test_id,
+                    "timestamp": timestamp,
+                    "speaker_model": SPEAKER_MODELS[model],
+                    "test_type": TEST_TYPES[test_type],
+                    "score": None if score != score else score,
+                    "user_rating": rating or None,
+                    "additional_data": HISTORICAL_DATA,
+                    "is_historical": True,
+                    "user_id": USER_IDS[user]
+                }
+
+    def find(self, test_id):
+        """Position of the test with id test_id, or None"""
+        try:
+            key = uuid.UUID(test_id)
+        except (TypeError, ValueError, AttributeError):
+            return None
+        if str(key) != test_id:
+            return None
+        if self._sorted is None:
+            prefixes = self.ids[:, :8].copy().view('>u8').ravel()
+            order = np.argsort(prefixes, kind='stable')
+            self._sorted = (prefixes[order], order)
+        prefixes, order = self._sorted
+        prefix = int.from_bytes(key.bytes[:8], 'big')
+        i = int(np.searchsorted(prefixes, prefix))
+        while i < len(prefixes) and prefixes[i] == prefix:
+            if self.ids[order[i]].tobytes() == key.bytes:
+                return int(order[i])
+            i += 1
+        return None
+
+    def positions(self, speaker_model=None, user_id=None, test_type=None):
+        """Positions of the tests matching every given filter"""
+        mask = np.ones(len(self), dtype=bool)
+        for names, column, value in ((SPEAKER_MODELS, self.model, speaker_model),
+                                     (USER_IDS, self.user, user_id),
+                                     (TEST_TYPES, self.test_type, test_type)):
+            if value is None:
+                continue
+            code = _code(names, value)
+            if code is None:
+                return np.empty(0, dtype=np.intp)
+            mask &= column == code
+        return np.flatnonzero(mask)
+
+    def select(self, speaker_model=None, user_id=None, test_type=None):
+        return list(self.iter_select(speaker_model, user_id, test_type))
+
+    def iter_select(self, speaker_model=None, user_id=None, test_type=None):
+        """Iterate over the tests matching every given filter, building each dict as it is reached"""
+        if speaker_model is None and user_id is None and test_type is None:
+            return iter(self)
+        return self.records(self.positions(speaker_model, user_id, test_type).tolist())
+
+    def iter_score_rows(self):
+        """(id, test_type, score, additional_data) of every test, for rescoring"""
+        for test in self:
+            yield test["id"], test["test_type"], test["score"], HISTORICAL_DATA
+
+    def set_score(self, i, score):
+        self.score[i] = np.nan if score is None else score
+
+    def add_to(self, engine):
+        """Append every test to an AnalyticsEngine in one batch; returns the engine row of the first"""
+        return engine.extend(SPEAKER_MODELS, TEST_TYPES, self.model, self.test_type, self.score, self.user_rating,
+                             self.epoch, historical=True, user_ids=USER_IDS, user_index=self.user)
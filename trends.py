@@ -0,0 +1,219 @@
+"""Score trends over time, from rollups kept per speaker model and test type.
+
+Every stored test is counted into one hour, one day and one week bucket of
+its (speaker model, test type, historical) series. A series holds its bucket
+start times as a sorted int64 array of epoch seconds next to arrays of test
+counts, score sums and scored-test counts, so answering a time range is two
+binary searches per series rather than a scan of raw records. Tests usually
+arrive in time order and land in a series' last bucket in O(1).
+"""
+import datetime
+
+import numpy as np
+
+from storage_common import timestamp_to_epoch_us
+
+# Bucket widths in seconds
+GRANULARITIES = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+
+# Weeks start on Monday; the epoch fell on a Thursday
+WEEK_OFFSET = 4 * 86400
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def bucket_start(epoch, granularity):
+    """Start (epoch seconds) of the bucket holding epoch; works on arrays too"""
+    width = GRANULARITIES[granularity]
+    offset = WEEK_OFFSET if granularity == "week" else 0
+    return (epoch - offset) // width * width + offset
+
+
+def parse_epoch(timestamp):
+    """Epoch seconds of an ISO timestamp (naive ones are taken as stored), or None for None"""
+    if timestamp is None:
+        return None
+    return timestamp_to_epoch_us(timestamp) // 1000000
+
+
+class _Series:
+    """Buckets of one series at one granularity, sorted by start time"""
+    __slots__ = ("buckets", "counts", "sums", "scored", "size")
+
+    def __init__(self):
+        self.buckets = np.empty(16, dtype=np.int64)
+        self.counts = np.zeros(16, dtype=np.int64)
+        self.sums = np.zeros(16)
+        self.scored = np.zeros(16, dtype=np.int64)
+        self.size = 0
+
+    def _index(self, bucket):
+        """Position of bucket, inserting an empty one if it is new"""
+        n = self.size
+        if n and self.buckets[n - 1] == bucket:
+            return n - 1
+        i = n if not n or bucket > self.buckets[n - 1] else int(np.searchsorted(self.buckets[:n], bucket))
+        if i < n and self.buckets[i] == bucket:
+            return i
+        if n == len(self.buckets):
+            for name in self.__slots__[:-1]:
+                old = getattr(self, name)
+                grown = np.zeros(n * 2, dtype=old.dtype)
+                grown[:n] = old
+                setattr(self, name, grown)
+        # Out-of-order bucket (e.g. backfilled history): shift the later ones up
+        for array in (self.buckets, self.counts, self.sums, self.scored):
+            array[i + 1:n + 1] = array[i:n]
+        self.buckets[i] = bucket
+        self.counts[i] = self.sums[i] = self.scored[i] = 0
+        self.size = n + 1
+        return i
+
+    def adjust(self, bucket, tests, score, scored):
+        i = self._index(bucket)
+        self.counts[i] += tests
+        self.sums[i] += score
+        self.scored[i] += scored
+
+    def merge(self, buckets, counts, sums, scored):
+        """Add the tests of sorted, distinct buckets (e.g. a batch of backfilled history)"""
+        n = self.size
+        merged, inverse = np.unique(np.concatenate([self.buckets[:n], buckets]), return_inverse=True)
+        capacity = len(self.buckets)
+        while capacity < len(merged):
+            capacity *= 2
+        for name, added in (("buckets", None), ("counts", counts), ("sums", sums), ("scored", scored)):
+            old = getattr(self, name)
+            array = np.zeros(capacity, dtype=old.dtype)
+            if added is None:
+                array[:len(merged)] = merged
+            else:
+                array[:len(merged)] = np.bincount(inverse, weights=np.concatenate([old[:n], added]),
+                                                  minlength=len(merged))
+            setattr(self, name, array)
+        self.size = len(merged)
+
+    def window(self, start, end):
+        """(buckets, counts, sums, scored) of the buckets starting in [start, end)"""
+        n = self.size
+        lo = 0 if start is None else int(np.searchsorted(self.buckets[:n], start, 'left'))
+        hi = n if end is None else int(np.searchsorted(self.buckets[:n], end, 'left'))
+        return self.buckets[lo:hi], self.counts[lo:hi], self.sums[lo:hi], self.scored[lo:hi]
+
+
+class TrendRollups:
+    def __init__(self):
+        self._series = {granularity: {} for granularity in GRANULARITIES}  # -> {(model, test_type, historical): _Series}
+
+    def state(self):
+        """Every series of a granularity as its key and size plus its buckets concatenated onto the others'"""
+        state = {}
+        for granularity, series in self._series.items():
+            entries = list(series.values())
+            saved = state[granularity] = {
+                "keys": list(series),
+                "sizes": np.array([entry.size for entry in entries], dtype=np.int64)
+            }
+            for name in _Series.__slots__[:-1]:
+                parts = [getattr(entry, name)[:entry.size] for entry in entries]
+                saved[name] = np.concatenate(parts) if parts else getattr(_Series(), name)[:0]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Rollups from state(); each series keeps using its slice of the concatenated arrays until it grows"""
+        rollups = cls()
+        for granularity, saved in state.items():
+            series = rollups._series[granularity]
+            ends = np.cumsum(saved["sizes"]).tolist()
+            start = 0
+            for key, end in zip(saved["keys"], ends):
+                entry = series[key] = _Series.__new__(_Series)
+                for name in _Series.__slots__[:-1]:
+                    setattr(entry, name, saved[name][start:end])
+                entry.size = end - start
+                start = end
+        return rollups
+
+    def _adjust(self, key, epoch, tests, score, scored):
+        for granularity, series in self._series.items():
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = _Series()
+            entry.adjust(bucket_start(epoch, granularity), tests, score, scored)
+
+    def add(self, speaker_model, test_type, historical, epoch, score):
+        """Count one test stored at epoch seconds; score NaN means unscored"""
+        scored = score == score
+        self._adjust((speaker_model, test_type, historical), epoch, 1, score if scored else 0.0, int(scored))
+
+    def add_many(self, speaker_models, test_types, historical, model_index, type_index, epoch, score):
+        """Count a batch of tests, test i of speaker_models[model_index[i]] and test_types[type_index[i]]"""
+        epoch = np.asarray(epoch)
+        score = np.asarray(score, dtype=np.float64)
+        scored = score == score
+        score = np.where(scored, score, 0.0)
+        pairs = np.asarray(model_index, dtype=np.int64) * len(test_types) + type_index
+        if not len(pairs):
+            return
+        order = np.argsort(pairs, kind='stable')
+        pairs = pairs[order]
+        starts = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+        for start, end in zip(starts.tolist(), np.r_[starts[1:], len(pairs)].tolist()):
+            rows = order[start:end]
+            model, kind = divmod(int(pairs[start]), len(test_types))
+            key = (speaker_models[model], test_types[kind], historical)
+            for granularity, series in self._series.items():
+                buckets, inverse = np.unique(bucket_start(epoch[rows], granularity), return_inverse=True)
+                entry = series.get(key)
+                if entry is None:
+                    entry = series[key] = _Series()
+                entry.merge(buckets, np.bincount(inverse, minlength=len(buckets)),
+                            np.bincount(inverse, weights=score[rows], minlength=len(buckets)),
+                            np.bincount(inverse, weights=scored[rows], minlength=len(buckets)))
+
+    def change_score(self, speaker_model, test_type, historical, epoch, old_score, new_score):
+        key = (speaker_model, test_type, historical)
+        if old_score == old_score:
+            self._adjust(key, epoch, 0, -old_score, -1)
+        if new_score == new_score:
+            self._adjust(key, epoch, 0, new_score, 1)
+
+    def query(self, granularity, start=None, end=None, speaker_model=None, test_type=None,
+              include_historical=True, group_by=None):
+        """trend_payload of the buckets starting in [start, end) (epoch seconds, None for open)"""
+        if start is not None:
+            start = bucket_start(start, granularity)
+        groups = {}
+        for (model, kind, historical), series in self._series[granularity].items():
+            if ((speaker_model is not None and model != speaker_model) or (test_type is not None and kind != test_type)
+                    or (historical and not include_historical)):
+                continue
+            label = model if group_by == 'speaker_model' else kind if group_by == 'test_type' else None
+            groups.setdefault(label, []).append(series.window(start, end))
+
+        merged = {}
+        for label, windows in groups.items():
+            buckets, inverse = np.unique(np.concatenate([w[0] for w in windows]), return_inverse=True)
+            if len(buckets):
+                merged[label] = (buckets,) + tuple(
+                    np.bincount(inverse, weights=np.concatenate([w[i] for w in windows]), minlength=len(buckets))
+                    for i in (1, 2, 3))
+        return trend_payload(granularity, group_by, merged)
+
+
+def trend_payload(granularity, group_by, groups):
+    """The /analytics/trends payload from {group label: (bucket starts, test counts, score sums, scored counts)}"""
+    series = []
+    for label in sorted(groups, key=lambda label: (label is not None, label)):
+        buckets, counts, sums, scored = groups[label]
+        scored = np.asarray(scored, dtype=np.float64)
+        averages = np.divide(sums, scored, out=np.full(len(scored), np.nan), where=scored > 0)
+        entry = {group_by: label} if group_by else {}
+        entry.update({
+            "buckets": [(EPOCH + datetime.timedelta(seconds=int(b))).isoformat() for b in buckets],
+            "average_score": [None if np.isnan(a) else float(a) for a in averages],
+            "test_count": [int(c) for c in counts]
+        })
+        series.append(entry)
+    return {"granularity": granularity, "group_by": group_by, "series": series}
@@ -0,0 +1,193 @@
+"""Incremental WAV decoding for captures uploaded as a raw request body.
+
+WavStreamParser takes the body in arbitrary byte chunks and returns each
+chunk's complete frames as float64 mono samples, so a capture can be analyzed
+while it is still arriving. Only the bytes of an unfinished chunk header or
+frame are held between calls. analyze_stream reads a file-like stream (e.g.
+Flask's ``request.stream``) in fixed-size blocks and feeds a streaming
+analyzer, such as measurement.SweepDeconvolver, as soon as the format is known.
+float_wav_header goes the other way, for serving raw float32 samples as WAV.
+"""
+import struct
+
+import numpy as np
+
+from measurement import to_float_mono
+from signals import SAMPLE_RATES
+
+# Bytes read from the stream per block
+BLOCK_BYTES = 64 * 1024
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format tag, bits per sample) -> sample dtype; 24-bit PCM is widened to int32
+SAMPLE_TYPES = {
+    (WAVE_FORMAT_PCM, 8): np.dtype('u1'),
+    (WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+    (WAVE_FORMAT_PCM, 24): np.dtype('<i4'),
+    (WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8')
+}
+
+# Streaming encoders that cannot seek back write these as the data chunk size
+UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+
+def float_wav_header(sample_rate, frames, channels=1):
+    """Header of a 32-bit float WAV file holding `frames` frames, to be followed by the raw samples"""
+    data_bytes = frames * channels * 4
+    return (b'RIFF' + struct.pack('<I', 36 + data_bytes) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, WAVE_FORMAT_IEEE_FLOAT, channels, sample_rate,
+                                    sample_rate * channels * 4, channels * 4, 32)
+            + b'data' + struct.pack('<I', data_bytes))
+
+
+class WavStreamParser:
+    """Push-style RIFF/WAVE decoder.
+
+    feed() returns the samples completed by each chunk of bytes; close()
+    checks that the stream did not end in the middle of the data chunk.
+    Chunks other than "fmt " and "data" are skipped. A data chunk of unknown
+    size (0 or 0xFFFFFFFF) is read until the end of the stream.
+    """
+    def __init__(self):
+        self.sample_rate = None
+        self.channels = None
+        self.dtype = None
+        self.samples = 0
+        self._buffer = bytearray()
+        self._state = 'riff'
+        self._chunk_id = None
+        self._remaining = 0  # bytes left in the current chunk, None until EOF
+        self._frame_bytes = None
+        self._bytes_per_sample = None
+
+    def feed(self, data):
+        """Float64 mono samples decoded from `data` (possibly none)"""
+        self._buffer += data
+        blocks = []
+        while True:
+            if self._state == 'riff':
+                if len(self._buffer) < 12:
+                    break
+                if self._buffer[:4] != b'RIFF' or self._buffer[8:12] != b'WAVE':
+                    raise ValueError("Could not read WAV capture: not a RIFF/WAVE stream")
+                del self._buffer[:12]
+                self._state = 'chunk'
+            elif self._state == 'chunk':
+                if len(self._buffer) < 8:
+                    break
+                self._chunk_id = bytes(self._buffer[:4])
+                size = struct.unpack('<I', self._buffer[4:8])[0]
+                del self._buffer[:8]
+                if self._chunk_id == b'data':
+                    if self.sample_rate is None:
+                        raise ValueError("Could not read WAV capture: data chunk before fmt chunk")
+                    self._remaining = None if size in UNKNOWN_SIZES else size
+                    self._state = 'data'
+                else:
+                    # Chunks are padded to an even size
+                    self._remaining = size + (size & 1)
+                    self._state = 'fmt' if self._chunk_id == b'fmt ' else 'skip'
+            elif self._state == 'fmt':
+                if len(self._buffer) < self._remaining:
+                    break
+                self._parse_fmt(bytes(self._buffer[:self._remaining]))
+                del self._buffer[:self._remaining]
+                self._state = 'chunk'
+            elif self._state == 'skip':
+                skipped = min(self._remaining, len(self._buffer))
+                del self._buffer[:skipped]
+                self._remaining -= skipped
+                if self._remaining:
+                    break
+                self._state = 'chunk'
+            elif self._state == 'data':
+                available = len(self._buffer) if self._remaining is None else min(self._remaining, len(self._buffer))
+                usable = available - available % self._frame_bytes
+                if usable:
+                    blocks.append(self._decode(self._buffer[:usable]))
+                    del self._buffer[:usable]
+                    if self._remaining is not None:
+                        self._remaining -= usable
+                if self._remaining == 0:
+                    # Anything after the data chunk (e.g. LIST metadata) is ignored
+                    self._state = 'done'
+                break
+            else:
+                self._buffer.clear()
+                break
+
+        if not blocks:
+            return np.zeros(0)
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+    def close(self):
+        """Check that a complete data chunk was read"""
+        if self._state not in ('data', 'done'):
+            raise ValueError("Could not read WAV capture: no data chunk")
+        if self._state == 'data' and (self._remaining or len(self._buffer)):
+            raise ValueError("Could not read WAV capture: stream ended inside the data chunk")
+        if not self.samples:
+            raise ValueError("Could not read WAV capture: no samples")
+
+    def _parse_fmt(self, chunk):
+        if len(chunk) < 16:
+            raise ValueError("Could not read WAV capture: fmt chunk is too short")
+        tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', chunk[:16])
+        if tag == WAVE_FORMAT_EXTENSIBLE:
+            if len(chunk) < 26:
+                raise ValueError("Could not read WAV capture: extensible fmt chunk is too short")
+            # The sub-format GUID starts with the actual format tag
+            tag = struct.unpack('<H', chunk[24:26])[0]
+        dtype = SAMPLE_TYPES.get((tag, bits))
+        if dtype is None:
+            raise ValueError(f"Could not read WAV capture: unsupported format {tag:#06x} at {bits} bits")
+        if not channels or not sample_rate or block_align != channels * bits // 8:
+            raise ValueError("Could not read WAV capture: inconsistent fmt chunk")
+        if sample_rate not in SAMPLE_RATES:
+            # Analyzers size their buffers from the rate as soon as it is known
+            raise ValueError(f"Could not read WAV capture: unsupported sample rate {sample_rate}")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = dtype
+        self._bytes_per_sample = bits // 8
+        self._frame_bytes = block_align
+
+    def _decode(self, data):
+        if self._bytes_per_sample == 3:
+            # Left-align each 24-bit sample in an int32, like scipy's wavfile.read
+            raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            samples = np.zeros((len(raw), 4), dtype=np.uint8)
+            samples[:, 1:] = raw
+            samples = samples.view('<i4').ravel()
+        else:
+            samples = np.frombuffer(data, dtype=self.dtype)
+        samples = samples.reshape(-1, self.channels)
+        self.samples += len(samples)
+        return to_float_mono(samples)
+
+
+def analyze_stream(stream, make_analyzer, block_bytes=BLOCK_BYTES, sink=None):
+    """Decode a WAV stream block by block into the analyzer make_analyzer(sample_rate); returns analyzer.result().
+
+    sink, if given, is called as sink(sample_rate, samples) with every decoded block too.
+    """
+    parser = WavStreamParser()
+    analyzer = None
+    while True:
+        data = stream.read(block_bytes)
+        if not data:
+            break
+        samples = parser.feed(data)
+        if analyzer is None and parser.sample_rate is not None:
+            analyzer = make_analyzer(parser.sample_rate)
+        if len(samples):
+            analyzer.feed(samples)
+            if sink is not None:
+                sink(parser.sample_rate, samples)
+    parser.close()
+    return analyzer.result()